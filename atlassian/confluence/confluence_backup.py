@@ -1,41 +1,212 @@
 #!/usr/bin/python
 
-'''This script demonstrates how to backup individual pages of a confluence space'''
+'''This script demonstrates how to backup individual pages of a confluence space
+
+Pages are exported concurrently and streamed straight into an uncompressed
+working tarball as each export completes. A manifest alongside it records
+the ID, archive name and checksum of every exported page, and the tarball
+offset after the last one, so an interrupted backup can be re-run and will
+resume where it stopped. Once every page is exported, the working tarball
+is compressed into the final backup.
+'''
 
 from atlassian import Confluence
 import tarfile
-import glob
 import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathvalidate import sanitize_filename
-from requests import HTTPError
+from requests import RequestException
 import boto3
 from botocore.exceptions import ClientError
 
+# Number of pages requested per page of CQL results
+PAGE_LIMIT = 100
 
-def create_tar(tar_file, file_ext):
-    '''Create a tarball for all the exported pages.
-    tar_file: file name of the tarball
-    file_ext: extension of files to include in tar
+# Attempts made to export each page, and the initial delay between them
+RETRIES = 5
+BACKOFF = 2
+
+
+def get_pages(confluence, cql):
+    '''Generator yielding every page matching the CQL query, fetching the
+    results one page at a time.
+    confluence: confluence connection session
+    cql: query to run
     '''
 
-    tar = tarfile.open(tar_file, "w:gz")
-    for f in glob.glob(f'*.{file_ext}'):
-        tar.add(f)
-    tar.close()
-    print(f'Saved tar file {tar_file}')
+    start = 0
+    while True:
+        space_info = confluence.cql(
+            cql,
+            start=start,
+            limit=PAGE_LIMIT,
+            expand='ancestors')
+        results = space_info.get('results', [])
+        yield from results
+        start += len(results)
+        if not results or start >= space_info.get('totalSize', 0):
+            break
 
 
-def save_file(content, filename):
-    '''Write content to a file.
+def export_page(confluence, page_id, export_type):
+    '''Export a page, retrying with exponential backoff on failure.
+    Returns the exported content, or None if every attempt failed.
+    confluence: confluence connection session
+    page_id: ID of the page to export
+    export_type: pdf or doc
+    '''
+
+    if export_type == 'pdf':
+        export = confluence.get_page_as_pdf
+    else:
+        export = confluence.get_page_as_word
+
+    for attempt in range(RETRIES):
+        try:
+            return export(page_id)
+        except RequestException as e:
+            if attempt == RETRIES - 1:
+                print(f'Unable to export page {page_id}: {e}')
+                return None
+            delay = BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f'Export of page {page_id} failed, retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+
+def load_manifest(manifest_file):
+    '''Load the manifest of an interrupted backup, or start a new one.
+    manifest_file: file the manifest is saved to
+    '''
+
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            return json.load(f)
+    return {'offset': 0, 'pages': {}}
+
+
+def save_manifest(manifest, manifest_file):
+    '''Atomically write the manifest, so it is never left half-written.
+    manifest: manifest to save
+    manifest_file: file to write to
+    '''
+
+    with open(f'{manifest_file}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{manifest_file}.tmp', manifest_file)
+
+
+def add_to_tar(tar, content, filename):
+    '''Write content into the tarball as a new member.
+    tar: open tarball
     content: input content
-    filename: file to write to
+    filename: name of the member
     '''
-    f = open(f'{filename}', 'wb')
-    f.write(content)
-    f.close()
+
+    info = tarfile.TarInfo(filename)
+    info.size = len(content)
+    info.mtime = time.time()
+    tar.addfile(info, io.BytesIO(content))
     print(f'Completed saving {filename}')
 
 
+def backup_pages(confluence, pages, export_type, work_tar, manifest_file,
+                 workers):
+    '''Export pages concurrently, adding each to the working tarball as it
+    completes, skipping pages already recorded in the manifest.
+    Returns the number of pages which could not be exported.
+    confluence: confluence connection session
+    pages: iterable of pages to export
+    export_type: pdf or doc
+    work_tar: uncompressed tarball to add pages to
+    manifest_file: manifest of pages already in work_tar
+    workers: number of pages to export concurrently
+    '''
+
+    manifest = load_manifest(manifest_file)
+    if manifest['offset'] and os.path.exists(work_tar):
+        # Discard any partial member written after the last recorded page,
+        # and end the archive there so it can be appended to
+        with open(work_tar, 'r+b') as f:
+            f.truncate(manifest['offset'])
+            f.seek(manifest['offset'])
+            f.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        tar = tarfile.open(work_tar, 'a')
+    else:
+        manifest = {'offset': 0, 'pages': {}}
+        tar = tarfile.open(work_tar, 'w')
+    names = {entry['name'] for entry in manifest['pages'].values()}
+    failed = 0
+
+    def complete(future):
+        nonlocal failed
+        page = pending.pop(future)
+        page_id = page['content']['id']
+        content = future.result()
+        if content is None:
+            failed += 1
+            return
+
+        file_name = sanitize_filename(f"{page['title']}.{export_type}")
+        if file_name in names:
+            file_name = sanitize_filename(
+                f"{page['title']}-{page_id}.{export_type}")
+        names.add(file_name)
+
+        add_to_tar(tar, content, file_name)
+        tar.fileobj.flush()
+        manifest['offset'] = tar.offset
+        manifest['pages'][page_id] = {
+            'name': file_name,
+            'sha256': hashlib.sha256(content).hexdigest()
+        }
+        save_manifest(manifest, manifest_file)
+
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page in pages:
+                page_id = page['content']['id']
+                if page_id in manifest['pages']:
+                    continue
+                print(f"Getting content of {page['title']}")
+                future = executor.submit(
+                    export_page, confluence, page_id, export_type)
+                pending[future] = page
+                # Bound the number of exports held in memory at once
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        complete(future)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    complete(future)
+    finally:
+        tar.close()
+
+    print(f"{len(manifest['pages'])} pages backed up, {failed} failed")
+    return failed
+
+
+def create_tar(tar_file, work_tar):
+    '''Compress the working tarball into the final tarball.
+    tar_file: file name of the tarball
+    work_tar: uncompressed tarball of all the exported pages
+    '''
+
+    with open(work_tar, 'rb') as src, gzip.open(tar_file, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    print(f'Saved tar file {tar_file}')
+
+
 def s3_upload_file(tar_file, bucket):
     '''Upload tarball to s3
     tar_file: Tarball to upload
@@ -46,7 +217,7 @@ def s3_upload_file(tar_file, bucket):
     session = boto3.Session(profile_name='cb-build')
     s3_client = session.client('s3')
     try:
-        response = s3_client.upload_file(file_name, bucket, object_name)
+        response = s3_client.upload_file(tar_file, bucket, object_name)
     except ClientError as e:
         print(e)
         return False
@@ -77,6 +248,16 @@ if __name__ == '__main__':
         type=str,
         default='CR',
         help='Confluence space key')
+    parser.add_argument(
+        '--url',
+        type=str,
+        default='https://hub.internal.couchbase.com/confluence',
+        help='Confluence base URL')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of pages to export concurrently')
     parser.add_argument(
         '--s3', default=True, action=argparse.BooleanOptionalAction)
     args = parser.parse_args()
@@ -88,40 +269,28 @@ if __name__ == '__main__':
 
     bucket_name = 'cr-confluence-backup'
     tar_name = f'confluence_space_{spacekey}_backup_{export_type}.tar.gz'
+    work_tar = f'confluence_space_{spacekey}_backup_{export_type}.tar'
+    manifest_file = f'{work_tar}.manifest.json'
 
     # Establish confluence connection session
     confluence = Confluence(
-        url='https://hub.internal.couchbase.com/confluence',
+        url=args.url,
         username=user_id,
         password=user_pat)
 
     cql = f'space.key="{spacekey}" and type="page"'
-    space_info = confluence.cql(
-        cql,
-        limit=99999,
-        expand='ancestors')
-    total_pages = space_info.get('totalSize')
+    pages = get_pages(confluence, cql)
 
-    for page in space_info.get('results'):
-        file_name = sanitize_filename(f"{page['title']}.{export_type}")
-        print(f'Getting content of {file_name}')
-        if export_type == 'pdf':
-            try:
-                result = confluence.get_page_as_pdf(page['content']['id'])
-            except HTTPError as e:
-                print(f'Unable to download {file_name}')
-                continue
-            else:
-                save_file(result, file_name)
-        if export_type == 'doc':
-            try:
-                result = confluence.get_page_as_word(page['content']['id'])
-            except HTTPError as e:
-                print(f'Unable to download {file_name}')
-                continue
-            else:
-                save_file(result, file_name)
-
-    create_tar(tar_name, export_type)
+    failed = backup_pages(
+        confluence, pages, export_type, work_tar, manifest_file,
+        args.workers)
+
+    create_tar(tar_name, work_tar)
+    if failed:
+        # Keep the working files, so a re-run only retries failed pages
+        print('Some pages could not be exported; re-run to resume')
+    else:
+        os.remove(work_tar)
+        os.remove(manifest_file)
     if args.s3:
         s3_upload_file(tar_name, bucket_name)
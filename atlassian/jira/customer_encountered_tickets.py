@@ -3,6 +3,7 @@ This script updates Jira tickets' Issue_Impact customfield based on association
 It looks for issues of given projects based on issue types and jql.  If the issues have CBSE links,
 this script will set Issue_Impact to "external"
 '''
+import argparse
 import logging
 from jira_issue_manager import JiraIssueManager
 
@@ -85,6 +86,16 @@ def find_tickets_with_linked_cbse(jira_session, project_key, category=None):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Set Issue_Impact to external on issues linked to CBSE')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Show the changes which would be made')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of issues to update concurrently')
+    parser.add_argument('--report',
+                        help='JSON file to write the outcome for each issue to')
+    args = parser.parse_args()
+
     issue_impact_field = f'customfield_{ISSUE_IMPACT_FIELD_ID}'
     set_issue_impact_field_external = {
         issue_impact_field: {
@@ -92,6 +103,7 @@ if __name__ == '__main__':
         }
     }
     session = JiraIssueManager()
+    updates = {}
     for project in STANDALONE_JIRA_PROJECTS:
         logger.info(
             f'Checking {project}...')
@@ -102,7 +114,7 @@ if __name__ == '__main__':
         logger.info(
             f'set issue_impact field to external for {project}: {issues_to_set}')
         for issue in issues_to_set:
-            session.update_issue(issue, set_issue_impact_field_external, notify=False)
+            updates[issue] = set_issue_impact_field_external
     for category in JIRA_CATEGORIES:
         projects = session.get_projects_in_category(category)
         for project in projects:
@@ -116,4 +128,14 @@ if __name__ == '__main__':
             logger.info(
                 f'set issue_impact field to external for {project}: {issues_to_set}')
             for issue in issues_to_set:
-                session.update_issue(issue, set_issue_impact_field_external, notify=False)
+                updates[issue] = set_issue_impact_field_external
+
+    report = session.bulk_update_issues(
+        updates,
+        notify=False,
+        dry_run=args.dry_run,
+        workers=args.workers,
+        report_file=args.report
+    )
+    if any(result['status'] == 'failed' for result in report.values()):
+        exit(1)
@@ -1,6 +1,9 @@
 import json
 import logging
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import requests
 from requests.auth import HTTPBasicAuth
@@ -12,6 +15,14 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Number of times a rate limited request is retried, and the delay used
+# when Jira does not send a Retry-After header
+MAX_RETRIES = 5
+DEFAULT_RETRY_AFTER = 5
+
+# Number of issue keys per "key in (...)" query
+KEY_BATCH_SIZE = 100
+
 
 class JiraIssueManager:
     def __init__(self):
@@ -29,6 +40,27 @@ class JiraIssueManager:
 
         self.api_url = f"{self.cloud_jira_creds['url']}/rest/api/3"
 
+        # When rate limited, all requests are held until this time
+        self._resume_at = 0
+        self._rate_limit_lock = threading.Lock()
+
+    def _wait_for_rate_limit(self):
+        '''Sleep until any rate limit reported by Jira has passed.'''
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _rate_limited(self, response, attempt):
+        '''Hold all requests for as long as the Retry-After header of a
+        rate limited response asks, returning the delay.'''
+        try:
+            delay = float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            delay = DEFAULT_RETRY_AFTER * 2 ** attempt
+        with self._rate_limit_lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        return delay
+
     def _make_api_request(self, method, endpoint, data=None):
         '''Helper function to make API requests.'''
         url = f"{self.api_url}/{endpoint}"
@@ -40,17 +72,25 @@ class JiraIssueManager:
             "Content-Type": "application/json"
         }
 
-        response = requests.request(
-            method,
-            url,
-            headers=headers,
-            auth=auth,
-            data=json.dumps(data) if data else None
-        )
+        for attempt in range(MAX_RETRIES + 1):
+            self._wait_for_rate_limit()
+            response = requests.request(
+                method,
+                url,
+                headers=headers,
+                auth=auth,
+                data=json.dumps(data) if data else None
+            )
+            if response.status_code not in (429, 503) or attempt == MAX_RETRIES:
+                break
+            delay = self._rate_limited(response, attempt)
+            logging.warning(
+                f'Rate limited on {method} {endpoint}, retrying in {delay}s')
 
         return response
 
-    def search_jira_issues(self, search_str, batch_size=100):
+    def search_jira_issues(self, search_str, batch_size=100,
+                           fields='key,versions,issuelinks'):
         """Helper function to handle paginated Jira searches"""
         issues = []
         nextPageToken = None
@@ -58,7 +98,7 @@ class JiraIssueManager:
             batch = self.client.enhanced_search_issues(
                 search_str,
                 maxResults=batch_size,
-                fields='key,versions,issuelinks',
+                fields=fields,
                 json_result=True,
                 nextPageToken=nextPageToken
             )
@@ -73,6 +113,96 @@ class JiraIssueManager:
         logging.info(f'Updating issue {issue_key} with fields {issue_fields}')
         self.client.issue(issue_key).update(fields=issue_fields, notify=notify)
 
+    def get_issue_fields(self, issue_keys, field_names):
+        '''Get the current values of the given fields of many issues.'''
+        issue_keys = sorted(issue_keys)
+        current = {}
+        for i in range(0, len(issue_keys), KEY_BATCH_SIZE):
+            batch = issue_keys[i:i + KEY_BATCH_SIZE]
+            issues = self.search_jira_issues(
+                f'key in ({", ".join(batch)})',
+                fields=','.join(field_names))
+            for issue in issues:
+                current[issue['key']] = issue['fields']
+        return current
+
+    def _put_issue_fields(self, issue_key, issue_fields, notify):
+        '''Update one issue's fields with a single request, returning its
+        report entry.'''
+        try:
+            response = self._make_api_request(
+                "PUT",
+                f"issue/{issue_key}?notifyUsers={str(notify).lower()}",
+                {"fields": issue_fields})
+        except requests.RequestException as e:
+            return {'status': 'failed', 'error': str(e)}
+        if not response.ok:
+            return {
+                'status': 'failed',
+                'error': f'{response.status_code}: {response.text}'
+            }
+        return {'status': 'updated'}
+
+    def bulk_update_issues(self, updates, notify=True, dry_run=False,
+                           workers=8, report_file=None):
+        '''Update the fields of many issues concurrently.
+
+        updates maps issue keys to the fields to set on them. Issues given
+        identical edits are grouped, so each distinct edit is logged once,
+        and in a dry run is diffed against the current values of its issues
+        instead of being applied. Requests are shared between a pool of
+        workers, all of which back off when Jira reports a rate limit.
+
+        Returns a report of each issue's outcome, also written to
+        report_file as JSON if given.'''
+        edits = {}
+        for issue_key, issue_fields in updates.items():
+            edit = json.dumps(issue_fields, sort_keys=True)
+            edits.setdefault(edit, []).append(issue_key)
+
+        report = {}
+        if dry_run:
+            for edit, issue_keys in edits.items():
+                issue_fields = json.loads(edit)
+                logging.info(
+                    f'Would update {len(issue_keys)} issues with fields '
+                    f'{issue_fields}')
+                current = self.get_issue_fields(issue_keys, issue_fields)
+                for issue_key in sorted(issue_keys):
+                    for field, value in issue_fields.items():
+                        old = current.get(issue_key, {}).get(field)
+                        logging.info(f'  {issue_key} {field}: {old} -> {value}')
+                    report[issue_key] = {
+                        'status': 'dry-run', 'fields': issue_fields}
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {}
+                for edit, issue_keys in edits.items():
+                    issue_fields = json.loads(edit)
+                    logging.info(
+                        f'Updating {len(issue_keys)} issues with fields '
+                        f'{issue_fields}')
+                    for issue_key in issue_keys:
+                        futures[issue_key] = executor.submit(
+                            self._put_issue_fields,
+                            issue_key, issue_fields, notify)
+                for issue_key, future in futures.items():
+                    report[issue_key] = {
+                        **future.result(), 'fields': updates[issue_key]}
+                    if report[issue_key]['status'] == 'failed':
+                        logging.error(
+                            f'Failed to update {issue_key}: '
+                            f'{report[issue_key]["error"]}')
+
+        failed = sum(1 for r in report.values() if r['status'] == 'failed')
+        logging.info(
+            f'{len(report) - failed} of {len(report)} issues succeeded, '
+            f'{failed} failed')
+        if report_file:
+            with open(report_file, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+
     def get_projects_in_category(self, category_name):
         '''Get all projects in a specific category.'''
         all_projects = []
@@ -14,12 +14,14 @@ import os
 import re
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from packaging.version import Version, InvalidVersion
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BUILD_TOOLS_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, "..", "..", ".."))
 BLACKDUCK_DIR = os.path.abspath(os.path.join(BUILD_TOOLS_DIR, "blackduck"))
 WORK_DIR = os.path.join(SCRIPT_DIR, "build")
+CACHE_DIR = os.path.join(WORK_DIR, "cache")
 BUILD_TOOLS_REPO = git.Repo(BUILD_TOOLS_DIR)
 
 ignorelist = [
@@ -95,6 +97,75 @@ def clone_repo(repo):
     return repo
 
 
+def list_remote_refs(repo):
+    """
+    Query a repository's HEAD and tags with git ls-remote, without fetching
+    anything
+
+    Parameters:
+    repo (str): Repository being checked
+
+    Returns:
+    tuple: Name of the main branch, and dict of ref name to object sha
+    """
+    output = git.cmd.Git().ls_remote(
+        "--symref", f"git@github.com:{repo}", "HEAD", "refs/tags/*")
+    main_branch = None
+    refs = {}
+    for line in output.splitlines():
+        if line.startswith("ref: "):
+            # "ref: refs/heads/<branch>\tHEAD"
+            main_branch = line[5:].split("\t")[0][len("refs/heads/"):]
+            continue
+        sha, ref = line.split("\t")
+        # Peeled annotated tags only duplicate the tag they belong to
+        if not ref.endswith("^{}"):
+            refs[ref] = sha
+    return main_branch, refs
+
+
+def fetch_repo(repo):
+    """
+    Bring a bare, blobless cache of a repository up to date with its main
+    branch and tags. The cache persists between runs, and nothing is
+    fetched if its refs already match the remote's.
+
+    Parameters:
+    repo (str): Repository being fetched
+
+    Returns:
+    git.repo.base.Repo: Repo object for the cached repository
+    """
+    url = f"git@github.com:{repo}"
+    cache_path = os.path.join(CACHE_DIR, f"{repo.split('/')[-1]}.git")
+    main_branch, remote_refs = list_remote_refs(repo)
+
+    if not os.path.isdir(cache_path):
+        logging.debug(f"Creating blobless cache of {repo}")
+        return git.Repo.clone_from(
+            url, cache_path, bare=True, multi_options=["--filter=blob:none"])
+
+    cached = git.Repo(cache_path)
+    local_refs = {
+        ref.path: ref.object.hexsha for ref in cached.tags
+    }
+    remote_head = remote_refs.pop("HEAD")
+    if (local_refs == remote_refs and
+            cached.head.reference.name == main_branch and
+            cached.head.commit.hexsha == remote_head):
+        logging.debug(f"Cache of {repo} is up to date")
+        return cached
+
+    logging.debug(f"Fetching {repo} into cache")
+    # Fetch from "origin" so the clone's blob:none filter applies
+    cached.git.fetch(
+        "--prune", "origin",
+        f"+refs/heads/{main_branch}:refs/heads/{main_branch}",
+        "+refs/tags/*:refs/tags/*")
+    cached.git.symbolic_ref("HEAD", f"refs/heads/{main_branch}")
+    return cached
+
+
 def get_main_branch(repo):
     """
     Get the main branch of a repository
@@ -258,13 +329,16 @@ def get_latest_timestamp(versions, tags):
         return current_time
 
 
-def update_scan_config(product_dir):
+def get_product_repo(product_dir):
     """
-    Ensure a given scan-config.json is up to date with all monitored tags
-    from its repo
+    Get the repository a product's scans are of
 
     Parameters:
     product_dir (str): The directory the scan-config.json lives in
+
+    Returns:
+    str: org/repo from the product's get_source.sh, or None if the product
+    doesn't have both a scan-config.json and get_source.sh
     """
     scan_config_path = os.path.join(
         BLACKDUCK_DIR, product_dir, "scan-config.json")
@@ -272,85 +346,127 @@ def update_scan_config(product_dir):
         BLACKDUCK_DIR, product_dir, "get_source.sh")
 
     if os.path.isfile(scan_config_path) and os.path.isfile(get_source_path):
-        logging.info(f"Checking {product_dir}")
-
-        scan_config = load_json_file(scan_config_path)
-        repo_name = get_repo_from_script(get_source_path)
-        repo = clone_repo(repo_name)
-        repo_tags = get_tags(repo)
-        main_branch = get_main_branch(repo)
-        latest_timestamp = get_latest_timestamp(
-            scan_config['versions'], repo_tags)
-
-        logging.debug(f"Latest timestamp for {product_dir}: {latest_timestamp}")
-
-        repo_tags[main_branch] = {
-            'commit': repo.head.commit.hexsha,
-            'timestamp': repo.head.commit.committed_date,
-            'main': True,
-        }
+        return get_repo_from_script(get_source_path)
+    return None
+
 
-        tag_prefix = tag_prefixes.get(product_dir, "")
+def read_repo(repo_name, full_clone=False):
+    """
+    Bring a repository up to date and read its main branch and tags. This
+    is the only place the repository's git.Repo is used, as products
+    sharing a repository are checked concurrently and GitPython's object
+    reads aren't thread safe.
 
-        logging.debug(f"Available tags for {product_dir}: {list(repo_tags.keys())}")
+    Parameters:
+    repo_name (str): org/repo being read
+    full_clone (bool): Make a fresh full clone instead of using the cache
+
+    Returns:
+    tuple: Name of the main branch, dict of tags from get_tags, and the
+    commit + timestamp of the head of the main branch
+    """
+    repo = clone_repo(repo_name) if full_clone else fetch_repo(repo_name)
+    head = {
+        'commit': repo.head.commit.hexsha,
+        'timestamp': repo.head.commit.committed_date,
+    }
+    return get_main_branch(repo), get_tags(repo), head
 
-        # We walk through repo tags in chronological order since we're
-        # comparing them to existing tags, and removing  previous version
-        # with the same major.minor as the one we're adding
-        for tag in sort_dict(repo_tags, reverse=False):
-            # We're only interested in main, master, and tags which begin
-            # with a version string (prefixed by the tag prefix for that
-            # project if applicable)
-            if not re.match(rf'^(main|master|{tag_prefix}\d+(\.\d+)*)$', tag):
+
+def update_scan_config(product_dir, main_branch, tags, head):
+    """
+    Ensure a given scan-config.json is up to date with all monitored tags
+    from its repo
+
+    Parameters:
+    product_dir (str): The directory the scan-config.json lives in
+    main_branch (str): Name of the repository's main branch
+    tags (dict): The repository's tags, from get_tags
+    head (dict): Commit + timestamp of the head of the main branch
+
+    Returns:
+    str: Path to the scan-config.json
+    """
+    scan_config_path = os.path.join(
+        BLACKDUCK_DIR, product_dir, "scan-config.json")
+
+    logging.info(f"Checking {product_dir}")
+
+    scan_config = load_json_file(scan_config_path)
+    # Products sharing a repository share its tags, so don't modify them
+    repo_tags = dict(tags)
+    latest_timestamp = get_latest_timestamp(
+        scan_config['versions'], repo_tags)
+
+    logging.debug(f"Latest timestamp for {product_dir}: {latest_timestamp}")
+
+    repo_tags[main_branch] = dict(head, main=True)
+
+    tag_prefix = tag_prefixes.get(product_dir, "")
+
+    logging.debug(f"Available tags for {product_dir}: {list(repo_tags.keys())}")
+
+    # We walk through repo tags in chronological order since we're
+    # comparing them to existing tags, and removing  previous version
+    # with the same major.minor as the one we're adding
+    for tag in sort_dict(repo_tags, reverse=False):
+        # We're only interested in main, master, and tags which begin
+        # with a version string (prefixed by the tag prefix for that
+        # project if applicable)
+        if not re.match(rf'^(main|master|{tag_prefix}\d+(\.\d+)*)$', tag):
+            continue
+        else:
+            if tag == main_branch:
+                stripped_tag = tag
+            else:
+                stripped_tag = tag[len(tag_prefix):]
+
+        if stripped_tag not in scan_config['versions']:
+            # For main branch, check if there's already a version with release=master/main
+            if tag == main_branch and has_master_release(scan_config['versions'], main_branch):
+                logging.debug(f"* Skipping {stripped_tag} - already have version with release={main_branch}")
                 continue
+
+            tag_timestamp = repo_tags[tag]['timestamp']
+            logging.debug(f"* Evaluating tag {stripped_tag}: timestamp={tag_timestamp}, latest_timestamp={latest_timestamp}, newer={tag_timestamp >= latest_timestamp}")
+
+            if tag_timestamp >= latest_timestamp or tag == main_branch:
+
+                # Adding a newer version than the most recent in
+                # scan-config.json, so we need to remove any previous
+                # versions with the same major.minor series
+                logging.info(f"* Adding {stripped_tag}")
+                superceded_versions = []
+                for k in scan_config['versions']:
+                    # Skip versions that have a "release" field (these point to branches)
+                    if isinstance(scan_config['versions'][k], dict) and 'release' in scan_config['versions'][k]:
+                        continue
+
+                    if are_same_major_minor(k, stripped_tag):
+                        logging.info(f"* Removing {k} (same major.minor as {stripped_tag})")
+                        superceded_versions.append(k)
+                for version in superceded_versions:
+                    scan_config['versions'].pop(version)
+                scan_config['versions'][stripped_tag] = {"interval": 1440}
             else:
-                if tag == main_branch:
-                    stripped_tag = tag
-                else:
-                    stripped_tag = tag[len(tag_prefix):]
-
-            if stripped_tag not in scan_config['versions']:
-                # For main branch, check if there's already a version with release=master/main
-                if tag == main_branch and has_master_release(scan_config['versions'], main_branch):
-                    logging.debug(f"* Skipping {stripped_tag} - already have version with release={main_branch}")
-                    continue
-
-                tag_timestamp = repo_tags[tag]['timestamp']
-                logging.debug(f"* Evaluating tag {stripped_tag}: timestamp={tag_timestamp}, latest_timestamp={latest_timestamp}, newer={tag_timestamp >= latest_timestamp}")
-
-                if tag_timestamp >= latest_timestamp or tag == main_branch:
-
-                    # Adding a newer version than the most recent in
-                    # scan-config.json, so we need to remove any previous
-                    # versions with the same major.minor series
-                    logging.info(f"* Adding {stripped_tag}")
-                    superceded_versions = []
-                    for k in scan_config['versions']:
-                        # Skip versions that have a "release" field (these point to branches)
-                        if isinstance(scan_config['versions'][k], dict) and 'release' in scan_config['versions'][k]:
-                            continue
-
-                        if are_same_major_minor(k, stripped_tag):
-                            logging.info(f"* Removing {k} (same major.minor as {stripped_tag})")
-                            superceded_versions.append(k)
-                    for version in superceded_versions:
-                        scan_config['versions'].pop(version)
-                    scan_config['versions'][stripped_tag] = {"interval": 1440}
-                else:
-                    # Older versions than the most current in scan-config
-                    # are ignored
-                    continue
-
-        scan_config['versions'] = sort_dict(scan_config['versions'])
-        with open(scan_config_path, 'w') as file:
-            file.write(json.dumps(
-                scan_config, indent=4) + os.linesep)
-        BUILD_TOOLS_REPO.git.add(scan_config_path)
+                # Older versions than the most current in scan-config
+                # are ignored
+                continue
+
+    scan_config['versions'] = sort_dict(scan_config['versions'])
+    with open(scan_config_path, 'w') as file:
+        file.write(json.dumps(
+            scan_config, indent=4) + os.linesep)
+    return scan_config_path
 
 
 def main():
     parser = argparse.ArgumentParser(description='Check for new releases and update scan configurations')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--full-clone', action='store_true',
+                        help='Make a fresh full clone of each repo instead of using the ref cache')
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='Number of products to check concurrently')
     args = parser.parse_args()
 
     # Set logging level based on debug flag
@@ -359,13 +475,36 @@ def main():
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
     logging.info("Checking for new releases...")
+    product_dirs = []
     for product_dir in os.listdir(BLACKDUCK_DIR):
         if product_dir in ignorelist:
             logging.debug(f"{product_dir} is on ignore list, skipping")
             continue
         else:
             logging.debug(f"Checking {product_dir}")
-            update_scan_config(product_dir)
+            product_dirs.append(product_dir)
+
+    product_repos = {}
+    for product_dir in product_dirs:
+        repo_name = get_product_repo(product_dir)
+        if repo_name is not None:
+            product_repos[product_dir] = repo_name
+
+    # Several products can share a repository (eg. the JVM SDKs are all in
+    # couchbase-jvm-clients), so bring each repository up to date and read
+    # its refs once before checking the products, rather than having
+    # concurrent checks clone, fetch or read the same repository
+    repo_names = sorted(set(product_repos.values()))
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        repo_refs = dict(zip(repo_names, executor.map(
+            lambda r: read_repo(r, args.full_clone), repo_names)))
+        scan_config_paths = list(executor.map(
+            lambda d: update_scan_config(d, *repo_refs[product_repos[d]]),
+            product_repos))
+
+    # Stage changes serially, as concurrent "git add"s contend for the index lock
+    for scan_config_path in scan_config_paths:
+        BUILD_TOOLS_REPO.git.add(scan_config_path)
 
 
 if __name__ == "__main__":
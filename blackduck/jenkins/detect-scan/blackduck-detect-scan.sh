@@ -192,6 +192,7 @@ echo "Loading product-specific Black Duck manifests"
 uv run --project "${DETECT_SCRIPT_DIR}" --quiet \
   "${DETECT_SCRIPT_DIR}/update-manual-manifest.py" -d \
     --credentials ~/.ssh/blackduck-creds.json \
+    --cache-file ~/blackduck/component-version-cache.json \
     --operation update --src-root "${WORKSPACE}" \
     -p ${PRODUCT} -v ${VERSION}
 
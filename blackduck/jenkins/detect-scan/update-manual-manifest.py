@@ -12,10 +12,12 @@ import re
 import requests
 import shutil
 import sys
+import time
 import yaml
 
 from abc import ABC, abstractmethod
 from bdhelper import BlackDuckClient
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from urllib.parse import urlparse, quote
 
@@ -274,9 +276,13 @@ class UpdateComponents(ManifestWalker):
     #    (lowercased) or, if that doesn't exist, the key of the component
     #    itself.
 
-    def __init__(self, credentials_file, project, version, dryrun):
+    def __init__(
+        self, credentials_file, project, version, dryrun,
+        cache_file=None, workers=8, cache_ttl=24
+    ):
 
         super().__init__(project, version, dryrun)
+        self.workers = workers
 
         logging.info(f"Preparing to update components for {project} {version}")
 
@@ -329,6 +335,28 @@ class UpdateComponents(ManifestWalker):
         # return the canonical version name.
         self.bd_alt_canonical_versions = collections.defaultdict(set)
 
+        # Knowledgebase component-version URLs, keyed by
+        # "<component_id>::<version>", with the time each was looked up.
+        # These may be persisted in cache_file and shared between runs, but
+        # as component IDs can change (see _load_bd_aliases()) entries
+        # older than cache_ttl hours are looked up again, and an entry
+        # Black Duck rejects is dropped; see add_component_version().
+        self.cache_file = cache_file
+        self.comp_version_urls = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, "r") as c:
+                cached = json.load(c)
+            now = time.time()
+            self.comp_version_urls = {
+                key: entry for key, entry in cached.items()
+                if isinstance(entry, dict)
+                and now - entry["time"] < cache_ttl * 3600
+            }
+            logging.debug(
+                f"Loaded {len(self.comp_version_urls)} cached "
+                f"component-version URLs ({len(cached)} before expiry)"
+            )
+
         # Load BD component alias list
         self._load_bd_aliases()
 
@@ -455,8 +483,14 @@ class UpdateComponents(ManifestWalker):
         """
         Looks up a component-version in the Knowledgebase via the BD REST API,
         and returns a component_version_url. Returns None if not found.
+        Found URLs are cached; misses are not, as the version may be added
+        to the Knowledgebase later.
         """
 
+        key = f"{comp_id}::{version}"
+        if key in self.comp_version_urls:
+            return self.comp_version_urls[key]["href"]
+
         component_url = self.comp_base + comp_id
 
         # Sadly the BD search API doesn't like some legit characters like +, but
@@ -470,6 +504,10 @@ class UpdateComponents(ManifestWalker):
         # Ensure one of those found versions is an exact match.
         for ver_entry in versions:
             if ver_entry['versionName'] == version:
+                self.comp_version_urls[key] = {
+                    "href": ver_entry['_meta']['href'],
+                    "time": time.time(),
+                }
                 return ver_entry['_meta']['href']
 
         logging.debug(f"Found no matching version!")
@@ -734,19 +772,15 @@ class UpdateComponents(ManifestWalker):
         return None
 
 
-    def add_component_version(self, comp_name, comp_id, version):
+    def resolve_component_version(self, comp_name, comp_id, version):
         """
-        Adds a component-version to this project-version, which is presumed to
-        not already exist in the BOM. If neither the component-version nor any
-        applicable alt-canonical versions exist in the Knowledgebase, raises an
-        error.
+        Finds the Knowledgebase URL for a component-version which is to be
+        added to this project-version. If neither the component-version nor
+        any applicable alt-canonical versions exist in the Knowledgebase,
+        raises an error.
         """
 
-        logging.info(
-            f"Adding component to Black Duck: {comp_name} ({comp_id}) "
-            f"version {version}")
-
-        # First, try to find the canonical version name or any alt-canonical
+        # Try to find the canonical version name or any alt-canonical
         # version names in the Knowledgebase
         component_version_url = self.find_canonical_component_version(
             comp_name, comp_id, version
@@ -779,20 +813,76 @@ class UpdateComponents(ManifestWalker):
                 f"new canonical ID to the older ID {comp_id}.\n\n\n\n"
             )
 
-        # OK, finally add the component-version to the project-version
-        # (unless dryrun is set).
-        pv_components_url = self.client.list_resources(self.project_version)["components"]
+        return component_version_url
+
+
+    def add_component_version(
+        self, comp_name, comp_id, version, component_version_url
+    ):
+        """
+        Adds a component-version to this project-version, which is presumed to
+        not already exist in the BOM. component_version_url is the
+        Knowledgebase URL returned by resolve_component_version().
+        """
+
+        logging.info(
+            f"Adding component to Black Duck: {comp_name} ({comp_id}) "
+            f"version {version}")
+
+        # Add the component-version to the project-version (unless dryrun
+        # is set).
         if self.dryrun:
             logging.info("DRYRUN: not updating Black Duck")
         else:
             post_data = {'component': component_version_url}
             response = self.client.session.post(
-                pv_components_url, json=post_data
+                self.pv_components_url, json=post_data
             )
+            if not response.ok and self._forget_component_version_url(
+                component_version_url
+            ):
+                # The URL came from the cache and may be stale, so look the
+                # component-version up again and retry with the result
+                logging.warning(
+                    f"Adding {comp_name} version {version} failed with "
+                    f"cached URL {component_version_url}; looking it up again"
+                )
+                retry_url = self.resolve_component_version(
+                    comp_name, comp_id, version
+                )
+                if retry_url != component_version_url:
+                    response = self.client.session.post(
+                        self.pv_components_url, json={'component': retry_url}
+                    )
             response.raise_for_status()
             logging.debug(f"{comp_id} version {version} added successfully")
 
 
+    def _forget_component_version_url(self, component_version_url):
+        """
+        Drops every cache entry for a component-version URL, returning
+        whether there were any
+        """
+
+        stale = [
+            key for key, entry in dict(self.comp_version_urls).items()
+            if entry["href"] == component_version_url
+        ]
+        for key in stale:
+            self.comp_version_urls.pop(key, None)
+        return bool(stale)
+
+
+    def _save_cache(self):
+        """
+        Writes the component-version URL cache to cache_file, if given
+        """
+
+        if self.cache_file is not None:
+            with open(self.cache_file, "w") as c:
+                json.dump(self.comp_version_urls, c, indent=2)
+
+
     def remove_component_version(self, comp_name, comp_id, version):
         """
         Removes a component-version from this project-version
@@ -822,24 +912,23 @@ class UpdateComponents(ManifestWalker):
         sys.exit(1)
 
 
-    def change_component_version_license_approved(self, target, approved):
+    def change_component_license_approved(self, approvals):
         """
-        Sets the 'reviewStatus' of all versions of the component in the project-
-        version to "REVIEWED" / "NOT_REVIEWED" based on the value of "approved".
+        Given a dict of component IDs to True/False, sets the 'reviewStatus'
+        of all versions of those components in the project-version to
+        "REVIEWED" / "NOT_REVIEWED" accordingly.
         """
 
-        # "target" starts with the component_id.
-        (comp_id, _) = target.split('.', maxsplit=1)
-        comp_url = self.comp_base + comp_id
-
-        # Have to re-read the current BOM to get all the entries for this
-        # component. This is expensive; however it should only be executed when
-        # there is an actual change to be made, due to DictDiffer.
+        # Have to re-read the current BOM to get all the entries for these
+        # components, since versions may have been added or removed since it
+        # was first loaded. One snapshot serves every component.
         curr_items = self._get_manual_components()
         for item in curr_items:
-            # Skip any components other than the comp_id we're looking for
-            if item["component"] != comp_url:
+            # Skip any components other than the ones we're looking for
+            comp_id = urlparse(item["component"]).path.rsplit('/', 1)[1]
+            if comp_id not in approvals:
                 continue
+            approved = approvals[comp_id]
             item["reviewStatus"] = "REVIEWED" if approved else "NOT_REVIEWED"
             logging.info(
                 f"Setting {item['componentName']} "
@@ -855,6 +944,18 @@ class UpdateComponents(ManifestWalker):
                 response.raise_for_status()
 
 
+    def _run_concurrently(self, func, jobs):
+        """
+        Calls func(*job) for each job on a bounded thread pool, returning
+        the results in order. Any exception (including sys.exit()) raised
+        by a job is re-raised here.
+        """
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(func, *job) for job in jobs]
+            return [future.result() for future in futures]
+
+
     def done_loading_manifests(self):
         logging.debug(
             f"Final input manifest: {pprint.pformat(self.manifest)}"
@@ -864,26 +965,27 @@ class UpdateComponents(ManifestWalker):
     def perform(self):
         """
         Compute the actions to make self.bom_comp_map look like added manifests,
-        then execute each action
+        then execute them: first resolve every component-version to be added,
+        then apply all additions and removals, and finally update license
+        approvals from a single BOM snapshot.
         """
 
         logging.debug("Computing actions")
         diff = dictdiffer.diff(self.bom_comp_map, self.manifest)
 
-        func_map = {
-            "add": self.add_component_version,
-            "remove": self.remove_component_version
+        plan = {
+            "add": [],
+            "remove": []
         }
-        actions_taken = 0
+        approvals = {}
 
         # dictdiffer gives us a list of diff actions, in a somewhat strange
-        # bespoke format. Here we decode them and invoke the corresponding
-        # actions.
+        # bespoke format. Here we decode them into the plan.
         for (action, target, value) in diff:
             # "change" actions are kinda noisy - we'll log explicit messages
             # for them later if they're applicable
             if action != "change":
-                logging.debug(f"Executing '{action}' '{target}' '{value}'")
+                logging.debug(f"Planning '{action}' '{target}' '{value}'")
 
             if action == "remove" or action == "add":
                 if target == '':
@@ -891,8 +993,9 @@ class UpdateComponents(ManifestWalker):
                     # iteratively add/remove each component-version.
                     for (comp_id, data) in value:
                         for version in data["versions"]:
-                            func_map[action](data["bd-name"], comp_id, version)
-                            actions_taken += 1
+                            plan[action].append(
+                                (data["bd-name"], comp_id, version)
+                            )
                 else:
                     # Adding or removing versions from an existing component
                     (comp_id, field) = target.split('.', maxsplit=1)
@@ -912,8 +1015,7 @@ class UpdateComponents(ManifestWalker):
                     # sure why). The second element will be the set of
                     # versions to add/remove.
                     for version in value[0][1]:
-                        func_map[action](comp_name, comp_id, version)
-                        actions_taken += 1
+                        plan[action].append((comp_name, comp_id, version))
 
             elif action == "change":
                 if target.endswith(".bd-name"):
@@ -931,10 +1033,9 @@ class UpdateComponents(ManifestWalker):
                         # Black Duck.
                         logging.log(5, f"Ignoring 'None' change to license-approved")
                     else:
-                        self.change_component_version_license_approved(
-                            target, value[1]
-                        )
-                        actions_taken +=1
+                        # "target" starts with the component_id.
+                        (comp_id, _) = target.split('.', maxsplit=1)
+                        approvals[comp_id] = value[1]
                 else:
                     logging.fatal(f"Unknown change field {target}!")
 
@@ -942,6 +1043,32 @@ class UpdateComponents(ManifestWalker):
                 logging.fatal(f"Unknown dictdiffer action {action}!")
                 sys.exit(6)
 
+        # Resolve every component-version URL before changing anything, so
+        # a missing component-version aborts without a half-updated BOM
+        logging.info(
+            f"Resolving {len(plan['add'])} component-versions in Knowledgebase"
+        )
+        urls = self._run_concurrently(
+            self.resolve_component_version, plan["add"]
+        )
+        self._save_cache()
+
+        self.pv_components_url = self.client.list_resources(
+            self.project_version
+        )["components"]
+        try:
+            self._run_concurrently(
+                self.add_component_version,
+                [add + (url,) for (add, url) in zip(plan["add"], urls)]
+            )
+        finally:
+            # Save any stale URLs dropped and looked up again
+            self._save_cache()
+        self._run_concurrently(self.remove_component_version, plan["remove"])
+        if approvals:
+            self.change_component_license_approved(approvals)
+
+        actions_taken = len(plan["add"]) + len(plan["remove"]) + len(approvals)
         if actions_taken == 0:
             logging.info("Current components match manifest - no updates needed!")
         else:
@@ -967,6 +1094,12 @@ if __name__ == "__main__":
         help="Whether to prune source dirs or update Black Duck")
     parser.add_argument('-n', '--dryrun', action='store_true',
         help="Dry run - don't update Black Duck, just report actions")
+    parser.add_argument('--cache-file', type=str,
+        help="JSON file caching Knowledgebase component-version URLs")
+    parser.add_argument('--cache-ttl', type=float, default=24,
+        help="Hours before a cached component-version URL is looked up again")
+    parser.add_argument('-j', '--workers', type=int, default=8,
+        help="Number of concurrent Black Duck requests")
     args = parser.parse_args()
 
     if args.debug:
@@ -994,7 +1127,10 @@ if __name__ == "__main__":
             args.credentials,
             args.project,
             args.version,
-            args.dryrun
+            args.dryrun,
+            args.cache_file,
+            args.workers,
+            args.cache_ttl
         )
 
     actor.set_source_root(src_root)
@@ -4,12 +4,16 @@ import argparse
 import json
 import logging
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import time
 import zipfile
 import pandas as pd
 
 from blackduck import Client
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 logger = logging.getLogger('blackduck/download-reports')
@@ -19,6 +23,13 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 ch = logging.StreamHandler()
 logger.addHandler(ch)
 
+# Chunk size used when streaming downloads to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Downloads smaller than this are buffered in memory rather than on disk
+# before being added to the .bdio zip
+SPOOL_SIZE = 16 * 1024 * 1024
+
 
 def get_api_link(bd_object, link_type):
     if '_meta' in bd_object and 'links' in bd_object['_meta']:
@@ -32,7 +43,8 @@ class FailedDownload(Exception):
 
 
 class ReportsDownloader:
-    def __init__(self, product, version, bld_num, cred_file, output_dir):
+    def __init__(self, product, version, bld_num, cred_file, output_dir,
+                 workers=8, report_timeout=1200):
         """
         Connects to Hub and initializes Project and Version
         """
@@ -41,7 +53,8 @@ class ReportsDownloader:
         self.version_name = version
         self.prefix = f"{product}-{version}-{bld_num}"
         self.output_dir = Path(output_dir).resolve()
-        self.tmp_zip = self.output_dir / "tmp.zip"
+        self.workers = workers
+        self.report_timeout = report_timeout
 
         # Connect to Black Duck
         creds = json.load(cred_file)
@@ -62,30 +75,40 @@ class ReportsDownloader:
     def download_report(self, report_name, location):
         """
         Waits for a specified report to be available, then downloads all
-        contents to the specified directory
+        contents to the specified directory. Polling backs off exponentially
+        until report_timeout seconds have passed.
         """
 
         report_id = location.split("/")[-1]
+        tmp_zip = self.output_dir / f"tmp-{report_id}.zip"
         logger.info(f"Downloading {report_name}")
         logger.debug(f"Report ID is {report_id}")
-        retries = 200
-        while retries > 0:
-            response = self.client.session.get(f"/api/reports/{report_id}")
-            if response.status_code != 200:
-                logger.debug(f"Report not ready yet, retrying #{retries}")
-                time.sleep(6)
-                retries -= 1
-                continue
-            logger.debug(f"Writing {report_name} to {self.tmp_zip}")
-            with self.tmp_zip.open("wb") as f:
-                f.write(response.content)
-            self.unpack_report(report_name)
-            return
-
-        raise Exception(f"Failed to retrieve {report_name} {report_id} after many retries!")
-
-
-    def unpack_report(self, report_name):
+        deadline = time.monotonic() + self.report_timeout
+        delay = 2
+        while True:
+            with self.client.session.get(
+                f"/api/reports/{report_id}", stream=True
+            ) as response:
+                if response.status_code == 200:
+                    logger.debug(f"Writing {report_name} to {tmp_zip}")
+                    with tmp_zip.open("wb") as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise FailedDownload(
+                    f"Failed to retrieve {report_name} {report_id} "
+                    f"after {self.report_timeout} seconds!"
+                )
+            logger.debug(f"{report_name} not ready yet, retrying in {delay}s")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 60)
+
+        self.unpack_report(report_name, tmp_zip)
+
+
+    def unpack_report(self, report_name, tmp_zip):
         """
         Unpacks the temp downloaded .zip from Hub, stripping the report
         identifier from the filename
@@ -95,7 +118,7 @@ class ReportsDownloader:
         # care about), and have a filename like "goodpart_YYYY-MM-DD_RANDOM.ext".
         # Break this apart and rename to "PRODUCT-VERSION-BLD_NUM-goodpart.ext"
         logger.info(f"Extracting {report_name}")
-        with zipfile.ZipFile(self.tmp_zip) as z:
+        with zipfile.ZipFile(tmp_zip) as z:
             for entry in z.infolist():
                 if entry.is_dir():
                     continue
@@ -109,9 +132,9 @@ class ReportsDownloader:
                 logger.debug(f"Writing {out_file}")
                 with out_file.open("wb") as out:
                     with z.open(entry) as content:
-                        out.write(content.read())
+                        shutil.copyfileobj(content, out, CHUNK_SIZE)
 
-        self.tmp_zip.unlink()
+        tmp_zip.unlink()
 
 
     def start_reports(self):
@@ -164,6 +187,30 @@ class ReportsDownloader:
         logger.debug(f"Notices location is {self.notices_location}")
 
 
+    def download_scan(self, codelocation, z, zip_lock):
+        """
+        Streams a single codelocation's .bdio file into the open zip z
+        """
+
+        bdio_link = get_api_link(codelocation, 'scan-data')
+        arcname = bdio_link.split("/")[-1]
+        # Only one entry of a ZipFile may be written at a time, so stream
+        # the download into a spooled buffer and copy it into the zip under
+        # the lock; the network transfers themselves still run concurrently.
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=self.output_dir) as buf:
+            with self.client.session.get(
+                bdio_link, allow_redirects=True, stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise FailedDownload(f"Failed to download {bdio_link}")
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    buf.write(chunk)
+            buf.seek(0)
+            with zip_lock:
+                with z.open(arcname, "w", force_zip64=True) as out:
+                    shutil.copyfileobj(buf, out, CHUNK_SIZE)
+
+
     def download_scans(self):
         """
         Downloads all scan .bdio files for product-version, and collects them
@@ -173,36 +220,42 @@ class ReportsDownloader:
         logger.info(f"Downloading .bdio scans")
 
         codelocations = self.client.get_resource('codelocations', self.version)
-        bdio_scan_count = 0
         logger.debug(f"Creating {self.prefix}-bdio.zip")
-        with zipfile.ZipFile(self.output_dir / f"{self.prefix}-bdio.zip", "w") as z:
-            for codelocation in codelocations:
-                bdio_link = get_api_link(codelocation, 'scan-data')
-                bdio_file = Path(os.path.join(self.output_dir, bdio_link.split("/")[-1]))
-                response = self.client.session.get(bdio_link, allow_redirects=True)
-                if response.status_code == 200:
-                    open(bdio_file, 'wb').write(response.content)
-                    z.write(bdio_file, arcname=bdio_file.name)
-                    bdio_file.unlink()
-                    bdio_scan_count += 1
-                else:
-                    logger.error("Failed to download {bdio_link}")
-                    sys.exit(1)
+        zip_lock = threading.Lock()
+        with zipfile.ZipFile(
+            self.output_dir / f"{self.prefix}-bdio.zip", "w"
+        ) as z, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.download_scan, codelocation, z, zip_lock)
+                for codelocation in codelocations
+            ]
+            for future in futures:
+                future.result()
 
-        logger.info(f"Downloaded {bdio_scan_count} scans")
+        logger.info(f"Downloaded {len(futures)} scans")
 
 
     def download(self):
         """
-        Invokes each of the download steps in turn, and waits for completion
+        Invokes each of the download steps concurrently, and waits for
+        completion
         """
 
         self.start_reports()
         self.start_notices()
 
-        self.download_scans()
-        self.download_report("CSV reports", self.reports_location)
-        self.download_report("Notices file", self.notices_location)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(self.download_scans),
+                executor.submit(
+                    self.download_report, "CSV reports", self.reports_location
+                ),
+                executor.submit(
+                    self.download_report, "Notices file", self.notices_location
+                ),
+            ]
+            for future in futures:
+                future.result()
 
 
     def filter_columns_in_csv(self):
@@ -246,6 +299,10 @@ if __name__ == "__main__":
                         help='Path to Black Duck server credentials JSON file')
     parser.add_argument('--output-dir', required=True,
                         help='Output path to directory for scans and reports')
+    parser.add_argument('-j', '--workers', type=int, default=8,
+                        help='Number of .bdio scans to download concurrently')
+    parser.add_argument('--report-timeout', type=int, default=1200,
+                        help='Seconds to wait for each report to be generated')
 
     args = parser.parse_args()
 
@@ -256,7 +313,9 @@ if __name__ == "__main__":
     downloader = ReportsDownloader(
         args.product, args.version, args.bld_num,
         args.credentials,
-        args.output_dir
+        args.output_dir,
+        args.workers,
+        args.report_timeout
     )
     downloader.download()
     downloader.filter_columns_in_csv()
@@ -7,6 +7,7 @@ from collections import defaultdict
 from pathlib import Path
 from itertools import groupby
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from blackduck import Client
 import constants
 
@@ -18,9 +19,11 @@ logging.basicConfig(
 
 
 class BlackduckClient:
-    def __init__(self):
+    def __init__(self, cve_cache=None):
         '''
         Initiate Black Duck connection.
+        cve_cache is an optional path to a JSON file used to persist CVE
+        details between runs.
         '''
         creds_file = Path.home() / '.ssh/blackduck-creds.json'
         if creds_file.exists():
@@ -38,6 +41,16 @@ class BlackduckClient:
             timeout=30.0,
             retries=5
         )
+        # Size the connection pool so concurrent CVE lookups can share the
+        # session without discarding connections
+        self.hub_client.session.get_adapter(self.base_url).init_poolmanager(
+            constants.CVE_FETCH_WORKERS, constants.CVE_FETCH_WORKERS)
+
+        self.cve_cache_file = Path(cve_cache) if cve_cache else None
+        self.cve_cache = {}
+        if self.cve_cache_file and self.cve_cache_file.exists():
+            with open(self.cve_cache_file) as f:
+                self.cve_cache = json.load(f)
 
     def _get_resource_by_name(self, key, resource_type,
                               resource_name, parent=None):
@@ -187,25 +200,76 @@ class BlackduckClient:
         vulns.extend(items)
         return vulns
 
+    def _fetch_cve_detail(self, cve_name):
+        '''Retrieve severity, update date and NIST link for a single CVE'''
+        url = f"{self.base_url}/api/vulnerabilities/{cve_name}"
+        cve_detail = self.hub_client.get_json(url)
+        cve_link = next(
+            (x['href'] for x in cve_detail['_meta']['links'] if x['rel'] == 'nist'), '')
+        return {
+            'severity': cve_detail.get('severity'),
+            'updatedDate': cve_detail['updatedDate'],
+            'nist': cve_link
+        }
+
+    def get_cve_details(self, cves):
+        '''
+        Retrieve details for a dict of {cve_name: updatedDate}.
+        Each CVE is only requested once, and cached details are reused as
+        long as their updatedDate matches the one reported in the BOM.
+        Missing details are fetched concurrently.
+        '''
+        details = {}
+        to_fetch = []
+        for cve_name, updated_date in cves.items():
+            cached = self.cve_cache.get(cve_name)
+            if (cached and updated_date and
+                    cached['updatedDate'] == updated_date):
+                details[cve_name] = cached
+            else:
+                to_fetch.append(cve_name)
+
+        logging.info(f'Fetching details for {len(to_fetch)} CVEs '
+                     f'({len(details)} cached)')
+        with ThreadPoolExecutor(
+                max_workers=constants.CVE_FETCH_WORKERS) as executor:
+            fetched = executor.map(self._fetch_cve_detail, to_fetch)
+            for cve_name, detail in zip(to_fetch, fetched):
+                details[cve_name] = detail
+                self.cve_cache[cve_name] = detail
+
+        if self.cve_cache_file and to_fetch:
+            with open(self.cve_cache_file, 'w') as f:
+                json.dump(self.cve_cache, f)
+
+        return details
+
     def prepare_vulnerability_entries(self, version):
         '''Prepare vulnerability entries for reporting.'''
         component_files = self.get_bom_files(version)
         entries = self.get_bom_vulns(version)
 
-        cve_list = []
+        # The same CVE is usually reported against many component versions,
+        # so collect the unique ones before querying their details
+        cves = {}
         for entry in entries:
             cve_name = entry['vulnerability']['vulnerabilityId']
             # Skip if CVE is in the exclusion list
             if cve_name in constants.EXCLUDED_CVE_LIST:
                 logging.info(f"CVE {cve_name} is on the excluded list")
                 continue
-            url = f"{self.base_url}/api/vulnerabilities/{cve_name}"
-            cve_detail = self.hub_client.get_json(url)
-            cve_link = next(
-                (x['href'] for x in cve_detail['_meta']['links'] if x['rel'] == 'nist'), '')
+            cves[cve_name] = entry['vulnerability'].get('updatedDate')
+        cve_details = self.get_cve_details(cves)
+
+        cve_list = []
+        for entry in entries:
+            cve_name = entry['vulnerability']['vulnerabilityId']
+            if cve_name not in cve_details:
+                continue
+            cve_detail = cve_details[cve_name]
 
             # Skip entries with null severity
-            severity = cve_detail.get('severity')
+            severity = cve_detail['severity']
             if severity is None:
                 logging.warning(f"CVE {cve_name} has null severity, skipping this entry")
                 continue
@@ -216,7 +280,7 @@ class BlackduckClient:
                 'cve_name': cve_name,
                 'severity': severity,
                 'updatedDate': cve_detail['updatedDate'],
-                'nist': cve_link
+                'nist': cve_detail['nist']
             })
 
         return self.group_vulnerability_entries(cve_list, component_files)
@@ -229,41 +293,68 @@ class BlackduckClient:
         result = self.hub_client.get_json(url, headers=headers)
         return result
 
-    def get_version_journal(self, version, start_date):
-        '''Retrieve journal entries from blackduck_hub updates for a project version.
-           These are associated with blackduck_system user.
-           We are only interested in these events:
-           * Vulnerability Found:
-                 New CVE found
-           * Component Deleted:
-                 Component is renamed.  It is usually followed by
-                 "Component Added" and "Vulnerability Found".  We will close the
-                 old issue and open a new one using the new name.
-        '''
+    def _journal_url(self, version, start_date):
+        '''Build the URL of the blackduck_system journal for a project version'''
         date_string = start_date.isoformat()
         encoded_date_string = urllib.parse.quote(date_string)
-
-        cve_entries, removed_entries = [], []
         url_base = version['_meta']['href'].replace(
             'api', 'api/journal')
-        url = (
+        return (
             f"{url_base}?sort=timestamp%20DESC"
             f"&filter=journalTriggerNames%3Ablackduck_system"
             f"&filter=journalDate%3A%3E%3D{encoded_date_string}"
             f"&filter=journalAction%3Avulnerability_detected"
             f"&filter=journalAction%3Acomponent_deleted"
-            f"&limit=1000"
         )
+
+    def _fetch_journal(self, version, start_date, page_size=1000):
+        '''Helper function to fetch every page of a version journal'''
+        url = self._journal_url(version, start_date)
         headers = {
             'Accept': 'application/vnd.blackducksoftware.journal-4+json'}
-        activities = self.hub_client.get_json(url, headers=headers)
+        journal_entries = []
+        offset = 0
+        while True:
+            activities = self.hub_client.get_json(
+                f"{url}&limit={page_size}&offset={offset}", headers=headers)
+            items = activities.get('items', [])
+            journal_entries.extend(items)
+            offset += len(items)
+            if not items or offset >= activities.get('totalCount', 0):
+                break
+        return journal_entries
+
+    def get_latest_journal_timestamp(self, version, start_date):
+        '''
+        Return the timestamp of the most recent journal entry of interest
+        for a project version, or None if there are no such entries.
+        '''
+        url = self._journal_url(version, start_date)
+        headers = {
+            'Accept': 'application/vnd.blackducksoftware.journal-4+json'}
+        activities = self.hub_client.get_json(f"{url}&limit=1", headers=headers)
+        items = activities.get('items', [])
+        return items[0]['timestamp'] if items else None
+
+    def get_version_journal(self, version, start_date):
+        '''Retrieve journal entries from blackduck_hub updates for a project version.
+           These are associated with blackduck_system user.
+           We are only interested in these events:
+           * Vulnerability Found:
+                 New CVE found
+           * Component Deleted:
+                 Component is renamed.  It is usually followed by
+                 "Component Added" and "Vulnerability Found".  We will close the
+                 old issue and open a new one using the new name.
+        '''
+        cve_entries, removed_entries = [], []
+        journal_entries = self._fetch_journal(version, start_date)
 
-        if activities.get('totalCount') == 0:
+        if not journal_entries:
             logging.info(
                 'No vulnerability updates from Black Duck Hub since the last scan.')
             return [], []
 
-        journal_entries = activities.get('items', [])
         for entry in journal_entries:
             if entry['action'] == 'Vulnerability Found':
                 cve_name=entry['currentData']['vulnerabilityId']
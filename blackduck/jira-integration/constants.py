@@ -22,6 +22,13 @@ EXCLUDED_PROJECTS = [
 # Versions only contains numbers and dots are included automatically
 INCLUDED_VERSION_NAMES = {'snapshot', 'dev', 'main', 'master', 'production'}
 
+# Number of concurrent requests used when fetching CVE details
+CVE_FETCH_WORKERS = 8
+# Number of project versions checked concurrently in knowledgebase mode
+KNOWLEDGEBASE_WORKERS = 4
+# Maximum requests per second sent to each of the Blackduck and Jira hosts
+REQUESTS_PER_SECOND = 10
+
 # Jira constants
 JIRA_PROJECT_KEY = 'VULN'
 JIRA_ISSUE_TYPE = 'Bug'
@@ -0,0 +1,37 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class HostRateLimiter:
+    '''
+    Limit the rate of requests sent to each host.  Requests to the same host
+    are spaced at least 1/rate seconds apart, regardless of which thread
+    issues them.
+    '''
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        '''Block until a request to url's host is allowed.'''
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def attach(self, session):
+        '''Rate limit every request made through a requests session.'''
+        request = session.request
+
+        def rate_limited_request(method, url, *args, **kwargs):
+            self.wait(url)
+            return request(method, url, *args, **kwargs)
+
+        session.request = rate_limited_request
@@ -2,13 +2,18 @@
 
 import re
 import argparse
+import json
 import logging
 import sys
+import threading
 import time
 import timestring
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from jira_issue_manager import JiraIssueManager
 import constants
 from blackduck_client import BlackduckClient
+from rate_limiter import HostRateLimiter
 
 logging.basicConfig(
     format='%(asctime)s:%(levelname)s:%(message)s',
@@ -307,6 +312,74 @@ def process_knowledgebase_changes(
             create_ticket(t, project_name, version_name, dry_run)
 
 
+def check_version_journal(project_name, version, start_date,
+                          journal_marks, marks_lock, dry_run):
+    '''
+    Apply knowledgebase journal changes of a single project version to Jira.
+    Versions whose latest journal entry matches the recorded high-water mark
+    have nothing new to process and are skipped.
+    '''
+    version_name = version.get('versionName')
+    mark_key = f'{project_name}:{version_name}'
+    latest = blackduck.get_latest_journal_timestamp(version, start_date)
+    with marks_lock:
+        if latest is None or journal_marks.get(mark_key) == latest:
+            logging.info(f'No journal changes for {mark_key} since last run')
+            return
+
+    logging.info(f'Checking version {mark_key}')
+    last_scan_date = is_scan_completed(blackduck, version)
+    if last_scan_date > start_date:
+        logging.info(
+            f'Last scan, {last_scan_date} is newer than {start_date} '
+            f'for {mark_key}.  Skip checking against Jira')
+    else:
+        tickets_to_update, tickets_to_close = blackduck.get_version_journal(
+            version, start_date)
+        process_knowledgebase_changes(
+            jira,
+            tickets_to_update,
+            tickets_to_close,
+            project_name,
+            version_name,
+            dry_run)
+
+    if not dry_run:
+        with marks_lock:
+            journal_marks[mark_key] = latest
+
+
+def knowledgebase_versions(projects):
+    ''' Yield (project name, version) pairs which are tracked in Jira. '''
+    params = {'limit': '0'}
+    for project in projects:
+        # Skip the projects that we don't or no longer maintain
+        if project['name'] in constants.EXCLUDED_PROJECTS:
+            logging.debug(f'Skipping excluded project: {project["name"]}')
+            continue
+        logging.info(f'Checking Blackduck Hub updates for {project["name"]}')
+        versions = blackduck.hub_client.get_resource(
+            'versions', parent=project, params=params)
+        if versions is None:
+            logging.debug(f'No versions found for project {project["name"]}')
+            continue
+        for version in versions:
+            version_name = version.get('versionName')
+            logging.debug(f'Processing version: {version_name}')
+
+            # Process if the version is on INCLUDED_VERSION_NAMES
+            # or is a numeric version
+            if (version_name.lower() not in constants.INCLUDED_VERSION_NAMES or
+                re.search(r'[^0-9.]', version_name)):
+                logging.info(f"Skip {version_name}.  We don't plan to tracked it in Jira")
+                continue
+            # Skip archived versions
+            if blackduck.is_version_archived(version):
+                logging.info(f'Skipping archived version: {project["name"]}:{version_name}')
+                continue
+            yield project['name'], version
+
+
 # Main execution
 parser = argparse.ArgumentParser(
     'Create or update JIRA tickets based on Blackduck vulnerabilities')
@@ -336,12 +409,30 @@ scan_parser.add_argument(
     action='store_true',
     default=False,
     help='Enable debug logging for detailed output.')
+scan_parser.add_argument(
+    '--cve-cache',
+    default=None,
+    help='JSON file used to cache CVE details between runs.')
 
 knowledgebase_parser.add_argument(
     '-d',
     '--start_date',
     required=True,
     help='Start date of knowledgebase activities')
+knowledgebase_parser.add_argument(
+    '--state-file',
+    default='knowledgebase-journal-marks.json',
+    help='JSON file recording the latest processed journal entry of each version.')
+knowledgebase_parser.add_argument(
+    '--workers',
+    type=int,
+    default=constants.KNOWLEDGEBASE_WORKERS,
+    help='Number of project versions to check concurrently.')
+knowledgebase_parser.add_argument(
+    '--rate',
+    type=float,
+    default=constants.REQUESTS_PER_SECOND,
+    help='Maximum number of requests per second sent to each host.')
 knowledgebase_parser.add_argument(
     '--dry-run',
     action='store_true',
@@ -368,7 +459,7 @@ if args.dry_run:
     logging.info(
         'DRY RUN MODE: No actual changes will be made to JIRA tickets')
 
-blackduck = BlackduckClient()
+blackduck = BlackduckClient(getattr(args, 'cve_cache', None))
 jira = JiraIssueManager()
 
 if args.type == 'scan':
@@ -399,47 +490,33 @@ if args.type == 'knowledgebase':
     logging.debug(
         f'Checking VULN based on Blackduck activity journal from date: {args.start_date}')
     start_date = timestring.Date(args.start_date).date
-    params = {'limit': '0'}
+
+    # Blackduck and Jira share the same limiter, which spaces requests per host
+    rate_limiter = HostRateLimiter(args.rate)
+    rate_limiter.attach(blackduck.hub_client.session)
+    rate_limiter.attach(jira.client._session)
+
+    state_file = Path(args.state_file)
+    journal_marks = {}
+    if state_file.exists():
+        with open(state_file) as f:
+            journal_marks = json.load(f)
+    marks_lock = threading.Lock()
+
     projects = blackduck.hub_client.get_resource('projects')
-    for project in projects:
-        # Skip the projects that we don't or no longer maintain
-        if project['name'] in constants.EXCLUDED_PROJECTS:
-            logging.debug(f'Skipping excluded project: {project["name"]}')
-            continue
-        logging.info(f'Checking Blackduck Hub updates for {project["name"]}')
-        versions = blackduck.hub_client.get_resource(
-            'versions', parent=project, params=params)
-        if versions is not None:
-            for version in versions:
-                version_name = version.get('versionName')
-                logging.debug(f'Processing version: {version_name}')
-
-                # Process if the version is on INCLUDED_VERSION_NAMES
-                # or is a numeric version
-                if (version_name.lower() not in constants.INCLUDED_VERSION_NAMES or
-                    re.search(r'[^0-9.]', version_name)):
-                    logging.info(f"Skip {version_name}.  We don't plan to tracked it in Jira")
-                    continue
-                # Skip archived versions
-                if blackduck.is_version_archived(version):
-                    logging.info(f'Skipping archived version: {project["name"]}:{version_name}')
-                    continue
-
-                logging.info(f'Checking version {version_name}')
-                last_scan_date = is_scan_completed(blackduck, version)
-                if last_scan_date > start_date:
-                    logging.info(
-                        f'Last scan, {last_scan_date} is newer than {start_date} '
-                        f'for {version_name}.  Skip checking against Jira')
-                    continue
-                tickets_to_update, tickets_to_close = blackduck.get_version_journal(
-                    version, start_date)
-                process_knowledgebase_changes(
-                    jira,
-                    tickets_to_update,
-                    tickets_to_close,
-                    project['name'],
-                    version_name,
-                    args.dry_run)
-        else:
-            logging.debug(f'No versions found for project {project["name"]}')
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(check_version_journal, project_name, version,
+                                start_date, journal_marks, marks_lock,
+                                args.dry_run)
+                for project_name, version in knowledgebase_versions(projects)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        # Persist progress even if a version failed, so the next run only
+        # revisits the versions that were not completed
+        if not args.dry_run:
+            with open(state_file, 'w') as f:
+                json.dump(journal_marks, f, indent=2)
@@ -10,6 +10,7 @@ import sys
 import time
 
 from blackduck import Client
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 class BlackDuckFlatten:
@@ -18,10 +19,23 @@ class BlackDuckFlatten:
     components with identical "manually added" components
     """
 
-    def __init__(self, url, token, project, version, dryrun):
+    # Filter selecting components which came from a signature scan
+    scan_component_filter = [
+        "bomMatchType:file_exact",
+        "bomMatchType:files_exact",
+        "bomMatchType:files_modified",
+        "bomMatchType:files_added_deleted",
+        "bomMatchType:manually_identified",
+    ]
+
+    def __init__(self, url, token, project, version, dryrun, workers=8):
         self.dryrun = dryrun
+        self.workers = workers
         logging.info(f"Preparing to flatten components for {project} {version}")
         self.bd = Client(base_url=url, token=token, verify=False)
+        # Size the connection pool so the concurrent matched-files requests
+        # can share the authenticated session without discarding connections
+        self.bd.session.get_adapter(url).init_poolmanager(workers, workers)
 
         # Save Black Duck's data about the project-version
         self.project = project
@@ -61,6 +75,18 @@ class BlackDuckFlatten:
         sys.exit(2)
 
 
+    def _get_scan_hrefs(self, component):
+        """
+        Returns the set of scans associated with any matched files for
+        a component
+        """
+
+        return {
+            self.bd.list_resources(match)["codelocations"]
+            for match in self.bd.get_resource("matched-files", parent=component)
+        }
+
+
     def read_scan_components(self):
         """
         Discovers all components associated with the project-version
@@ -69,27 +95,23 @@ class BlackDuckFlatten:
           * set of scan hrefs
         """
 
-        components = []
-        scan_hrefs = set()
-        for component in self.bd.get_resource(
+        bom_components = list(self.bd.get_resource(
             "components",
             parent=self.proj_ver_data,
-            params = {
-                "filter": [
-                    "bomMatchType:file_exact",
-                    "bomMatchType:files_exact",
-                    "bomMatchType:files_modified",
-                    "bomMatchType:files_added_deleted",
-                    "bomMatchType:manually_identified",
-                ]
-            }
-        ):
-            # Identify the scans associated with any matched files for
-            # this component
-            for match in self.bd.get_resource("matched-files", parent=component):
-                scan_hrefs.add(self.bd.list_resources(match)["codelocations"])
+            params = {"filter": self.scan_component_filter}
+        ))
+
+        # Identify the scans associated with any matched files for each
+        # component, fetching the matched files of several components at
+        # once
+        scan_hrefs = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for hrefs in executor.map(self._get_scan_hrefs, bom_components):
+                scan_hrefs.update(hrefs)
 
-            # Remember everything about the component
+        # Remember everything about the components
+        components = []
+        for component in bom_components:
             entry = {
                 "name": component["componentName"],
                 "version": component.get("componentVersionName", "<none>"),
@@ -103,6 +125,21 @@ class BlackDuckFlatten:
         return (components, scan_hrefs)
 
 
+    def count_scan_components(self):
+        """
+        Returns the number of components in the project-version that
+        originate from a signature scan, without reading them all
+        """
+
+        result = self.bd.get_resource(
+            "components",
+            parent=self.proj_ver_data,
+            params = {"filter": self.scan_component_filter, "limit": 1},
+            items=False,
+        )
+        return result["totalCount"]
+
+
     def delete_signature_scans(self):
         """
         Finds any signature-scan code locations and removes them from the project-version
@@ -123,14 +160,21 @@ class BlackDuckFlatten:
         if self.dryrun:
             return
 
-        # Verify that the project-version now has no components from signature scan
+        # Verify that the project-version now has no components from
+        # signature scan, backing off while Black Duck catches up
+        delay = 2
+        deadline = time.time() + 60 * 60
         while True:
-            time.sleep(5)
-            (components, _) = self.read_scan_components()
-            if len(components) == 0:
+            count = self.count_scan_components()
+            if count == 0:
                 logging.info("Verified 0 signature scan components after deleting scan(s)!")
                 break
-            logging.info("There are still signature scan components, waiting...")
+            if time.time() > deadline:
+                logging.fatal(f"Still {count} signature scan components an hour after deleting scan(s)!")
+                sys.exit(4)
+            logging.info(f"There are still {count} signature scan components, waiting {delay} seconds...")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
 
 
     def add_manual_component(self, comp_name, comp_version, comp_id, version_id):
@@ -161,11 +205,11 @@ class BlackDuckFlatten:
             logging.debug(f"{comp_name} version {comp_version} added successfully")
 
 
-    def add_manual_components(self):
+    def read_manual_components(self):
         """
-        Load the most recent components.csv report, and add new manual
-        components for any components previously derived from a
-        signature scan
+        Load the most recent components.csv report, and return the
+        components which need new manual components: those previously
+        derived only from a signature scan
         """
 
         # Download existing scan components
@@ -175,7 +219,9 @@ class BlackDuckFlatten:
         )
         logging.info(f"Reading components.csv for {self.project} {self.project_ver}")
         logging.debug(f"from URL: {csv_url}")
+        manual_components = []
         with requests.get(csv_url, stream=True) as r:
+            r.raise_for_status()
             components = csv.DictReader(line.decode('utf-8') for line in r.iter_lines())
 
             for comp in components:
@@ -189,26 +235,46 @@ class BlackDuckFlatten:
                         "Files Added/Deleted"
                     ) for m in match_types
                 ):
-                    self.add_manual_component(
+                    manual_components.append((
                         comp['Component name'],
                         comp['Component version name'],
                         comp['Component id'],
                         comp['Version id']
-                    )
+                    ))
+
+        return manual_components
 
 
-    def flatten(self):
+    def show_plan(self, manual_components):
         """
-        Flattens all components
+        Lists the manual components that will be added
         """
 
+        print(f"{len(manual_components)} manual components to add to {self.project} {self.project_ver}:")
+        for (comp_name, comp_version, comp_id, version_id) in manual_components:
+            print(f"  {comp_name} {comp_version} ({comp_id}/{version_id})")
+
+
+    def flatten(self, plan_only=False):
+        """
+        Flattens all components, or if plan_only is set, just lists the
+        manual components which would be added
+        """
+
+        # Work out which manual components to add before touching the BOM
+        manual_components = self.read_manual_components()
+        self.show_plan(manual_components)
+        if plan_only:
+            return
+
         # Need to detach the scan results first, or else certain components
         # (those with no origins, for whatever reason) will fail with a
         # "cannot add to BOM because it already exists" error.
         self.delete_signature_scans()
 
-        # Read CSV report and add new manual components
-        self.add_manual_components()
+        # Add new manual components
+        for component in manual_components:
+            self.add_manual_component(*component)
 
 
 if __name__ == "__main__":
@@ -226,6 +292,10 @@ if __name__ == "__main__":
         help="Version of <project>")
     parser.add_argument('-n', '--dryrun', action='store_true',
         help="Dry run - don't update Black Duck, just report actions")
+    parser.add_argument('--plan', action='store_true',
+        help="Only list the manual components which would be added")
+    parser.add_argument('-j', '--workers', type=int, default=8,
+        help="Number of concurrent Black Duck requests")
     args = parser.parse_args()
 
     if args.debug:
@@ -247,6 +317,7 @@ if __name__ == "__main__":
         creds["token"],
         args.project,
         args.version,
-        args.dryrun
+        args.dryrun,
+        args.workers
     )
-    flattener.flatten()
+    flattener.flatten(args.plan)
@@ -0,0 +1,335 @@
+"""
+Checks of flatten-project-version.py against a local stub Black Duck
+server. Run with "python3 -m unittest" or pytest from this directory.
+"""
+
+import contextlib
+import csv
+import io
+import importlib.machinery
+import importlib.util
+import itertools
+import json
+import logging
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+loader = importlib.machinery.SourceFileLoader(
+    "flatten_project_version", str(SCRIPT_DIR / "flatten-project-version.py"))
+spec = importlib.util.spec_from_loader("flatten_project_version", loader)
+flatten = importlib.util.module_from_spec(spec)
+loader.exec_module(flatten)
+
+PROJECT = "couchbase-server"
+VERSION = "7.6.0"
+COMPONENTS = 300
+SCANS = 3
+
+
+def components_csv():
+    """
+    Returns a components.csv report of which the even components came
+    only from signature scans
+    """
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["Component name", "Component version name",
+                     "Component id", "Version id", "Match type"])
+    for i in range(10):
+        match_type = "Exact,Files Modified" if i % 2 == 0 else "Exact,Direct"
+        writer.writerow([f"comp{i}", "1.0", f"c{i}", f"v{i}", match_type])
+    return out.getvalue()
+
+
+class StubBlackDuck(BaseHTTPRequestHandler):
+    """
+    Serves a single project-version whose components were all found by
+    signature scans, recording the changes made and the concurrency of
+    the matched-files requests
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    lock = threading.Lock()
+    # Polls of the component count which still find components after
+    # the scans are deleted
+    pending_polls = 0
+    # Seconds to take over each matched-files request
+    matched_files_delay = 0
+    events = []
+    connections = 0
+    in_flight = 0
+    max_in_flight = 0
+
+    @classmethod
+    def reset(cls, pending_polls=0, matched_files_delay=0):
+        cls.pending_polls = pending_polls
+        cls.matched_files_delay = matched_files_delay
+        cls.events = []
+        cls.connections = 0
+        cls.in_flight = 0
+        cls.max_in_flight = 0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            StubBlackDuck.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200, headers={}):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def href(self, path):
+        return f"http://{self.headers['Host']}{path}"
+
+    def resource(self, path, links, **fields):
+        return dict(fields, _meta={
+            "href": self.href(path),
+            "links": [
+                {"rel": rel, "href": self.href(href)}
+                for rel, href in links.items()
+            ],
+        })
+
+    def component(self, i):
+        path = f"/api/projects/p/versions/v/components/{i}"
+        return self.resource(
+            path, {"matched-files": f"{path}/matched-files"},
+            componentName=f"comp{i}",
+            componentVersionName="1.0",
+            component=self.href(f"/api/components/c{i}"),
+            componentVersion=self.href(f"/api/components/c{i}/versions/v{i}"),
+        )
+
+    def remaining_components(self):
+        with self.lock:
+            if not any(event[0] == "DELETE" for event in self.events):
+                return COMPONENTS
+            if StubBlackDuck.pending_polls > 0:
+                StubBlackDuck.pending_polls -= 1
+                return 5
+            return 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse(self.path).path
+        if path == "/api/tokens/authenticate":
+            return self.send_json(
+                {"bearerToken": "bearer", "expiresInMilliseconds": 3600000},
+                headers={"X-CSRF-TOKEN": "csrf"})
+        with self.lock:
+            self.events.append(("POST", json.loads(body)["component"]))
+        self.send_json({}, status=201)
+
+    def do_DELETE(self):
+        with self.lock:
+            self.events.append(("DELETE", urlparse(self.path).path))
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = url.path.rstrip("/")
+        if path == "/api":
+            return self.send_json({
+                "projects": self.href("/api/projects"), "_meta": {}})
+        if path == "/api/projects":
+            return self.send_json({"items": [
+                self.resource(
+                    f"/api/projects/{name}",
+                    {"versions": "/api/projects/p/versions"}, name=name)
+                # Black Duck does a substring match
+                for name in [f"{PROJECT}-extra", PROJECT]
+            ]})
+        if path == "/api/projects/p/versions":
+            return self.send_json({"items": [self.resource(
+                "/api/projects/p/versions/v",
+                {"components": "/api/projects/p/versions/v/components"},
+                versionName=VERSION,
+            )]})
+        if path == "/api/projects/p/versions/v/components":
+            total = self.remaining_components()
+            offset = int(params.get("offset", ["0"])[0])
+            limit = int(params.get("limit", ["10"])[0])
+            return self.send_json({
+                "totalCount": total,
+                "items": [
+                    self.component(i)
+                    for i in range(offset, min(offset + limit, total))
+                ],
+            })
+        if path.endswith("/matched-files"):
+            i = int(path.split("/")[-2])
+            with self.lock:
+                StubBlackDuck.in_flight += 1
+                StubBlackDuck.max_in_flight = max(
+                    StubBlackDuck.max_in_flight, StubBlackDuck.in_flight)
+            time.sleep(self.matched_files_delay)
+            with self.lock:
+                StubBlackDuck.in_flight -= 1
+            return self.send_json({"items": [self.resource(
+                f"/api/matched-files/{i}",
+                {"codelocations": f"/api/codelocations/{i % SCANS}"},
+            )]})
+        if path == "/components.csv":
+            body = components_csv().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+        self.send_json({"errorMessage": "not found"}, 404)
+
+
+class FlattenTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubBlackDuck)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        logging.disable(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        logging.disable(logging.NOTSET)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubBlackDuck.reset()
+        # Read components.csv from the stub rather than GitHub
+        get = flatten.requests.get
+        patcher = mock.patch.object(
+            flatten.requests, "get",
+            side_effect=lambda url, **kwargs: get(
+                f"{self.url}/components.csv", **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flattener(self, workers=16, dryrun=False):
+        return flatten.BlackDuckFlatten(
+            self.url, "token", PROJECT, VERSION, dryrun, workers)
+
+    def test_lookup(self):
+        flattener = self.flattener()
+        self.assertEqual(flattener.proj_data["name"], PROJECT)
+        self.assertEqual(flattener.pv_components_url,
+                         "/api/projects/p/versions/v/components")
+
+    def test_pooled_matched_files(self):
+        workers = 16
+        flattener = self.flattener(workers)
+        StubBlackDuck.reset(matched_files_delay=0.02)
+        components, scan_hrefs = flattener.read_scan_components()
+
+        self.assertEqual(len(components), COMPONENTS)
+        self.assertEqual(components[1], {
+            "name": "comp1",
+            "version": "1.0",
+            "uri": f"{self.url}/api/components/c1/versions/v1",
+        })
+        # Each scan is listed once, however many components it found
+        self.assertEqual(scan_hrefs, {
+            f"{self.url}/api/codelocations/{i}" for i in range(SCANS)
+        })
+        # The matched files are fetched concurrently, over a connection
+        # pool large enough to keep a connection for every worker
+        self.assertGreater(StubBlackDuck.max_in_flight, 1)
+        self.assertLessEqual(StubBlackDuck.max_in_flight, workers)
+        self.assertLessEqual(StubBlackDuck.connections, workers)
+        adapter = flattener.bd.session.get_adapter(self.url)
+        pool = adapter.poolmanager.connection_from_url(self.url)
+        self.assertEqual(pool.pool.maxsize, workers)
+
+    def test_plan(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.flattener().flatten(plan_only=True)
+        self.assertEqual(out.getvalue().splitlines(), [
+            f"5 manual components to add to {PROJECT} {VERSION}:",
+            "  comp0 1.0 (c0/v0)",
+            "  comp2 1.0 (c2/v2)",
+            "  comp4 1.0 (c4/v4)",
+            "  comp6 1.0 (c6/v6)",
+            "  comp8 1.0 (c8/v8)",
+        ])
+        # Nothing is changed
+        self.assertEqual(StubBlackDuck.events, [])
+
+    def test_flatten(self):
+        flattener = self.flattener()
+        # Record when the plan is shown among the changes made
+        show_plan = flattener.show_plan
+
+        def recording_show_plan(manual_components):
+            StubBlackDuck.events.append(("PLAN", len(manual_components)))
+            show_plan(manual_components)
+
+        flattener.show_plan = recording_show_plan
+        with contextlib.redirect_stdout(io.StringIO()):
+            flattener.flatten()
+
+        events = StubBlackDuck.events
+        # The plan is shown before anything is changed, then every scan is
+        # deleted before the manual components are added
+        self.assertEqual(events[0], ("PLAN", 5))
+        self.assertEqual(
+            sorted(events[1:1 + SCANS]),
+            [("DELETE", f"/api/codelocations/{i}") for i in range(SCANS)])
+        self.assertEqual(events[1 + SCANS:], [
+            ("POST", "https://blackduck.build.couchbase.com/api/components/"
+                     f"c{i}/versions/v{i}")
+            for i in range(0, 10, 2)
+        ])
+
+    def test_dryrun(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.flattener(dryrun=True).flatten()
+        self.assertEqual(StubBlackDuck.events, [])
+
+    def test_backoff(self):
+        flattener = self.flattener()
+        StubBlackDuck.reset(pending_polls=7)
+        with mock.patch.object(flatten, "time") as fake_time:
+            fake_time.time.return_value = 0
+            flattener.delete_signature_scans()
+        self.assertEqual(
+            [call.args[0] for call in fake_time.sleep.call_args_list],
+            [2, 4, 8, 16, 32, 60, 60])
+
+    def test_backoff_deadline(self):
+        flattener = self.flattener()
+        StubBlackDuck.reset(pending_polls=100)
+        with mock.patch.object(flatten, "time") as fake_time:
+            # Half an hour passes between each poll
+            fake_time.time.side_effect = itertools.count(0, 1800)
+            with self.assertRaises(SystemExit) as cm:
+                flattener.delete_signature_scans()
+        self.assertEqual(cm.exception.code, 4)
+        self.assertEqual(
+            [call.args[0] for call in fake_time.sleep.call_args_list], [2, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+Checks of scan-bsl-for-manifest against fixture repositories created in a
+temporary directory. Run with "python3 -m unittest" or pytest from this
+directory.
+"""
+
+import importlib.machinery
+import importlib.util
+import os
+import subprocess
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+loader = importlib.machinery.SourceFileLoader(
+    "scan_bsl", str(SCRIPT_DIR / "scan-bsl-for-manifest"))
+spec = importlib.util.spec_from_loader("scan_bsl", loader)
+scan = importlib.util.module_from_spec(spec)
+loader.exec_module(scan)
+
+PRODUCT = "Couchbase Server"
+VERSION = "7.6.0"
+CHANGE_DATE = "2028-01-01"
+
+GIT_ENV = dict(
+    os.environ,
+    GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+    GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com",
+)
+
+
+def bsl_text(product=PRODUCT, version=VERSION, change_date=CHANGE_DATE):
+    return scan.expected_licenses(
+        product, version, change_date)[scan.BSL_LIC]
+
+
+class ScanBslTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.cache = scan.ObjectCache(self.root / "cache")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_repo(self, name, files, branch="master"):
+        """
+        Creates a repo with a single commit of files (path: bytes) on
+        branch, returning its SHA
+        """
+        path = self.root / name
+        subprocess.run(["git", "init", "--quiet", "-b", branch, str(path)],
+                       check=True)
+        for relpath, content in files.items():
+            (path / relpath).parent.mkdir(parents=True, exist_ok=True)
+            (path / relpath).write_bytes(content)
+        subprocess.run(["git", "-C", str(path), "add", "-A"], check=True)
+        subprocess.run(["git", "-C", str(path), "commit", "--quiet",
+                        "-m", "fixture"], check=True, env=GIT_ENV)
+        return scan.git("-C", str(path), "rev-parse", "HEAD",
+                        text=True).strip()
+
+    def complete_files(self, **bsl_args):
+        expected = scan.expected_licenses(PRODUCT, VERSION, CHANGE_DATE)
+        expected[scan.BSL_LIC] = bsl_text(**bsl_args)
+        return expected
+
+    def scan_repo(self, name, revision, main_ok=False):
+        project = scan.Project(
+            name, name, f"file://{self.root / name}", revision, None, {})
+        scan.scan_project(self.cache, project, PRODUCT, VERSION,
+                          CHANGE_DATE, main_ok)
+        return project
+
+    def test_cat_files(self):
+        sha = self.make_repo("repo", {
+            "a.txt": b"first\nfile\n",
+            "dir/b.bin": b"\x00\n\x01no trailing newline",
+        })
+        contents = scan.cat_files(
+            self.root / "repo" / ".git", sha,
+            ["a.txt", "missing.txt", "dir/b.bin"])
+        self.assertEqual(contents, {
+            "a.txt": b"first\nfile\n",
+            "missing.txt": None,
+            "dir/b.bin": b"\x00\n\x01no trailing newline",
+        })
+
+    def test_up_to_date(self):
+        self.make_repo("repo", self.complete_files())
+        project = self.scan_repo("repo", "master")
+        self.assertEqual(project.changes, [])
+        self.assertIsNone(project.error)
+
+    def test_other_changes_allowed_on_main(self):
+        files = self.complete_files()
+        del files[scan.TOP_LIC]
+        files["COPYING-LICENSE.md"] = b"old\n"
+        self.make_repo("repo", files)
+        project = self.scan_repo("repo", "master")
+        self.assertEqual(project.changes, [
+            f"Create {scan.TOP_LIC}", "Remove COPYING-LICENSE.md"])
+        self.assertIsNone(project.error)
+
+    def test_new_version_on_main(self):
+        self.make_repo("repo", self.complete_files(version="7.2.0"))
+        project = self.scan_repo("repo", "master")
+        self.assertEqual(project.changes, [
+            f"Update BSL Version from 7.2.0 to {VERSION}"])
+        self.assertIn("'master' branch", project.error)
+
+        project = self.scan_repo("repo", "master", main_ok=True)
+        self.assertIsNone(project.error)
+
+    def test_new_change_date_on_release_branch(self):
+        self.make_repo("repo", self.complete_files(change_date="2027-01-01"),
+                       branch="trinity")
+        project = self.scan_repo("repo", "trinity")
+        self.assertEqual(project.changes, [
+            f"Update BSL Change Date from 2027-01-01 to {CHANGE_DATE}"])
+        self.assertIsNone(project.error)
+
+    def test_new_version_locked(self):
+        sha = self.make_repo("repo", self.complete_files(version="7.2.0"))
+        project = self.scan_repo("repo", sha)
+        self.assertIn("locked to SHA", project.error)
+
+    def test_wrong_product(self):
+        self.make_repo("repo", self.complete_files(product="Sync Gateway"))
+        project = self.scan_repo("repo", "master")
+        self.assertEqual(
+            project.error, f"BSL Product is Sync Gateway, not {PRODUCT}")
+
+    def test_manifest_repo_per_url(self):
+        for name in ["manifest", "other-manifest"]:
+            self.make_repo(name, {
+                "default.xml": f'<manifest name="{name}"/>'.encode()})
+        for name in ["manifest", "other-manifest"]:
+            path = scan.update_manifest_repo(
+                f"file://{self.root / name}", self.cache)
+            root = scan.read_manifest(path, "default.xml")
+            self.assertEqual(root.get("name"), name)
+
+    def test_manifest_projects(self):
+        root = ET.fromstring("""
+            <manifest>
+              <remote name="couchbase" fetch=".."/>
+              <default remote="couchbase"/>
+              <project name="build">
+                <annotation name="BSL_PRODUCT" value="Couchbase Server"/>
+              </project>
+              <project name="kv_engine" groups="bsl" revision="trinity"/>
+              <project name="norev" groups="notdefault,bsl"/>
+              <project name="other" revision="master"/>
+            </manifest>
+        """)
+        metadata, projects = scan.manifest_projects(
+            root, "https://github.com/couchbase/manifest", set())
+        self.assertEqual(metadata, {"BSL_PRODUCT": "Couchbase Server"})
+        self.assertEqual([p.name for p in projects], ["kv_engine", "norev"])
+        # Resolved as repo does, relative to the manifest URL itself
+        self.assertEqual(projects[0].url, "https://github.com/kv_engine")
+        self.assertIsNone(projects[0].error)
+        self.assertIsNotNone(projects[1].error)
+
+
+if __name__ == "__main__":
+    unittest.main()
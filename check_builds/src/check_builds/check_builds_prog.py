@@ -12,7 +12,6 @@ import argparse
 import configparser
 import json
 import logging
-import os
 import smtplib
 import subprocess
 import sys
@@ -20,7 +19,7 @@ import time
 
 from email.mime.text import MIMEText
 from pathlib import Path
-from .util import generate_filelist
+from .inventory import Inventory
 
 import cbbuild.database.db as cbutil_db
 
@@ -32,6 +31,10 @@ logger.setLevel(logging.INFO)
 ch = logging.StreamHandler()
 logger.addHandler(ch)
 
+# Number of updated build documents to write to the database at once
+UPSERT_BATCH_SIZE = 500
+
+
 # Echo command being executed - helpful for debugging
 def run(cmd, **kwargs):
     print("++", *cmd)
@@ -75,6 +78,50 @@ def send_email(smtp_server, receivers, message, dryrun):
         smtp.quit()
 
 
+class MetadataUpdates:
+    """
+    Collects metadata changes to build documents, writing them to the
+    database in batches rather than one document at a time
+    """
+
+    def __init__(self, db, dryrun):
+        self.db = db
+        self.dryrun = dryrun
+        self.pending = {}
+
+    def set(self, build, key, value):
+        build.setdefault('metadata', {})[key] = value
+        if not self.dryrun:
+            self.pending[build['key_']] = build
+            if len(self.pending) >= UPSERT_BATCH_SIZE:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.db.upsert_documents(self.pending)
+            self.pending = {}
+
+
+def find_template(template_dir, product):
+    """Find the single pkg_data template for a product"""
+
+    templates = list(
+        filter(
+            lambda x: x.name.endswith(('.yaml.j2', '.json')),
+            template_dir.glob("pkg_data.*")
+        )
+    )
+    if len(templates) < 1:
+        logger.error(f"Product {product} has no pkg_data templates")
+        sys.exit(1)
+    if len(templates) > 1:
+        logger.error(f"Found multiple possible pkg_data files for {product}!")
+        sys.exit(1)
+    logger.debug(f"Using template {templates[0]} for {product}")
+
+    return templates[0]
+
+
 def main():
     """
     Parse the command line arguments, handle configuration setup,
@@ -91,6 +138,9 @@ def main():
     parser.add_argument('-c', '--config', dest='check_build_config',
                         help='Configuration file for build database loader',
                         default='check_builds.ini')
+    parser.add_argument('--cache-file', default='check_builds_cache.json',
+                        help='File caching the latestbuilds inventory '
+                             'between runs')
     parser.add_argument('-n', '--dryrun', action='store_true',
                         help="Only check, don't update database or send email")
     parser.add_argument('-v', '--verbose', action='store_true',
@@ -144,8 +194,12 @@ def main():
     db = cbutil_db.CouchbaseDB(db_info)
     builds = db.query_documents(
         'build',
-        where_clause="ifmissingornull(metadata.builds_complete, 'n/a')='n/a'"
+        where_clause="ifmissingornull(metadata.builds_complete, 'n/a')='n/a'",
+        simple=True
     )
+    updates = MetadataUpdates(db, dryrun)
+    inventory = Inventory(miss_info['lb_base_dir'], args.cache_file)
+    templates = {}
 
     # Go through builds and based on age and whether certain metadata
     # values (builds_complete and email_notification) are set, determine
@@ -155,7 +209,8 @@ def main():
     #     (files already gone from latestbuilds)
     #   - If the product isn't in the product config data, skip
     #   - Generate necessary file list, then get current file list from
-    #     latestbuilds (mounted via NFS)
+    #     latestbuilds (mounted via NFS), unless the inventory shows
+    #     neither has changed since the last run
     #   - Check to see if any files in needed list aren't in current list:
     #      - If not, mark build complete and continue
     #      - Else if there are and build age is over `delay` hours, check to
@@ -163,76 +218,78 @@ def main():
     #        if not, marking email as sent
     #      - And if there are and build age is also over 12 hours, mark
     #        as incomplete and continue
-    for build in builds:
-        build_age = int(time.time()) - build.timestamp
-
-        if build_age > 28 * 24 * 60 * 60:  # 28 days
-            dryrun or build.set_metadata('builds_complete', 'unknown')
-            continue
-
-        template_dir = metadata_dir / build.product / "check_builds"
-        if not template_dir.exists():
-            logger.debug(f"Skipping build for unknown product {build.product}")
-            continue
-
-        prodver_path = f'{build.product}/{build.release}/{build.build_num}'
-        lb_dir = f'{miss_info["lb_base_dir"]}/{prodver_path}/'
-        lb_url = f'{miss_info["lb_base_url"]}/{prodver_path}/'
-
-        templates = list(
-            filter(
-                lambda x: x.name.endswith(('.yaml.j2', '.json')),
-                template_dir.glob("pkg_data.*")
-            )
-        )
-        if len(templates) < 1:
-            logger.error(f"Product {build.product} has no pkg_data templates")
-            sys.exit(1)
-        if len(templates) > 1:
-            logger.error(f"Found multiple possible pkg_data files for {build.product}!")
-            sys.exit(1)
-        logger.debug(f"Using template {templates[0]} for {build.product}")
-
-        logger.info(f"***** Checking {build.product} {build.release} build {build.version}-{build.build_num} ({build_age} seconds old)")
-
-        needed_files = generate_filelist(
-            build.product, build.release, build.version, build.build_num,
-            templates[0]
-        )
-        try:
-            existing_files = set(os.listdir(lb_dir))
-        except FileNotFoundError:
-             existing_files = set()
-        missing_files = list(needed_files.difference(existing_files))
-
-        if not missing_files:
-            logger.info("All expected files found - build complete!")
-            dryrun or build.set_metadata('builds_complete', 'complete')
-            continue
-
-        hours = int(miss_info['delay'])
-        if build_age > hours * 60 * 60:
-            logger.info(f"Still incomplete after {hours} hours; missing files:")
-            for missing in missing_files:
-                logger.info(f"    - {missing}")
-            if not build.metadata.setdefault('email_notification', False):
-                curr_bld = \
-                    f'{build.product}-{build.version}-{build.build_num}'
-                message = {
-                    'subject': f'Build {curr_bld} not complete after {hours} hours',
-                    'body': generate_mail_body(lb_url, missing_files)
-                }
-                receivers = miss_info['receivers'].split(',')
-                send_email(miss_info['smtp_server'], receivers, message, dryrun)
-                dryrun or build.set_metadata('email_notification', True)
-            else:
-                logger.info("Email previously sent")
+    try:
+        for build in builds:
+            check_build(build, metadata_dir, miss_info, inventory,
+                        templates, updates, dryrun)
+    finally:
+        updates.flush()
+        inventory.save()
+
+
+def check_build(build, metadata_dir, miss_info, inventory, templates,
+                updates, dryrun):
+    """Check a single build document, updating its metadata as needed"""
+
+    product = build['product']
+    release = build['release']
+    version = build['version']
+    build_num = build['build_num']
+    build_age = int(time.time()) - build['timestamp']
+
+    if build_age > 28 * 24 * 60 * 60:  # 28 days
+        updates.set(build, 'builds_complete', 'unknown')
+        return
+
+    if product not in templates:
+        template_dir = metadata_dir / product / "check_builds"
+        if template_dir.exists():
+            templates[product] = find_template(template_dir, product)
+        else:
+            templates[product] = None
+    if templates[product] is None:
+        logger.debug(f"Skipping build for unknown product {product}")
+        return
+
+    prodver_path = f'{product}/{release}/{build_num}'
+    lb_url = f'{miss_info["lb_base_url"]}/{prodver_path}/'
+
+    logger.info(f"***** Checking {product} {release} build {version}-{build_num} ({build_age} seconds old)")
+
+    missing_files = list(inventory.missing_files(
+        product, release, version, build_num, templates[product]
+    ))
+
+    if not missing_files:
+        logger.info("All expected files found - build complete!")
+        updates.set(build, 'builds_complete', 'complete')
+        return
+
+    hours = int(miss_info['delay'])
+    if build_age > hours * 60 * 60:
+        logger.info(f"Still incomplete after {hours} hours; missing files:")
+        for missing in missing_files:
+            logger.info(f"    - {missing}")
+        if not build.setdefault('metadata', {}).setdefault(
+                'email_notification', False):
+            curr_bld = f'{product}-{version}-{build_num}'
+            message = {
+                'subject': f'Build {curr_bld} not complete after {hours} hours',
+                'body': generate_mail_body(lb_url, missing_files)
+            }
+            receivers = miss_info['receivers'].split(',')
+            send_email(miss_info['smtp_server'], receivers, message, dryrun)
+            updates.set(build, 'email_notification', True)
+            # Record the email right away, so it's never sent twice
+            updates.flush()
         else:
-            logger.info(f"Incomplete but less than {hours} hours old")
+            logger.info("Email previously sent")
+    else:
+        logger.info(f"Incomplete but less than {hours} hours old")
 
-        if build_age > 12 * 60 * 60:  # 12 hours
-            logger.info("Build incomplete after 12 hours - marking incomplete")
-            dryrun or build.set_metadata('builds_complete', 'incomplete')
+    if build_age > 12 * 60 * 60:  # 12 hours
+        logger.info("Build incomplete after 12 hours - marking incomplete")
+        updates.set(build, 'builds_complete', 'incomplete')
 
 
 if __name__ == '__main__':
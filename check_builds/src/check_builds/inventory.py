@@ -0,0 +1,128 @@
+"""
+Cached inventory of build directories in latestbuilds.  Scanning the
+latestbuilds tree over NFS and rendering file list templates are the
+expensive parts of checking a build, so this records, for each build,
+the mtime of its directory, the hash of the template used and the files
+found to be missing.  On the next run, builds whose directory and template
+are both unchanged reuse the previous result instead of being re-examined.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from .util import generate_filelist
+
+
+logger = logging.getLogger('check_builds.scripts.check_builds')
+
+
+class Inventory:
+    """
+    What was last seen in each build directory of latestbuilds, persisted
+    between runs in a JSON cache file
+    """
+
+    def __init__(self, lb_base_dir, cache_file):
+        self.lb_base_dir = lb_base_dir
+        self.cache_file = cache_file
+        self.release_dirs = {}
+        self.template_hashes = {}
+        self.seen = set()
+
+        try:
+            with open(cache_file) as fh:
+                self.cache = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.cache = {}
+
+    def build_dir_mtime(self, product, release, build_num):
+        """
+        Return the mtime of a build's directory, or None if it doesn't
+        exist.  Each product/release directory is scanned only once, so
+        all of its builds are found with a single directory read
+        """
+
+        if (product, release) not in self.release_dirs:
+            mtimes = {}
+            try:
+                with os.scandir(
+                    f'{self.lb_base_dir}/{product}/{release}'
+                ) as entries:
+                    for entry in entries:
+                        if entry.is_dir():
+                            mtimes[entry.name] = entry.stat().st_mtime
+            except FileNotFoundError:
+                pass
+            self.release_dirs[(product, release)] = mtimes
+
+        return self.release_dirs[(product, release)].get(str(build_num))
+
+    def template_hash(self, template_file):
+        """Return the hash of a template's contents"""
+
+        if template_file not in self.template_hashes:
+            self.template_hashes[template_file] = hashlib.sha256(
+                template_file.read_bytes()
+            ).hexdigest()
+
+        return self.template_hashes[template_file]
+
+    def missing_files(self, product, release, version, build_num,
+                      template_file):
+        """
+        Return the set of files expected for a build which aren't in its
+        latestbuilds directory, re-examining the directory only if it or
+        the template has changed since the last run
+        """
+
+        key = f'{product}/{release}/{version}/{build_num}'
+        mtime = self.build_dir_mtime(product, release, build_num)
+        template_hash = self.template_hash(template_file)
+        self.seen.add(key)
+
+        entry = self.cache.get(key)
+        if entry is not None and mtime is not None \
+                and entry['mtime'] == mtime \
+                and entry['template_hash'] == template_hash:
+            logger.debug(f'Using cached inventory for {key}')
+            return set(entry['missing'])
+
+        if entry is not None and entry['template_hash'] == template_hash:
+            needed_files = set(entry['expected'])
+        else:
+            needed_files = generate_filelist(
+                product, release, version, build_num, template_file
+            )
+
+        if mtime is None:
+            existing_files = set()
+        else:
+            existing_files = set(os.listdir(
+                f'{self.lb_base_dir}/{product}/{release}/{build_num}'
+            ))
+        missing = needed_files.difference(existing_files)
+
+        self.cache[key] = {
+            'mtime': mtime,
+            'template_hash': template_hash,
+            'expected': sorted(needed_files),
+            'missing': sorted(missing),
+        }
+        return missing
+
+    def save(self):
+        """
+        Write the cache file, dropping builds which weren't checked in
+        this run (they're either finished or no longer in latestbuilds)
+        """
+
+        self.cache = {
+            key: entry for key, entry in self.cache.items()
+            if key in self.seen
+        }
+        tmp_file = f'{self.cache_file}.tmp'
+        with open(tmp_file, 'w') as fh:
+            json.dump(self.cache, fh)
+        os.replace(tmp_file, self.cache_file)
@@ -1,4 +1,5 @@
 import argparse
+import functools
 import itertools
 import json
 import sys
@@ -19,16 +20,30 @@ def generate_filelist(product, release, version, build_num, template_file, debug
 
     if template_file.name.endswith(".json"):
         return generate_filelist_from_json(
-            product, release, version, build_num, json.loads(template)
+            product, release, version, build_num,
+            parse_template(template_file.name, template)
         )
     elif template_file.name.endswith(".yaml.j2"):
         return generate_filelist_from_jinja(
-            product, release, version, build_num, Template(template), debug
+            product, release, version, build_num,
+            parse_template(template_file.name, template), debug
         )
     else:
         print (f"Unrecognized extension on {template_file.name}!")
         sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
+def parse_template(name, template):
+    """
+    Parse a template's contents, caching the result so each distinct
+    template is only loaded or compiled once.  The parsed JSON must not
+    be modified by callers
+    """
+
+    if name.endswith(".json"):
+        return json.loads(template)
+    return Template(template)
+
 def generate_filelist_from_json(product, release, version, build_num, template):
     """
     Create a set of filenames for given set of build coordinates
@@ -0,0 +1,212 @@
+"""
+Checks and a benchmark of the latestbuilds inventory cache, against a
+synthetic latestbuilds tree created in a temporary directory.
+
+Run the checks with "python3 -m unittest" or pytest from this directory,
+and the benchmark with "python3 test_inventory.py", which by default
+checks a tree of 10,000 builds cold, again with the cache, and after
+some build directories and the template have changed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from check_builds import inventory
+from check_builds.inventory import Inventory
+
+PLATFORMS = ["linux", "macos", "windows", "debian12", "rhel9", "ubuntu24.04"]
+
+
+def write_template(path, packages=("server", "tools")):
+    """
+    Writes a JSON template expecting one file per package and platform
+    in every release
+    """
+    template = {}
+    for product in ["couchbase-server", "sync_gateway"]:
+        template[product] = {"package": {
+            package: {"release": {
+                release: {
+                    "template": "{package}-{VERSION}-{BLD_NUM}-{platform}.{ext}",
+                    "platform": {
+                        platform: {"ext": "zip" if platform == "windows" else "tar"}
+                        for platform in PLATFORMS
+                    },
+                }
+                for release in ["trinity", "morpheus"]
+            }}
+            for package in packages
+        }}
+    path.write_text(json.dumps(template))
+
+
+def make_tree(root, builds):
+    """
+    Creates builds build directories in a latestbuilds tree under root,
+    split between two products and two releases. Every tenth build is
+    missing its windows package. Returns the coordinates of each build.
+    """
+    coords = []
+    for n in range(builds):
+        product = ["couchbase-server", "sync_gateway"][n % 2]
+        release = ["trinity", "morpheus"][n // 2 % 2]
+        build_num = 1000 + n // 4
+        build_dir = root / product / release / str(build_num)
+        build_dir.mkdir(parents=True)
+        for package in ["server", "tools"]:
+            for platform in PLATFORMS:
+                if platform == "windows" and n % 10 == 0:
+                    continue
+                ext = "zip" if platform == "windows" else "tar"
+                (build_dir / f"{package}-7.6.0-{build_num}-{platform}.{ext}"
+                 ).touch()
+        coords.append((product, release, "7.6.0", build_num))
+    return coords
+
+
+def check_all(inv, coords, template):
+    return {
+        coord: inv.missing_files(*coord, template) for coord in coords
+    }
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.lb = self.root / "latestbuilds"
+        self.cache_file = self.root / "cache.json"
+        self.template = self.root / "pkg_data.json"
+        write_template(self.template)
+        self.coords = make_tree(self.lb, 40)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_check(self):
+        """
+        Checks every build with a new Inventory, as a new run would,
+        returning the missing files and the number of templates rendered
+        and directories listed
+        """
+        inv = Inventory(str(self.lb), str(self.cache_file))
+        with mock.patch.object(
+                inventory, "generate_filelist",
+                wraps=inventory.generate_filelist) as rendered, \
+                mock.patch.object(
+                    inventory.os, "listdir", wraps=os.listdir) as listed:
+            missing = check_all(inv, self.coords, self.template)
+        inv.save()
+        return missing, rendered.call_count, listed.call_count
+
+    def build_dir(self, coord):
+        product, release, _, build_num = coord
+        return self.lb / product / release / str(build_num)
+
+    def test_cold_then_cached(self):
+        missing, rendered, listed = self.run_check()
+        self.assertEqual((rendered, listed), (40, 40))
+        self.assertEqual(
+            missing[self.coords[0]], {"server-7.6.0-1000-windows.zip",
+                                      "tools-7.6.0-1000-windows.zip"})
+        self.assertEqual(missing[self.coords[1]], set())
+
+        cached, rendered, listed = self.run_check()
+        self.assertEqual((rendered, listed), (0, 0))
+        self.assertEqual(cached, missing)
+
+    def test_changed_directory(self):
+        self.run_check()
+        coord = self.coords[0]
+        build_dir = self.build_dir(coord)
+        (build_dir / "server-7.6.0-1000-windows.zip").touch()
+        # Make sure the mtime changes, however coarse the filesystem's
+        os.utime(build_dir, (0, build_dir.stat().st_mtime + 10))
+
+        missing, rendered, listed = self.run_check()
+        # Only the changed directory is listed again, and its expected
+        # files come from the cache as the template hasn't changed
+        self.assertEqual((rendered, listed), (0, 1))
+        self.assertEqual(missing[coord], {"tools-7.6.0-1000-windows.zip"})
+
+    def test_changed_template(self):
+        self.run_check()
+        write_template(self.template, packages=("server",))
+
+        missing, rendered, listed = self.run_check()
+        self.assertEqual((rendered, listed), (40, 40))
+        self.assertEqual(
+            missing[self.coords[0]], {"server-7.6.0-1000-windows.zip"})
+
+    def test_missing_directory(self):
+        coord = ("couchbase-server", "trinity", "7.6.0", 9999)
+        self.coords.append(coord)
+        missing, _, _ = self.run_check()
+        self.assertEqual(len(missing[coord]), 12)
+
+        # A build whose directory doesn't exist yet is always re-examined
+        self.build_dir(coord).mkdir()
+        missing, rendered, listed = self.run_check()
+        self.assertEqual((rendered, listed), (0, 1))
+
+    def test_unchecked_builds_dropped(self):
+        self.run_check()
+        self.coords = self.coords[:10]
+        self.run_check()
+        self.assertEqual(len(json.loads(self.cache_file.read_text())), 10)
+
+    def test_corrupt_cache(self):
+        self.cache_file.write_text('{"couchbase-server/')
+        _, rendered, listed = self.run_check()
+        self.assertEqual((rendered, listed), (40, 40))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the latestbuilds inventory cache")
+    parser.add_argument("--builds", type=int, default=10000,
+                        help="Number of builds in the synthetic tree")
+    parser.add_argument("--changed", type=int, default=100,
+                        help="Number of build directories changed between "
+                        "the cached and partial runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        lb = root / "latestbuilds"
+        cache_file = root / "cache.json"
+        template = root / "pkg_data.json"
+        write_template(template)
+        coords = make_tree(lb, args.builds)
+
+        def timed_run(name):
+            start = time.monotonic()
+            inv = Inventory(str(lb), str(cache_file))
+            check_all(inv, coords, template)
+            inv.save()
+            print(f"{name}: {time.monotonic() - start:.2f}s")
+
+        print(f"Checking {args.builds} builds")
+        timed_run("cold")
+        timed_run("cached")
+        for product, release, _, build_num in coords[:args.changed]:
+            build_dir = lb / product / release / str(build_num)
+            (build_dir / "new-file").touch()
+            os.utime(build_dir, (0, build_dir.stat().st_mtime + 10))
+        timed_run(f"{args.changed} directories changed")
+        write_template(template, packages=("server",))
+        timed_run("template changed")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,4 @@ from .logs import logger
 from .factory import API
 from .gerrit import Gerrit
 from .github import GitHub
+from .reconcile import build_plan
@@ -9,6 +9,11 @@ import tempfile
 from api import API, logger
 
 
+EXTERNAL_IDS_REF = "refs/meta/external-ids"
+RE_OAUTH_ID = re.compile(r"\[externalId \"github-oauth:([0-9]+)\"\]")
+RE_ACCOUNT_ID = re.compile("accountId = ([0-9]+)")
+
+
 class REST():
     def __init__(self, url, username, token):
         self.url = url
@@ -116,10 +121,11 @@ class Gerrit(API):
             config['gerrit_token'],
             config['noop_groups'].split(","),
             config['noop_userids'].split(","),
-            dry_run
+            dry_run,
+            config.get('cache_dir')
         )
 
-    def __init__(self, hostname, web_protocol, web_port, ssh_port, username, token, noop_groups, noop_userids, dry_run):
+    def __init__(self, hostname, web_protocol, web_port, ssh_port, username, token, noop_groups, noop_userids, dry_run, cache_dir=None):
         """
         Parameters
         ----------
@@ -141,6 +147,10 @@ class Gerrit(API):
             Groups which should not be modified
         noop_userids: list(str)
             Users which should not be modified
+        cache_dir: str, optional
+            Directory in which All-Users and the external ID index are kept
+            between runs. If not set, a temp dir is used and removed on
+            completion
         """
         self.dry_run = dry_run
         self.hostname = hostname
@@ -155,14 +165,21 @@ class Gerrit(API):
         self._group_members = {}
         self._users = {}
         self.map = {}
-        self.path = tempfile.mkdtemp()
-        logger.debug(f"Created temp dir {self.path}")
+        self.temp_dir = cache_dir is None
+        if self.temp_dir:
+            self.path = tempfile.mkdtemp()
+            logger.debug(f"Created temp dir {self.path}")
+        else:
+            self.path = os.path.abspath(os.path.expanduser(cache_dir))
+            os.makedirs(self.path, exist_ok=True)
+            logger.debug(f"Using cache dir {self.path}")
         self.init()
+        # Fetch into a local ref, so the previously indexed commit stays
+        # reachable for the next incremental update
         self.fetch(
             f"ssh://{self.username}@{hostname}:{self.ssh_port}/All-Users",
-            "refs/meta/external-ids")
-        self.checkout("FETCH_HEAD")
-        self.map_ids()
+            f"+{EXTERNAL_IDS_REF}:{EXTERNAL_IDS_REF}")
+        self.map_ids(self.git("rev-parse", EXTERNAL_IDS_REF).decode().strip())
         self.rest = REST(
             f"{web_protocol}://{hostname}:{web_port}", username, token)
 
@@ -170,8 +187,9 @@ class Gerrit(API):
         """
         Remove temp dir on completion
         """
-        shutil.rmtree(self.path)
-        logger.debug(f"Removed temp dir {self.path}")
+        if self.temp_dir:
+            shutil.rmtree(self.path)
+            logger.debug(f"Removed temp dir {self.path}")
 
     def init(self):
         """
@@ -187,57 +205,154 @@ class Gerrit(API):
         else:
             logger.debug("Git repo initialised")
 
-    def map_ids(self):
+    def git(self, *args, input=None):
         """
-        Populate self.map with a mapping of [gerrit] user ids and [github]
-        oauth ids
-        """
-        re_oauth_id = re.compile(r"\[externalId \"github-oauth:([0-9]+)\"\]")
-        re_account_id = re.compile("accountId = ([0-9]+)")
-        for root, dirs, files in os.walk(self.path):
-            if ".git" in dirs:
-                dirs.remove(".git")
-            for file in files:
-                oauth_id = account_id = None
-                filename = os.sep.join([root, file])
-                with open(filename) as f:
-                    content = f.read()
-                    oauth_id = re_oauth_id.search(content)
-                    account_id = re_account_id.search(content)
-                    if(oauth_id and account_id):
-                        oauth_id = str(oauth_id.group(1))
-                        account_id = str(account_id.group(1))
-                        self.map[account_id] = oauth_id
+        Run a git command in the repo at `self.path`, returning its stdout
 
-    def oauth_id(self, gerrit_user_id):
+        Parameters
+        ----------
+        args : str
+            the git subcommand and its arguments
+        input : bytes, optional
+            data passed to the command's stdin
         """
-        Retrieve a single oauth id from a given gerrit user id
+        call = subprocess.run(["git", "-C", self.path, *args], input=input,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if call.returncode != 0:
+            logger.critical(
+                f"git {args[0]} failed - {call.stderr.decode()}")
+            sys.exit(1)
+        return call.stdout
+
+    def read_blobs(self, shas):
+        """
+        Retrieve the contents of a number of blobs with a single
+        `git cat-file --batch`, as a dict keyed by sha
 
         Parameters
         ----------
-        gerrit_user_id : string
-            the needle
+        shas : list(str)
+            the blobs to read
+        """
+        if not shas:
+            return {}
+        output = self.git("cat-file", "--batch",
+                          input="".join(f"{sha}\n" for sha in shas).encode())
+        blobs = {}
+        pos = 0
+        for sha in shas:
+            header_end = output.index(b"\n", pos)
+            size = int(output[pos:header_end].split()[2])
+            content_start = header_end + 1
+            blobs[sha] = output[content_start:content_start + size].decode(
+                errors="replace")
+            # Skip content and its trailing newline
+            pos = content_start + size + 1
+        return blobs
+
+    def parse_external_id(self, content):
+        """
+        Extract the [gerrit] account id and [github] oauth id from an
+        external id file, returning None unless both are present
+
+        Parameters
+        ----------
+        content : str
+            the file contents
         """
-        return self.map.get(str(gerrit_user_id), None)
+        oauth_id = RE_OAUTH_ID.search(content)
+        account_id = RE_ACCOUNT_ID.search(content)
+        if oauth_id and account_id:
+            return [str(account_id.group(1)), str(oauth_id.group(1))]
+        return None
 
-    def checkout(self, ref):
+    def changed_files(self, old_commit, new_commit):
         """
-        Check out a specific ref of the git repo at `self.path`
+        Retrieve the files which differ between two commits, as a dict of
+        path to new blob sha (None for deleted files). If old_commit is
+        None, every file in new_commit is returned
 
         Parameters
         ----------
-        ref : string
-            the ref to checkout
+        old_commit : str
+            the previously indexed commit
+        new_commit : str
+            the commit being indexed
+        """
+        files = {}
+        if old_commit is None:
+            entries = self.git("ls-tree", "-r", "-z", new_commit).split(b"\0")
+            for entry in entries:
+                if entry:
+                    info, path = entry.decode().split("\t", 1)
+                    files[path] = info.split()[2]
+            return files
+
+        fields = self.git("diff-tree", "-r", "-z", "--no-renames",
+                          old_commit, new_commit).split(b"\0")
+        # Output alternates ":oldmode newmode oldsha newsha status" and path
+        for info, path in zip(fields[0::2], fields[1::2]):
+            info = info.decode().split()
+            files[path.decode()] = None if info[4] == "D" else info[3]
+        return files
+
+    def map_ids(self, commit):
         """
-        os.chdir(self.path)
-        call = subprocess.run(["git", "checkout", ref],
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if call.returncode != 0:
-            logger.critical(
-                f"Couldn't checkout {ref} - {call.stderr.decode()}")
-            sys.exit(1)
-        else:
-            logger.debug(f"Checked out {ref}")
+        Populate self.map with a mapping of [gerrit] user ids and [github]
+        oauth ids found in external ids at `commit`.
+
+        The external id files are indexed by path in a file alongside the
+        repo, recording the commit they were read from. On later runs only
+        the files changed since that commit are read.
+
+        Parameters
+        ----------
+        commit : str
+            the refs/meta/external-ids commit being mapped
+        """
+        index_file = os.path.join(self.path, ".git", "external-ids.json")
+        index = {"commit": None, "files": {}}
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+            # Fall back to a full scan if the indexed commit has gone
+            if index["commit"] is not None and subprocess.run(
+                    ["git", "-C", self.path, "cat-file", "-e",
+                     f"{index['commit']}^{{commit}}"],
+                    stderr=subprocess.DEVNULL).returncode != 0:
+                index = {"commit": None, "files": {}}
+
+        if index["commit"] != commit:
+            changed = self.changed_files(index["commit"], commit)
+            logger.debug(
+                f"Reading {len(changed)} external id files changed since "
+                f"{index['commit']}")
+            blobs = self.read_blobs(
+                [sha for sha in changed.values() if sha is not None])
+            for path, sha in changed.items():
+                ids = None if sha is None else self.parse_external_id(blobs[sha])
+                if ids is None:
+                    index["files"].pop(path, None)
+                else:
+                    index["files"][path] = ids
+            index["commit"] = commit
+            if not self.temp_dir:
+                with open(index_file, "w") as f:
+                    json.dump(index, f)
+
+        for account_id, oauth_id in index["files"].values():
+            self.map[account_id] = oauth_id
+
+    def oauth_id(self, gerrit_user_id):
+        """
+        Retrieve a single oauth id from a given gerrit user id
+
+        Parameters
+        ----------
+        gerrit_user_id : string
+            the needle
+        """
+        return self.map.get(str(gerrit_user_id), None)
 
     def init(self):
         """
@@ -427,20 +542,3 @@ class Gerrit(API):
                 "email": member['email'] if 'email' in member else ''
             } for member in members]
         return self._group_members[group_name]
-
-    def github_user_id_is_in_group(self, user_id, group):
-        """
-        Check whether a given user is a member of a group
-
-        Parameters
-        ----------
-        user_id : str
-            the user id of the github user
-        group : str
-            the gerrit group being searched
-        """
-        if user_id in [
-                member['github_id']
-                for member
-                in self.group_members(group)]:
-            return True
@@ -66,17 +66,3 @@ class GitHub(API):
         except UnknownObjectException as e:
             print(f"Github organisation {org} does not exist")
             sys.exit()
-
-    def user_id_is_in_org(self, user_id, org):
-        """
-        Check if a specified user ID is in an org
-
-        Parameters
-        ----------
-        user_id : string
-            needle
-        org : string
-            haystack
-        """
-        if user_id in [member['id'] for member in self.org_members(org)]:
-            return True
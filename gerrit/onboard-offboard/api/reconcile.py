@@ -0,0 +1,148 @@
+from api import logger
+
+
+def normalize_github_id(github_id):
+    """
+    Normalize a GitHub user ID so IDs from Gerrit and GitHub compare equal.
+    Returns None for users with no GitHub identity.
+
+    Parameters
+    ----------
+    github_id : str or int
+        the GitHub user ID as reported by either side
+    """
+    if github_id is None:
+        return None
+    github_id = str(github_id).strip()
+    if not github_id.isdigit():
+        return None
+    return str(int(github_id))
+
+
+class Plan:
+    """
+    Set of membership changes needed to bring Gerrit groups in line with a
+    GitHub org, which can be reviewed before being applied.
+
+    Attributes
+    ----------
+    adds : dict
+        lists of users to add, keyed by gerrit group
+    removes : dict
+        lists of users to remove, keyed by gerrit group
+    reasons : dict
+        short explanation of each group's additions/removals, keyed by
+        ("add"|"remove", group)
+    """
+    def __init__(self):
+        self.adds = {}
+        self.removes = {}
+        self.reasons = {}
+
+    def add(self, group, members, reason):
+        if members:
+            self.adds[group] = members
+            self.reasons[("add", group)] = reason
+
+    def remove(self, group, members, reason):
+        if members:
+            self.removes[group] = members
+            self.reasons[("remove", group)] = reason
+
+    def is_empty(self):
+        return not self.adds and not self.removes
+
+    def __str__(self):
+        lines = []
+        for group, members in self.adds.items():
+            lines.append(f"Add to '{group}' - {self.reasons[('add', group)]}")
+            lines += [f"  + {member['name']} ({member['id']})"
+                      for member in members]
+        for group, members in self.removes.items():
+            lines.append(
+                f"Remove from '{group}' - {self.reasons[('remove', group)]}")
+            lines += [f"  - {member['name']} ({member['id']})"
+                      for member in members]
+        return "\n".join(lines)
+
+    def apply(self, gerrit):
+        """
+        Apply the plan, returning the combined responses of the add and
+        remove calls
+
+        Parameters
+        ----------
+        gerrit : Gerrit
+            the gerrit instance to modify
+        """
+        add_response = ""
+        remove_response = ""
+        for group, members in self.adds.items():
+            add_response += gerrit.add_members_to_group(
+                group, members, self.reasons[("add", group)])
+        for group, members in self.removes.items():
+            remove_response += gerrit.remove_members_from_group(
+                group, members, self.reasons[("remove", group)])
+        return add_response, remove_response
+
+
+def build_plan(gerrit, github, github_org, gerrit_group):
+    """
+    Compute the changes needed so that every GitHub org member with a Gerrit
+    account is in `gerrit_group`, and no group contains users outside the
+    org. Noop groups and users are left untouched.
+
+    Each side is loaded once into sets keyed by normalized GitHub ID, so
+    the changes are simple set differences.
+
+    Parameters
+    ----------
+    gerrit : Gerrit
+        the gerrit instance
+    github : GitHub
+        the github instance
+    github_org : str
+        the org whose members should have access
+    gerrit_group : str
+        the group org members should be added to
+    """
+    org_ids = {
+        normalize_github_id(member['id'])
+        for member in github.org_members(github_org)}
+    org_ids.discard(None)
+
+    users_by_github_id = {}
+    for user in gerrit.users():
+        github_id = normalize_github_id(user.get('github_id'))
+        if github_id is not None:
+            users_by_github_id.setdefault(github_id, []).append(user)
+
+    group_ids = {
+        normalize_github_id(member['github_id'])
+        for member in gerrit.group_members(gerrit_group)}
+
+    plan = Plan()
+
+    # If users are in `github_org` and non-noop, ensure they're in
+    # `gerrit_group`
+    plan.add(gerrit_group, [
+        user
+        for github_id in sorted(org_ids - group_ids)
+        for user in users_by_github_id.get(github_id, [])
+        if user['id'] not in gerrit.noop_userids],
+        f"absent from gerrit group {gerrit_group}")
+
+    # If users aren't in `github_org`, remove them from all non-noop gerrit
+    # groups
+    for group in gerrit.groups():
+        if group in gerrit.noop_groups:
+            logger.info(f"Not removing users from '{group}' (noop group)")
+            continue
+        plan.remove(group, [
+            member
+            for member in gerrit.group_members(group)
+            if normalize_github_id(member['github_id']) not in org_ids
+            and member['id'] not in gerrit.noop_userids],
+            f"absent from github org {github_org}")
+
+    return plan
@@ -1,32 +1,6 @@
 import argparse
 import sys
-from api import Gerrit, GitHub, logger
-
-
-def group_members_not_in_org(gerrit_group, github_org):
-    return [
-        group_member
-        for group_member
-        in [
-            gerrit_user
-            for gerrit_user
-            in gerrit.group_members(gerrit_group)]
-        if not github.user_id_is_in_org(group_member['github_id'],
-                                        github_org)]
-
-
-def org_members_not_in_group(github_org, gerrit_group):
-    return [
-        gerrit_user
-        for gerrit_user
-        in gerrit.users()
-        if gerrit_user.get('github_id')
-        in [github_user['id']
-            for github_user
-            in github.org_members(github_org)
-            if not gerrit.github_user_id_is_in_group(
-                github_user['id'],
-                gerrit_group)]]
+from api import Gerrit, GitHub, build_plan, logger
 
 
 if __name__ == "__main__":
@@ -67,30 +41,11 @@ if __name__ == "__main__":
     gerrit = Gerrit.from_config_file(args.config, args.dry_run)
     github = GitHub.from_config_file(args.config, args.dry_run)
 
-    add_response = ""
-    remove_response = ""
-
-    # If users are in `github_org` and non-noop, ensure they're in
-    # `gerrit_group`
-    add_response = gerrit.add_members_to_group(gerrit_group, [
-        member
-        for member
-        in org_members_not_in_group(github_org, gerrit_group)
-        if member['id'] not in gerrit.noop_userids],
-        f"absent from gerrit group {gerrit_group}")
-
-    # If users aren't in `github_org`, remove them from all non-noop gerrit
-    # groups
-    for group in gerrit.groups():
-        if group in gerrit.noop_groups:
-            logger.info(f"Not removing users from '{group}' (noop group)")
-        else:
-            remove_response += gerrit.remove_members_from_group(group, [
-                member
-                for member
-                in group_members_not_in_org(group, github_org)
-                if member['id'] not in gerrit.noop_userids],
-                f"absent from github org {github_org}")
+    # Work out every change up front, and show it before applying
+    plan = build_plan(gerrit, github, github_org, gerrit_group)
+    if not plan.is_empty():
+        logger.info(f"Planned changes:\n{plan}")
+    add_response, remove_response = plan.apply(gerrit)
 
     if add_response:
         logger.info(add_response)
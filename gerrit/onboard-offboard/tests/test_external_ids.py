@@ -0,0 +1,163 @@
+"""
+Checks of the incremental external id index in api/gerrit.py, against a
+local All-Users style repo with thousands of external id files created in
+a temporary directory. Run with "python3 -m unittest" or pytest from this
+directory.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from api import Gerrit
+from api.gerrit import EXTERNAL_IDS_REF
+
+ACCOUNTS = 3000
+
+
+def external_id_file(key, account_id):
+    """
+    Returns the path and contents of the external id file for key, named
+    by the SHA-1 of the key as Gerrit does
+    """
+    path = hashlib.sha1(key.encode()).hexdigest()
+    path = f"{path[:2]}/{path[2:]}"
+    content = f'[externalId "{key}"]\n\taccountId = {account_id}\n'
+    return path, content.encode()
+
+
+def account_files(account_id, github_id):
+    """
+    Returns the external id files of a Gerrit account: a username, and
+    a GitHub OAuth id if github_id is set
+    """
+    files = dict([external_id_file(f"username:user{account_id}", account_id)])
+    if github_id is not None:
+        files.update([
+            external_id_file(f"github-oauth:{github_id}", account_id)])
+    return files
+
+
+class ExternalIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = self.tmpdir.name
+        subprocess.run(["git", "init", "--quiet", self.path], check=True)
+        self.commits = 0
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def commit(self, changes):
+        """
+        Commits changes (path: bytes, or None to delete) to the external
+        ids ref with "git fast-import", returning the new commit's SHA
+        """
+        self.commits += 1
+        message = f"Update external ids {self.commits}\n".encode()
+        stream = [
+            b"commit %s\n" % EXTERNAL_IDS_REF.encode(),
+            b"committer test <test@example.com> 1700000000 +0000\n",
+            b"data %d\n%s" % (len(message), message),
+        ]
+        if self.commits > 1:
+            stream.append(b"from %s^0\n" % EXTERNAL_IDS_REF.encode())
+        for path, content in changes.items():
+            if content is None:
+                stream.append(b"D %s\n" % path.encode())
+            else:
+                stream.append(b"M 100644 inline %s\ndata %d\n%s\n"
+                              % (path.encode(), len(content), content))
+        subprocess.run(["git", "-C", self.path, "fast-import", "--quiet"],
+                       input=b"".join(stream), check=True)
+        return subprocess.run(
+            ["git", "-C", self.path, "rev-parse", EXTERNAL_IDS_REF],
+            check=True, stdout=subprocess.PIPE, text=True).stdout.strip()
+
+    def gerrit(self):
+        """
+        Returns a Gerrit using the fixture repo, without connecting to a
+        server, which counts the external id files it reads
+        """
+        gerrit = Gerrit.__new__(Gerrit)
+        gerrit.path = self.path
+        gerrit.temp_dir = False
+        gerrit.map = {}
+        gerrit.blobs_read = 0
+        read_blobs = gerrit.read_blobs
+
+        def counting_read_blobs(shas):
+            gerrit.blobs_read += len(shas)
+            return read_blobs(shas)
+        gerrit.read_blobs = counting_read_blobs
+        return gerrit
+
+    def test_incremental_index(self):
+        files = {}
+        # Every tenth account has no GitHub identity
+        for account_id in range(1000000, 1000000 + ACCOUNTS):
+            files.update(account_files(
+                account_id, None if account_id % 10 == 0 else account_id + 7))
+        first = self.commit(files)
+
+        gerrit = self.gerrit()
+        gerrit.map_ids(first)
+        self.assertEqual(gerrit.blobs_read, len(files))
+        self.assertEqual(len(gerrit.map), ACCOUNTS * 9 // 10)
+        self.assertEqual(gerrit.oauth_id(1000001), "1000008")
+        self.assertIsNone(gerrit.oauth_id(1000000))
+
+        # Link a GitHub identity to one account, unlink another, and add
+        # a new account
+        changes = {
+            **account_files(1000010, 42),
+            external_id_file("github-oauth:1000008", 1000001)[0]: None,
+            **account_files(2000000, 43),
+        }
+        second = self.commit(changes)
+
+        gerrit = self.gerrit()
+        gerrit.map_ids(second)
+        # Unchanged files (including the unchanged username files of the
+        # accounts changed) aren't read again
+        self.assertEqual(gerrit.blobs_read, 3)
+        self.assertEqual(gerrit.oauth_id(1000010), "42")
+        self.assertIsNone(gerrit.oauth_id(1000001))
+        self.assertEqual(gerrit.oauth_id(2000000), "43")
+        self.assertEqual(gerrit.oauth_id(1000002), "1000009")
+
+        # Nothing is read when the ref hasn't moved
+        gerrit = self.gerrit()
+        gerrit.map_ids(second)
+        self.assertEqual(gerrit.blobs_read, 0)
+        self.assertEqual(len(gerrit.map), ACCOUNTS * 9 // 10 + 1)
+
+    def test_indexed_commit_gone(self):
+        first = self.commit(account_files(1000001, 101))
+        self.gerrit().map_ids(first)
+
+        # Point the index at a commit which doesn't exist, as after the
+        # ref was rewritten and garbage collected
+        index_file = os.path.join(self.path, ".git", "external-ids.json")
+        with open(index_file) as f:
+            index = json.load(f)
+        index["commit"] = "0" * 40
+        with open(index_file, "w") as f:
+            json.dump(index, f)
+
+        second = self.commit(account_files(1000002, 102))
+        gerrit = self.gerrit()
+        gerrit.map_ids(second)
+        # Everything is read again
+        self.assertEqual(gerrit.blobs_read, 4)
+        self.assertEqual(gerrit.map, {"1000001": "101", "1000002": "102"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Checks and a benchmark of the membership reconciliation in api/reconcile.py,
+against stub Gerrit and GitHub instances.
+
+Run the checks with "python3 -m unittest" or pytest from this directory,
+and the benchmark with "python3 test_reconcile.py", which by default
+reconciles a synthetic 50,000 user Gerrit against a GitHub org.
+"""
+
+import argparse
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from api import build_plan
+
+
+class StubGitHub:
+    def __init__(self, org_members):
+        self._org_members = org_members
+
+    def org_members(self, org):
+        return self._org_members
+
+
+class StubGerrit:
+    def __init__(self, users, group_members, noop_groups=(), noop_userids=()):
+        self._users = users
+        self._group_members = group_members
+        self.noop_groups = list(noop_groups)
+        self.noop_userids = list(noop_userids)
+
+    def users(self):
+        return self._users
+
+    def groups(self):
+        return list(self._group_members)
+
+    def group_members(self, group):
+        return self._group_members[group]
+
+
+def user(account_id, github_id):
+    return {
+        "id": str(account_id),
+        "name": f"user{account_id}",
+        "github_id": str(github_id),
+    }
+
+
+def ids(members):
+    return [member["id"] for member in members]
+
+
+def synthetic(count):
+    """
+    Returns stub GitHub and Gerrit instances with count Gerrit users, of
+    which the even ones are in the GitHub org, and every third is in the
+    "developers" group. Every fourth is in "admins", and the first ten are
+    in the noop "Administrators" group.
+    """
+    users = [user(1000 + i, 5000000 + i) for i in range(count)]
+    org = [
+        {"id": str(5000000 + i), "username": f"gh{i}"}
+        for i in range(0, count, 2)
+    ]
+    groups = {
+        "developers": users[::3],
+        "admins": users[::4],
+        "Administrators": users[:10],
+    }
+    gerrit = StubGerrit(users, groups, noop_groups=["Administrators"])
+    return StubGitHub(org), gerrit
+
+
+class BuildPlanTest(unittest.TestCase):
+
+    def test_plan(self):
+        users = [
+            user(1, 101),
+            user(2, 102),
+            user(3, 103),
+            # No GitHub identity
+            user(4, None),
+            user(5, 105),
+        ]
+        github = StubGitHub([
+            {"id": "101", "username": "one"},
+            {"id": "102", "username": "two"},
+            # IDs are compared normalized
+            {"id": " 0105", "username": "five"},
+            # Not a Gerrit user
+            {"id": "199", "username": "other"},
+        ])
+        gerrit = StubGerrit(users, {
+            "developers": [users[0], users[2], users[3]],
+            "Administrators": [users[2]],
+            "testers": [users[2]],
+        }, noop_groups=["Administrators"], noop_userids=["2"])
+
+        plan = build_plan(gerrit, github, "org", "developers")
+        # User 2 is a noop user, so isn't added
+        self.assertEqual(
+            {group: ids(members) for group, members in plan.adds.items()},
+            {"developers": ["5"]})
+        # Administrators is a noop group, so isn't changed
+        self.assertEqual(
+            {group: ids(members) for group, members in plan.removes.items()},
+            {"developers": ["3", "4"], "testers": ["3"]})
+
+    def test_nothing_to_do(self):
+        users = [user(1, 101)]
+        plan = build_plan(
+            StubGerrit(users, {"developers": users}),
+            StubGitHub([{"id": "101", "username": "one"}]),
+            "org", "developers")
+        self.assertTrue(plan.is_empty())
+
+    def test_synthetic(self):
+        github, gerrit = synthetic(1200)
+        plan = build_plan(gerrit, github, "org", "developers")
+        # Even users not already in developers (every third) are added
+        self.assertEqual(len(plan.adds["developers"]), 400)
+        # Odd users are removed from every group but the noop one; admins
+        # only has even users
+        self.assertEqual(len(plan.removes["developers"]), 200)
+        self.assertNotIn("admins", plan.removes)
+        self.assertNotIn("Administrators", plan.removes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark build_plan against synthetic users")
+    parser.add_argument("--users", type=int, default=50000,
+                        help="Number of Gerrit users")
+    args = parser.parse_args()
+
+    github, gerrit = synthetic(args.users)
+    start = time.monotonic()
+    plan = build_plan(gerrit, github, "org", "developers")
+    elapsed = time.monotonic() - start
+    adds = sum(len(members) for members in plan.adds.values())
+    removes = sum(len(members) for members in plan.removes.values())
+    print(f"Planned {adds} additions and {removes} removals for "
+          f"{args.users} users in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,15 +9,34 @@ or removed) and the destination team must already exist
 
 import argparse
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from github import Github
 from os import environ
 
 
+def role_from_permission(permission):
+    if permission.admin:
+        return "admin"
+    elif permission.maintain:
+        return "maintain"
+    elif permission.push:
+        return "push"  # this is called 'write' in UI
+    elif permission.triage:
+        return "triage"
+    elif permission.pull:
+        return "read"
+    return None
+
+
 class GitHubTeamMover():
-    def __init__(self, org, dry_run):
+    def __init__(self, org, dry_run, workers=8):
         self.connect()
         self.get_org(org)
         self.dry_run = dry_run
+        self.workers = workers
+        self.teams = {}
+        self.repos = {}
+        self.repo_teams = None
 
     def connect(self):
         try:
@@ -29,15 +48,45 @@ class GitHubTeamMover():
     def get_org(self, org):
         self.org = self.g.get_organization(org)
 
+    def get_team(self, team_slug):
+        if team_slug not in self.teams:
+            self.teams[team_slug] = self.org.get_team_by_slug(team_slug)
+        return self.teams[team_slug]
+
+    def get_team_repos(self, team):
+        # The repositories listed for a team carry that team's permissions
+        return team.slug, [
+            (repo, role_from_permission(repo.permissions))
+            for repo in team.get_repos()
+        ]
+
+    def get_repo_teams(self):
+        """
+        Build a map of repo full name -> {team slug: role} for the whole org,
+        listing each team's repositories once rather than each repository's
+        teams
+        """
+        if self.repo_teams is None:
+            teams = list(self.org.get_teams())
+            self.teams.update({team.slug: team for team in teams})
+            self.repo_teams = {}
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for slug, repos in executor.map(self.get_team_repos, teams):
+                    for repo, role in repos:
+                        self.repos[repo.full_name] = repo
+                        self.repo_teams.setdefault(
+                            repo.full_name, {})[slug] = role
+        return self.repo_teams
+
     def get_repos_team_present_in(self, team_slug):
-        repos = []
-        for repo in self.org.get_repos():
-            if(team_slug in [t.slug for t in repo.get_teams()]):
-                repos.append(repo)
-        return repos
+        return [
+            self.repos[name]
+            for name, teams in sorted(self.get_repo_teams().items())
+            if team_slug in teams
+        ]
 
     def remove_from_repo(self, team_slug, repo):
-        team = self.org.get_team_by_slug(team_slug)
+        team = self.get_team(team_slug)
         print("Removing", team.slug, "from", repo.name, "...", end=" ")
         if not self.dry_run:
             team.remove_from_repos(repo)
@@ -46,7 +95,7 @@ class GitHubTeamMover():
             print("no action (dry run)")
 
     def add_to_repo(self, team_slug, repo, role):
-        team = self.org.get_team_by_slug(team_slug)
+        team = self.get_team(team_slug)
         print("Adding", team.slug, "to", repo.name,
               f"({role} access) ...", end=" ")
         if not self.dry_run:
@@ -57,19 +106,8 @@ class GitHubTeamMover():
             print("no action (dry run)")
 
     def get_repo_role(self, team_slug, repo):
-        team = self.org.get_team_by_slug(team_slug)
-        permission = team.get_repo_permission(repo)
-        if permission.admin:
-            role = "admin"
-        elif permission.maintain:
-            role = "maintain"
-        elif permission.push:
-            role = "push"  # this is called 'write' in UI
-        elif permission.triage:
-            role = "triage"
-        elif permission.pull:
-            role = "read"
-        else:
+        role = self.get_repo_teams().get(repo.full_name, {}).get(team_slug)
+        if role is None:
             print(
                 f"Couldn't determine permission for {team_slug} on ",
                 repo.full_name)
@@ -79,10 +117,26 @@ class GitHubTeamMover():
     def set_repo_role(self, team, repo, role):
         return team.update_team_repository(repo, role)
 
+    def show_diff(self, from_team, to_team):
+        """
+        Print the permission changes switching teams would make to each repo
+        """
+        print(f"Permission changes replacing {from_team} with {to_team}:")
+        for repo in self.get_repos_team_present_in(from_team):
+            teams = self.get_repo_teams()[repo.full_name]
+            print(f"  {repo.full_name}:")
+            print(f"    - {from_team} ({teams[from_team]})")
+            if to_team in teams:
+                print(f"    ~ {to_team} ({teams[to_team]} -> "
+                      f"{teams[from_team]})")
+            else:
+                print(f"    + {to_team} ({teams[from_team]})")
+
     def switch_teams(self, from_team, to_team):
+        self.show_diff(from_team, to_team)
         repos_present_in = self.get_repos_team_present_in(from_team)
         for repo in repos_present_in:
-            role = self.get_repo_role(from_team, repo.full_name)
+            role = self.get_repo_role(from_team, repo)
             self.add_to_repo(to_team, repo, role)
             self.remove_from_repo(from_team, repo)
 
@@ -93,8 +147,11 @@ parser.add_argument('--org', action='store', required=True)
 parser.add_argument('--from-team-slug', action='store', required=True)
 parser.add_argument('--to-team-slug', action='store', required=True)
 parser.add_argument('--dry-run', action='store_true')
+parser.add_argument('--workers', action='store', type=int, default=8,
+                    help='Number of teams whose repositories are listed '
+                    'concurrently')
 args = parser.parse_args()
 
 
-team = GitHubTeamMover(args.org, args.dry_run)
+team = GitHubTeamMover(args.org, args.dry_run, args.workers)
 team.switch_teams(args.from_team_slug, args.to_team_slug)
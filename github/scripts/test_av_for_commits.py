@@ -0,0 +1,144 @@
+"""
+Checks of av-for-commits against a stub GitHub API server. Run with
+"python3 -m unittest" or pytest from this directory.
+"""
+
+import importlib.machinery
+import importlib.util
+import json
+import re
+import threading
+import unittest
+
+from github import Github
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+loader = importlib.machinery.SourceFileLoader(
+    "av_for_commits", str(SCRIPT_DIR / "av-for-commits"))
+spec = importlib.util.spec_from_loader("av_for_commits", loader)
+av_for_commits = importlib.util.module_from_spec(spec)
+loader.exec_module(av_for_commits)
+
+REPO = "couchbasecloud/couchbase-cloud"
+
+
+def sha(n):
+    return f"{n:040x}"
+
+
+class StubGitHub(BaseHTTPRequestHandler):
+    """
+    Serves the repository, compare, commit and commit pulls endpoints
+    from the class attributes below
+    """
+
+    # Commit SHA: list of (PR number, PR body)
+    pulls = {}
+    # "base...head": (total_commits, listed commit SHAs)
+    ranges = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def commit(self, commit_sha):
+        return {
+            "sha": commit_sha,
+            "url": f"{self.base}/repos/{REPO}/commits/{commit_sha}",
+        }
+
+    def do_GET(self):
+        self.base = f"http://{self.headers['Host']}"
+        path = self.path.split("?")[0]
+        if path == f"/repos/{REPO}":
+            return self.send_json({
+                "full_name": REPO,
+                "name": REPO.split("/")[1],
+                "url": f"{self.base}/repos/{REPO}",
+            })
+        match = re.fullmatch(rf"/repos/{REPO}/compare/(.*)", path)
+        if match and match[1] in self.ranges:
+            total, shas = self.ranges[match[1]]
+            return self.send_json({
+                "url": f"{self.base}{path}",
+                "total_commits": total,
+                "commits": [self.commit(s) for s in shas],
+            })
+        match = re.fullmatch(rf"/repos/{REPO}/commits/(\w+)(/pulls)?", path)
+        if match and match[1] in self.pulls:
+            if match[2] is None:
+                return self.send_json(self.commit(match[1]))
+            return self.send_json([
+                {"number": number, "body": body}
+                for number, body in self.pulls[match[1]]
+            ])
+        self.send_json({"message": "Not Found"}, 404)
+
+
+class AvForCommitsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGitHub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        StubGitHub.pulls = {
+            sha(1): [(101, "Jira\n* [AV-1001](https://example.com)")],
+            sha(2): [(102, "Jira  * AV-1002")],
+            sha(3): [(103, "No ticket here")],
+            sha(4): [],
+            sha(5): [(105, "Jira * AV-1005"), (106, "Jira * AV-1006")],
+        }
+        StubGitHub.ranges = {
+            f"{sha(0)}...{sha(2)}": (2, [sha(1), sha(2)]),
+            # As the compare API lists at most 250 commits
+            f"{sha(0)}...{sha(9)}": (300, [sha(1), sha(2)]),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def check(self, specs):
+        av = av_for_commits.AvForCommits(None, jobs=4)
+        av.gh = Github(
+            base_url=f"http://127.0.0.1:{self.server.server_port}")
+        av.add_commits(REPO, specs)
+        return av
+
+    def test_range(self):
+        av = self.check([f"{sha(0)}..{sha(2)}"])
+        self.assertEqual(av.failures, {})
+        self.assertEqual(
+            {s: info["ticket"] for s, info in av.commits.items()},
+            {sha(1): "AV-1001", sha(2): "AV-1002"})
+        self.assertEqual(av.commits[sha(1)]["pr"], 101)
+
+    def test_failures(self):
+        av = self.check([sha(3), sha(4), sha(5), "f" * 40])
+        self.assertEqual(av.commits, {})
+        self.assertIn("no associated Jira link", av.failures[sha(3)])
+        self.assertEqual(av.failures[sha(4)], "Commit has 0 != 1 PRs")
+        self.assertEqual(av.failures[sha(5)], "Commit has 2 != 1 PRs")
+        self.assertIn("Unable to look up commit", av.failures["f" * 40])
+
+    def test_truncated_range(self):
+        spec = f"{sha(0)}..{sha(9)}"
+        av = self.check([spec])
+        self.assertIn("Range has 300 commits", av.failures[spec])
+        # The commits which were listed are still reported
+        self.assertEqual(set(av.commits), {sha(1), sha(2)})
+
+
+if __name__ == "__main__":
+    unittest.main()
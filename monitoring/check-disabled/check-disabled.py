@@ -1,54 +1,137 @@
 #!/usr/bin/python
 
+# Warns when any of the given Jenkins jobs have been disabled.
+#
+# The jobs in each folder of each Jenkins are looked up with a single
+# tree query, and the Jenkins instances are queried concurrently. The
+# jobs found disabled are recorded in a state file along with when they
+# were first seen disabled, so a job is only alerted on when it becomes
+# disabled; while it stays disabled it is just reported.
+
 import base64
 import sys
 import json
 import os
 import argparse
 import socket
-from urllib.error import URLError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.error import HTTPError, URLError
 from urllib.request import Request, urlopen
 
+DEFAULT_JENKINS = "server.jenkins.couchbase.com"
+
 parser = argparse.ArgumentParser()
-parser.add_argument("jenkins", type=str, help="Jenkins to connect to",
-    nargs='?', default="server.jenkins.couchbase.com")
-parser.add_argument("--job", type=str, help="Job name(s)",
+parser.add_argument("jenkins", type=str, help="Jenkins(es) to connect to",
+    nargs='*', default=[DEFAULT_JENKINS])
+parser.add_argument("--job", type=str,
+    help="Job name(s), optionally as JENKINS:JOB to check a job on only "
+         "one Jenkins; jobs in folders are given as FOLDER/job/JOB",
     nargs="+", required=True)
+parser.add_argument("--state-file", type=str, default="check-disabled.json",
+    help="File recording which jobs were found disabled, and when")
 args = parser.parse_args()
 
-jenkins = args.jenkins
-jobs = args.job
-
 if not os.environ.get('jenkins_user') or not os.environ.get('jenkins_token'):
-    print("Authentication required for '{0}'".format(jenkins))
+    print("Authentication required for '{0}'".format(", ".join(args.jenkins)))
     print("Ensure jenkins_user and jenkins_token environment variables are populated")
     exit(1)
 
-joburl = 'http://{0}/job/{1}/api/json'
-warning = False
-for job in jobs:
-    request = Request(joburl.format(jenkins, job))
-    auth_arg = '%s:%s' % (os.environ.get('jenkins_user'), os.environ.get('jenkins_token'))
-    base64string = base64.b64encode(auth_arg.encode())
+auth_arg = '%s:%s' % (os.environ.get('jenkins_user'), os.environ.get('jenkins_token'))
+base64string = base64.b64encode(auth_arg.encode())
+
+# Group the jobs to check by Jenkins and folder, as one query returns
+# every job in a folder
+folders = {}
+for job in args.job:
+    jenkins, sep, name = job.rpartition(':')
+    jenkinses = [jenkins] if sep else args.jenkins
+    folder, sep, name = name.rpartition('/job/')
+    for jenkins in jenkinses:
+        folders.setdefault((jenkins, folder), set()).add(name)
+
+
+def get_folder_jobs(jenkins, folder):
+    """
+    Returns a dict of job name to whether it's disabled for every job in a
+    folder ('' for the top level), None if the request timed out, or an
+    empty dict if the folder doesn't exist
+    """
+
+    url = f'http://{jenkins}/'
+    if folder:
+        url += f'job/{folder}/'
+    url += 'api/json?tree=jobs[name,disabled,color]'
+    request = Request(url)
     request.add_header("Authorization", "Basic %s" % base64string.decode())
     try:
         response = urlopen(request, timeout=20)
+    except HTTPError as e:
+        # Every job in a missing folder is then reported as not found
+        if e.code == 404:
+            print(f"Folder '{folder}' not found on {jenkins}")
+            return {}
+        raise
     except URLError as e:
         # We get occasional timeouts, which we'd rather not hear about
         # since this script will run again in 15 minutes anyway. By setting
         # timeout=20 above, urllib will abort with a socket.timeout after
         # 20 seconds, so catch that here.
         if isinstance(e.reason, socket.timeout):
-            print("Got a timeout; ignoring")
-            continue
+            print(f"Got a timeout from {jenkins}; ignoring")
+            return None
         else:
             raise
+    except socket.timeout:
+        print(f"Got a timeout from {jenkins}; ignoring")
+        return None
+
+    # Some job types don't report "disabled", but show it as their color
+    return {
+        jobdata['name']: jobdata.get('disabled', jobdata.get('color') == 'disabled')
+        for jobdata in json.load(response).get('jobs', [])
+    }
+
+
+try:
+    with open(args.state_file) as f:
+        state = json.load(f)
+except FileNotFoundError:
+    state = {}
+
+with ThreadPoolExecutor(max_workers=len(folders)) as executor:
+    results = {
+        key: executor.submit(get_folder_jobs, *key) for key in folders
+    }
+    results = {key: future.result() for key, future in results.items()}
+
+now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+warning = False
+for (jenkins, folder), names in sorted(folders.items()):
+    found = results[(jenkins, folder)]
+    if found is None:
+        # Timed out; leave the state of these jobs as it was
+        continue
 
-    jobdata = json.load(response)
+    for name in sorted(names):
+        job = f"{folder}/job/{name}" if folder else name
+        key = f"{jenkins}:{job}"
+        if name not in found:
+            print(f"\n\n\n*************\nWarning: Job '{job}' not found on {jenkins}\n**************")
+            warning = True
+        elif found[name]:
+            if key in state:
+                print(f"Job '{job}' on {jenkins} has been disabled since {state[key]}")
+            else:
+                print(f"\n\n\n*************\nWarning: Job '{job}' on {jenkins} is currently disabled\n**************")
+                state[key] = now
+                warning = True
+        elif key in state:
+            print(f"Job '{job}' on {jenkins} has been re-enabled (was disabled since {state.pop(key)})")
 
-    if (jobdata['disabled']):
-        print(f"\n\n\n*************\nWarning: Job '{job}' is currently disabled\n**************")
-        warning = True
+with open(f"{args.state_file}.tmp", 'w') as f:
+    json.dump(state, f, indent=2, sort_keys=True)
+os.replace(f"{args.state_file}.tmp", args.state_file)
 
 if warning:
     sys.exit(1)
@@ -0,0 +1,188 @@
+"""
+Checks of check-disabled.py run against a local stub Jenkins serving job
+JSON. Run with "python3 -m unittest" or pytest from this directory.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse
+
+SCRIPT = Path(__file__).resolve().parent / "check-disabled.py"
+
+
+class StubJenkins(BaseHTTPRequestHandler):
+    """
+    Serves the jobs of each folder in the folders class attribute ('' for
+    the top level), recording the paths requested
+    """
+
+    # Folder: {job name: job data}
+    folders = {}
+    paths = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        StubJenkins.paths.append(url.path)
+        if self.headers["Authorization"] != "Basic dXNlcjp0b2tlbg==":
+            return self.send_json({}, 401)
+        folder = url.path[:-len("/api/json")].strip("/")
+        if folder.startswith("job/"):
+            folder = folder[len("job/"):]
+        if folder not in self.folders:
+            return self.send_json({}, 404)
+        self.send_json({"jobs": [
+            dict(data, name=name) for name, data in self.folders[folder].items()
+        ]})
+
+
+class CheckDisabledTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubJenkins)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.jenkins = f"127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmpdir.name, "state.json")
+        StubJenkins.folders = {
+            "": {
+                "build-sanity": {"disabled": False},
+                "nightly": {"disabled": True},
+                # Some job types only show they're disabled by their color
+                "pipeline": {"color": "disabled"},
+            },
+            "cbdeps/job/ci": {
+                "cbdep-build": {"disabled": False},
+                "cbdep-old": {"disabled": True},
+            },
+        }
+        StubJenkins.paths = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check(self, *jobs, jenkinses=None, env=None):
+        """
+        Runs check-disabled.py for jobs against the stub Jenkins, returning
+        its exit code and output
+        """
+        if jenkinses is None:
+            jenkinses = [self.jenkins]
+        if env is None:
+            env = dict(os.environ, jenkins_user="user", jenkins_token="token")
+        result = subprocess.run(
+            [sys.executable, str(SCRIPT), *jenkinses,
+             "--state-file", self.state_file, "--job", *jobs],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True)
+        return result.returncode, result.stdout
+
+    def state(self):
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def test_enabled(self):
+        code, output = self.check("build-sanity", "cbdeps/job/ci/job/cbdep-build")
+        self.assertEqual(code, 0, output)
+        self.assertEqual(output, "")
+        self.assertEqual(self.state(), {})
+
+    def test_newly_disabled(self):
+        code, output = self.check("nightly", "pipeline")
+        self.assertEqual(code, 1, output)
+        self.assertIn(f"Job 'nightly' on {self.jenkins} is currently disabled",
+                      output)
+        self.assertIn(f"Job 'pipeline' on {self.jenkins} is currently disabled",
+                      output)
+        state = self.state()
+        self.assertEqual(sorted(state), [
+            f"{self.jenkins}:nightly", f"{self.jenkins}:pipeline"])
+
+        # Still disabled: reported, but not warned about again
+        code, output = self.check("nightly", "pipeline")
+        self.assertEqual(code, 0, output)
+        self.assertIn(
+            f"Job 'nightly' on {self.jenkins} has been disabled since "
+            f"{state[f'{self.jenkins}:nightly']}", output)
+        self.assertNotIn("Warning", output)
+        self.assertEqual(self.state(), state)
+
+    def test_reenabled(self):
+        key = f"{self.jenkins}:cbdeps/job/ci/job/cbdep-build"
+        with open(self.state_file, "w") as f:
+            json.dump({key: "2024-01-01 00:00:00 UTC"}, f)
+        code, output = self.check("cbdeps/job/ci/job/cbdep-build")
+        self.assertEqual(code, 0, output)
+        self.assertIn(
+            f"Job 'cbdeps/job/ci/job/cbdep-build' on {self.jenkins} has been "
+            "re-enabled (was disabled since 2024-01-01 00:00:00 UTC)", output)
+        self.assertEqual(self.state(), {})
+
+    def test_one_request_per_folder(self):
+        code, output = self.check(
+            "build-sanity", "nightly", "cbdeps/job/ci/job/cbdep-build",
+            "cbdeps/job/ci/job/cbdep-old")
+        self.assertEqual(code, 1, output)
+        self.assertEqual(sorted(StubJenkins.paths), [
+            "/api/json", "/job/cbdeps/job/ci/api/json"])
+        self.assertEqual(sorted(self.state()), [
+            f"{self.jenkins}:cbdeps/job/ci/job/cbdep-old",
+            f"{self.jenkins}:nightly"])
+
+    def test_missing(self):
+        code, output = self.check("no-such-job", "nosuchfolder/job/anything")
+        self.assertEqual(code, 1, output)
+        self.assertIn(f"Folder 'nosuchfolder' not found on {self.jenkins}",
+                      output)
+        self.assertIn(f"Job 'no-such-job' not found on {self.jenkins}", output)
+        self.assertIn(
+            f"Job 'nosuchfolder/job/anything' not found on {self.jenkins}",
+            output)
+        self.assertEqual(self.state(), {})
+
+    def test_job_on_one_jenkins(self):
+        # The other Jenkins (with nothing listening) isn't asked about
+        # the job
+        code, output = self.check(
+            f"{self.jenkins}:nightly", jenkinses=[self.jenkins, "127.0.0.1:1"])
+        self.assertEqual(code, 1, output)
+        self.assertEqual(StubJenkins.paths, ["/api/json"])
+
+    def test_no_credentials(self):
+        code, output = self.check("nightly", env={
+            key: value for key, value in os.environ.items()
+            if key not in ("jenkins_user", "jenkins_token")
+        })
+        self.assertEqual(code, 1)
+        self.assertIn("Authentication required", output)
+        self.assertEqual(StubJenkins.paths, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
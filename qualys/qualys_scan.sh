@@ -26,6 +26,9 @@ EOF
 
 echo -e "password = ${QUALYS_PASSWORD}" >> ${QUALYS_CONFIG}
 
+# Scans in flight are tracked here, so a restarted job reattaches to them
+SCAN_STATE=/tmp/was-scan-state.${SCAN_TYPE}-${WEB_NAME}.json
+
 PROFILE_ID="178884"
 case $PRODUCT in
   sync_gateway)
@@ -57,6 +60,7 @@ python3 ${SCRIPT_DIR}/was_scan.py \
   --scan-type-name ${SCAN_TYPE} \
   --bld-num ${BLD_NUM} \
   --qualys-config ${QUALYS_CONFIG} \
+  --state-file ${SCAN_STATE} \
   --debug
 
 # cleanup old scans
@@ -85,4 +89,5 @@ curl -u "cuchb3ws:${QUALYS_PASSWORD}" \
 echo "Deactivating virtualenv ..."
 deactivate
 rm -rf ${QUALYS_CONFIG}
+rm -f ${SCAN_STATE}
 rm -rf /tmp/${VIRTUALENV_NAME}
@@ -0,0 +1,260 @@
+"""
+Checks of the WAS scan polling in was_scan.py against a fake Qualys API
+and a fake clock. Run with "python3 -m unittest" or pytest from this
+directory.
+"""
+
+import argparse
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+import was_scan
+from was_scan import ScanPoller, next_poll_delay
+
+WEBAPP_ID = '2695834'
+
+
+class FakeClock:
+    ''' Stands in for the time module, advancing only when slept '''
+
+    def __init__(self, now=1700000000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        assert seconds >= 0
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeQualys:
+    '''
+    Answers the WAS API calls made by was_scan.py. Each scan and report
+    reports the statuses in its list in turn, staying at the last one.
+    '''
+
+    def __init__(self, scan_statuses=('RUNNING', 'RUNNING', 'FINISHED'),
+                 report_statuses=('RUNNING', 'COMPLETE')):
+        self.scan_statuses = scan_statuses
+        self.report_statuses = report_statuses
+        self.scans = {}
+        self.reports = {}
+        self.calls = []
+
+    def response(self, data):
+        return (
+            '<ServiceResponse><responseCode>SUCCESS</responseCode>'
+            f'<data>{data}</data></ServiceResponse>'
+        )
+
+    def next_status(self, statuses):
+        return statuses.pop(0) if len(statuses) > 1 else statuses[0]
+
+    def request(self, api_call, data=None, http_method=None):
+        self.calls.append(api_call)
+        parts = api_call.strip('/').split('/')
+        if parts[:3] == ['update', 'was', 'webapp']:
+            return self.response(f'<WebApp><id>{parts[3]}</id></WebApp>')
+        if parts[:3] == ['launch', 'was', 'wasscan']:
+            scan_id = str(1000 + len(self.scans))
+            self.scans[scan_id] = list(self.scan_statuses)
+            return self.response(f'<WasScan><id>{scan_id}</id></WasScan>')
+        if parts[:3] == ['status', 'was', 'wasscan']:
+            if parts[3] not in self.scans:
+                return (
+                    '<ServiceResponse><responseCode>NOT_FOUND</responseCode>'
+                    '<responseErrorDetails><errorMessage>No such scan'
+                    '</errorMessage></responseErrorDetails></ServiceResponse>'
+                )
+            status = self.next_status(self.scans[parts[3]])
+            return self.response(
+                f'<WasScan><status>{status}</status></WasScan>')
+        if parts[:3] == ['create', 'was', 'report']:
+            report_id = str(5000 + len(self.reports))
+            self.reports[report_id] = list(self.report_statuses)
+            return self.response(f'<Report><id>{report_id}</id></Report>')
+        if parts[:3] == ['status', 'was', 'report']:
+            status = self.next_status(self.reports[parts[3]])
+            return self.response(
+                f'<Report><status>{status}</status></Report>')
+        if parts[:3] == ['download', 'was', 'report']:
+            return b'%PDF-1.4 report ' + parts[3].encode()
+        raise AssertionError(f'unexpected call {api_call}')
+
+    def count(self, prefix):
+        return sum(call.startswith(prefix) for call in self.calls)
+
+
+class WasScanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.state_file = os.path.join(self.tmpdir.name, 'scans.json')
+        self.clock = FakeClock()
+        clock = mock.patch.object(was_scan, 'time', self.clock)
+        clock.start()
+        self.addCleanup(clock.stop)
+        # Reports are downloaded to the current directory
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def poll(self, poller):
+        with self.assertLogs(level='INFO') as logs:
+            result = poller.run()
+        return result, logs.output
+
+    def test_next_poll_delay(self):
+        start = self.clock.now
+        with mock.patch.object(was_scan.random, 'uniform', return_value=1):
+            # Backs off exponentially from the minimum interval
+            self.assertEqual(next_poll_delay(0, start, 3600), 15)
+            self.assertEqual(next_poll_delay(3, start, 3600), 120)
+            self.assertEqual(next_poll_delay(10, start, 3600), 600)
+            # but not far past when it's expected to be ready
+            self.assertEqual(next_poll_delay(5, start, 100), 100)
+            # and once overdue, polls at the overdue interval
+            self.clock.now += 100
+            self.assertEqual(next_poll_delay(5, start, 100), 60)
+            self.assertEqual(next_poll_delay(0, start, 100), 15)
+
+        # Jitter takes off up to half, but never below the minimum
+        with mock.patch.object(was_scan.random, 'uniform', return_value=0.5):
+            self.assertEqual(next_poll_delay(4, start, 3600), 120)
+            self.assertEqual(next_poll_delay(0, start, 3600), 15)
+        for attempt in range(8):
+            delay = next_poll_delay(attempt, start, 3600)
+            self.assertGreaterEqual(delay, 15)
+            self.assertLessEqual(delay, 600)
+
+    def test_scan_and_report(self):
+        qgc = FakeQualys(
+            scan_statuses=['SUBMITTED', 'RUNNING', 'RUNNING', 'FINISHED'])
+        poller = ScanPoller(qgc, self.state_file)
+        poller.add('1000', WEBAPP_ID, 'report')
+        qgc.scans['1000'] = list(qgc.scan_statuses)
+
+        with mock.patch.object(was_scan.random, 'uniform', return_value=1):
+            result, _ = self.poll(poller)
+        self.assertTrue(result)
+        self.assertEqual(qgc.count('/status/was/wasscan'), 4)
+        self.assertEqual(qgc.count('/status/was/report'), 2)
+        # Scan polls back off, then the report is polled at once and from
+        # the minimum interval again
+        self.assertEqual(self.clock.sleeps, [15, 30, 60, 0, 15])
+        with open('report_5000.pdf', 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.4 report 5000')
+        with open(self.state_file) as f:
+            self.assertEqual(f.read(), '{}')
+
+    def test_concurrent_scans(self):
+        qgc = FakeQualys()
+        poller = ScanPoller(qgc)
+        for scan_id, webapp_id in [('1000', 'a'), ('1001', 'b')]:
+            qgc.scans[scan_id] = list(qgc.scan_statuses)
+            poller.add(scan_id, webapp_id, f'report-{webapp_id}')
+        with mock.patch.object(was_scan.random, 'uniform', return_value=1):
+            result, _ = self.poll(poller)
+        self.assertTrue(result)
+        # Both are polled in the same rounds
+        self.assertEqual(self.clock.sleeps, [15, 30, 0, 15])
+        self.assertEqual(qgc.count('/status/was/wasscan'), 6)
+        self.assertTrue(os.path.exists('report-a_5000.pdf'))
+        self.assertTrue(os.path.exists('report-b_5001.pdf'))
+
+    @mock.patch.object(was_scan.random, 'uniform', return_value=1)
+    def test_reattach(self, uniform):
+        qgc = FakeQualys(scan_statuses=['RUNNING'] * 3 + ['FINISHED'])
+        poller = ScanPoller(qgc, self.state_file)
+        qgc.scans['1000'] = list(qgc.scan_statuses)
+        poller.add('1000', WEBAPP_ID, 'report')
+
+        # The job dies part way through polling
+        qgc.request = mock.Mock(side_effect=[
+            qgc.request('/status/was/wasscan/1000'),
+            qgc.request('/status/was/wasscan/1000'),
+            KeyboardInterrupt,
+        ])
+        with self.assertRaises(KeyboardInterrupt):
+            self.poll(poller)
+
+        # A new poller picks up where the old one left off
+        qgc = FakeQualys(scan_statuses=['RUNNING', 'FINISHED'])
+        qgc.scans['1000'] = list(qgc.scan_statuses)
+        poller = ScanPoller(qgc, self.state_file)
+        self.assertEqual(poller.in_flight(WEBAPP_ID), ['1000'])
+        self.assertEqual(poller.in_flight('other'), [])
+        # The interrupted poll was due, so is made again at once, and the
+        # backoff carries on from where it was
+        self.assertEqual(poller.scans['1000']['attempt'], 2)
+        self.assertLessEqual(poller.scans['1000']['next_poll'], self.clock.now)
+        sleeps = len(self.clock.sleeps)
+        result, _ = self.poll(poller)
+        self.assertTrue(result)
+        self.assertEqual(self.clock.sleeps[sleeps:], [60, 0, 15])
+        self.assertTrue(os.path.exists('report_5000.pdf'))
+
+    def run_main(self, qgc):
+        args = argparse.Namespace(
+            web_url='http://192.0.2.1:8091', webapp_id=WEBAPP_ID,
+            web_name='Couchbase Server', profile_id='1',
+            scan_type_name='VULNERABILITY', bld_num='1234',
+            qualys_config='qualys.config', state_file=self.state_file)
+        with mock.patch.object(
+                was_scan.qualysapi, 'connect', return_value=qgc), \
+                self.assertLogs(level='INFO') as logs:
+            was_scan.main(args)
+        return logs.output
+
+    def test_main_launches(self):
+        qgc = FakeQualys()
+        self.run_main(qgc)
+        self.assertEqual(qgc.count('/launch/was/wasscan'), 1)
+        self.assertTrue(os.path.exists(
+            'Scan_Report_Couchbase Server_1234_VULNERABILITY_5000.pdf'))
+
+    def test_main_reattaches(self):
+        qgc = FakeQualys()
+        qgc.scans['999'] = ['RUNNING', 'FINISHED']
+        ScanPoller(qgc, self.state_file).add('999', WEBAPP_ID, 'earlier')
+
+        logs = self.run_main(qgc)
+        self.assertIn('INFO:root:Reattaching to in-flight scans: 999', logs)
+        self.assertEqual(qgc.count('/update/was/webapp'), 0)
+        self.assertEqual(qgc.count('/launch/was/wasscan'), 0)
+        self.assertTrue(os.path.exists('earlier_5000.pdf'))
+
+    def test_failures(self):
+        qgc = FakeQualys(scan_statuses=['RUNNING'])
+        poller = ScanPoller(qgc, self.state_file)
+        # Never finishes
+        qgc.scans['1000'] = ['RUNNING']
+        poller.add('1000', 'a', 'report-a')
+        # Deleted from Qualys
+        poller.add('1001', 'b', 'report-b')
+
+        with mock.patch.object(was_scan.random, 'uniform', return_value=1):
+            result, logs = self.poll(poller)
+        self.assertFalse(result)
+        self.assertEqual(poller.failed, ['1001', '1000'])
+        self.assertIn('ERROR:root:Scans failed: 1001, 1000', logs)
+        self.assertGreater(self.clock.now - 1700000000.0, was_scan.SCAN_TIMEOUT)
+        # Once overdue, it was polled at the overdue interval
+        self.assertEqual(set(self.clock.sleeps[-10:]), {60})
+
+        qgc = FakeQualys()
+        ScanPoller(qgc, self.state_file).add('1002', WEBAPP_ID, 'gone')
+        with self.assertRaises(SystemExit) as cm:
+            self.run_main(qgc)
+        self.assertEqual(cm.exception.code, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
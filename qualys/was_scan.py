@@ -3,6 +3,8 @@
 import sys
 import os
 import datetime
+import json
+import random
 import time
 import argparse
 from argparse import RawTextHelpFormatter
@@ -22,6 +24,22 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.os.environ['LOG_LEVEL'])
 
+# Polling backs off exponentially between these intervals (in seconds), but
+# doesn't wait much past the time a scan or report is expected to be ready
+MIN_POLL_INTERVAL = 15
+MAX_POLL_INTERVAL = 600
+SCAN_EXPECTED_DURATION = 600
+REPORT_EXPECTED_DURATION = 60
+
+# Once a scan or report has taken longer than expected, it is polled at
+# this interval, as it could be ready at any moment
+OVERDUE_POLL_INTERVAL = 60
+
+# Scans are abandoned this long after launch, a little after Qualys should
+# have cancelled them (cancelAfterNHours). Sometimes, scans get stuck in
+# various states even when cancelled.
+SCAN_TIMEOUT = 310 * 60
+
 
 def update_scan_url(qgc, current_time, args):
     ''' Update WAS scan Name and IP/URL '''
@@ -61,7 +79,9 @@ def update_scan_url(qgc, current_time, args):
         return root.data.WebApp.id.text
 
 
-def scan_report(qgc, current_time, args, scan_id):
+def launch_scan(qgc, current_time, args, scan_id):
+    ''' Launch a WAS scan of a webapp, returning the scan id '''
+
     call = '/launch/was/wasscan'
 
     # The scan typically takes less than 10 minutes.
@@ -116,53 +136,27 @@ def scan_report(qgc, current_time, args, scan_id):
         scan_id = root.data.WasScan.id.text
         logger.debug('Scan launch result: %s', xml_output.encode('utf-8'))
 
-    # Get scan status
-    # Exit the loop after one hour based on cancelAfterNHours value above.
-    # Sometime, scan may get stuck in various states even when it is cancelled.
-    call = '/status/was/wasscan' + '/' + scan_id
-    sleep_time = 60
-    count = 0
-
-    while True:
-        count = count + 1
-        xml_output = qgc.request(call, http_method='get')
-        scan_root = objectify.fromstring(xml_output.encode('utf-8'))
-        if scan_root.responseCode != 'SUCCESS':
-            # Unable to obtain scan status if scan_id is invalid or scan is
-            # deleted.
-            logger.error(
-                'Error found when getting scan result: %s',
-                scan_root.responseErrorDetails.errorMessage.text)
-            logger.error(
-                'Scan result response code: %s',
-                scan_root.responseCode)
-            sys.exit(1)
-
-        if count <= 310:
-            if scan_root.data.WasScan.status != 'FINISHED':
-                time.sleep(sleep_time)
-                logger.info(
-                    'Wait for scan to finish.  Current scan status: %s',
-                    scan_root.data.WasScan.status)
-                logger.info('Sleep for 60 seconds... %s', sleep_time)
-            else:
-                break
-        else:
-            logger.error(
-                'Scan did not finish in expected time frame. aborting...')
-            logger.error('Scan result: %s', xml_output.encode('utf-8'))
-            sys.exit(1)
+    logger.info('Launched scan: %s', scan_id)
+    return scan_id
 
-    try:
-        logger.info(
-            'Scan finished successfully! Scan id: %s',
-            scan_root.data.WasScan.id.text)
-        return scan_root.data.WasScan.id.text
-    except AttributeError as error:
+
+def get_scan_status(qgc, scan_id):
+    ''' Get the status of a WAS scan, or None if it cannot be found '''
+
+    call = '/status/was/wasscan' + '/' + scan_id
+    xml_output = qgc.request(call, http_method='get')
+    scan_root = objectify.fromstring(xml_output.encode('utf-8'))
+    if scan_root.responseCode != 'SUCCESS':
+        # Unable to obtain scan status if scan_id is invalid or scan is
+        # deleted.
         logger.error(
-            'Error found when looking up scan_root.data.WasScan.id.text: %s',
-            error)
-        sys.exit(1)
+            'Error found when getting scan result: %s',
+            scan_root.responseErrorDetails.errorMessage.text)
+        logger.error(
+            'Scan result response code: %s',
+            scan_root.responseCode)
+        return None
+    return scan_root.data.WasScan.status.text
 
 
 def get_report_status(qgc, report_id):
@@ -181,8 +175,8 @@ def get_report_status(qgc, report_id):
 # template id 68837, is the default Scan Report template under our account.
 
 
-def generate_report(qgc, args, was_scan_id):
-    ''' Generate scan report from scan_id '''
+def create_report(qgc, was_scan_id):
+    ''' Start generating a scan report from scan_id, returning its id '''
 
     call = '/create/was/report'
     request_xml_header = '''
@@ -227,27 +221,148 @@ def generate_report(qgc, args, was_scan_id):
         report_id = root.data.Report.id.text
         logger.info('Report id: %s', report_id)
 
-    # Download report
-    if report_id:
-        call = '/download/was/report/' + report_id
-        sleep_time = 60
-        while True:
-            # get report status
-            scan_status = get_report_status(qgc, report_id)
-            if scan_status != 'COMPLETE':
-                time.sleep(sleep_time)
-                logger.info('Sleeping ... %s', sleep_time)
-            else:
-                break
-
-        output = qgc.request(call, http_method='get')
-        pdf_report_name = "Scan_Report_" + args.web_name + '_' + \
-            args.bld_num + '_' + args.scan_type_name + '_' + report_id + ".pdf"
-        with open(pdf_report_name, "wb") as report:
-            report.write(output)
-        logger.info(
-            'Report has been downloaded successfully: %s',
-            pdf_report_name)
+    return report_id
+
+
+def download_report(qgc, report_id, report_prefix):
+    ''' Download a completed scan report '''
+
+    call = '/download/was/report/' + report_id
+    output = qgc.request(call, http_method='get')
+    pdf_report_name = report_prefix + '_' + report_id + ".pdf"
+    with open(pdf_report_name, "wb") as report:
+        report.write(output)
+    logger.info(
+        'Report has been downloaded successfully: %s',
+        pdf_report_name)
+
+
+def next_poll_delay(attempt, started, expected_duration):
+    '''
+    Exponential backoff with jitter, capped by the time remaining until
+    the scan or report is expected to be ready, or by
+    OVERDUE_POLL_INTERVAL once that time has passed
+    '''
+
+    delay = min(MAX_POLL_INTERVAL, MIN_POLL_INTERVAL * 2 ** attempt)
+    remaining = started + expected_duration - time.time()
+    if remaining > MIN_POLL_INTERVAL:
+        delay = min(delay, remaining)
+    else:
+        delay = min(delay, OVERDUE_POLL_INTERVAL)
+    return max(MIN_POLL_INTERVAL, delay * random.uniform(0.5, 1))
+
+
+class ScanPoller:
+    '''
+    Tracks any number of WAS scans at once, generating and downloading
+    each scan's report as soon as the scan finishes.
+
+    The scans are saved to state_file (if given) whenever they change, so a
+    restarted job can reattach to scans which are still in flight.
+    '''
+
+    def __init__(self, qgc, state_file=None):
+        self.qgc = qgc
+        self.state_file = state_file
+        self.scans = {}
+        self.failed = []
+        if state_file and os.path.exists(state_file):
+            with open(state_file) as f:
+                self.scans = json.load(f)
+
+    def save(self):
+        if self.state_file:
+            with open(self.state_file + '.tmp', 'w') as f:
+                json.dump(self.scans, f, indent=2)
+            os.replace(self.state_file + '.tmp', self.state_file)
+
+    def add(self, scan_id, webapp_id, report_prefix):
+        ''' Start tracking a newly launched scan '''
+
+        self.scans[scan_id] = {
+            'webapp_id': webapp_id,
+            'report_prefix': report_prefix,
+            'report_id': None,
+            'started': time.time(),
+            'attempt': 0,
+            'next_poll': 0,
+        }
+        self.save()
+
+    def in_flight(self, webapp_id):
+        ''' Ids of tracked scans of the given webapp '''
+
+        return [
+            scan_id for scan_id, scan in self.scans.items()
+            if scan['webapp_id'] == webapp_id
+        ]
+
+    def fail(self, scan_id):
+        self.failed.append(scan_id)
+        del self.scans[scan_id]
+
+    def check(self, scan_id, scan):
+        ''' Poll a scan (or its report) once, and schedule the next poll '''
+
+        if scan['report_id'] is None:
+            status = get_scan_status(self.qgc, scan_id)
+            if status is None:
+                self.fail(scan_id)
+                return
+            if status == 'FINISHED':
+                logger.info('Scan finished successfully! Scan id: %s', scan_id)
+                scan['report_id'] = create_report(self.qgc, scan_id)
+                scan.update(started=time.time(), attempt=0, next_poll=0)
+                return
+            if time.time() - scan['started'] > SCAN_TIMEOUT:
+                logger.error(
+                    'Scan %s did not finish in expected time frame. '
+                    'aborting...', scan_id)
+                logger.error('Scan status: %s', status)
+                self.fail(scan_id)
+                return
+            logger.info(
+                'Wait for scan %s to finish.  Current scan status: %s',
+                scan_id, status)
+            expected_duration = SCAN_EXPECTED_DURATION
+        else:
+            status = get_report_status(self.qgc, scan['report_id'])
+            if status == 'COMPLETE':
+                download_report(
+                    self.qgc, scan['report_id'], scan['report_prefix'])
+                del self.scans[scan_id]
+                return
+            logger.info(
+                'Wait for report %s to complete.  Current report status: %s',
+                scan['report_id'], status)
+            expected_duration = REPORT_EXPECTED_DURATION
+
+        delay = next_poll_delay(
+            scan['attempt'], scan['started'], expected_duration)
+        scan['attempt'] += 1
+        scan['next_poll'] = time.time() + delay
+        logger.info('Checking %s again in %d seconds', scan_id, delay)
+
+    def run(self):
+        '''
+        Poll until every scan's report is downloaded or the scan fails.
+        Returns True if all succeeded.
+        '''
+
+        while self.scans:
+            for scan_id, scan in list(self.scans.items()):
+                if scan['next_poll'] <= time.time():
+                    self.check(scan_id, scan)
+                    self.save()
+            if self.scans:
+                next_poll = min(
+                    scan['next_poll'] for scan in self.scans.values())
+                time.sleep(max(0, next_poll - time.time()))
+
+        if self.failed:
+            logger.error('Scans failed: %s', ', '.join(self.failed))
+        return not self.failed
 
 
 def main(args):
@@ -257,9 +372,19 @@ def main(args):
     current_time = datetime.datetime.now().strftime("%Y%m%d%H%M")
     logger.debug('Current Time: %s', current_time)
 
-    webapp_id = update_scan_url(qgc, current_time, args)
-    scan_id = scan_report(qgc, current_time, args, webapp_id)
-    generate_report(qgc, args, scan_id)
+    poller = ScanPoller(qgc, args.state_file)
+    scan_ids = poller.in_flight(args.webapp_id)
+    if scan_ids:
+        logger.info('Reattaching to in-flight scans: %s', ', '.join(scan_ids))
+    else:
+        webapp_id = update_scan_url(qgc, current_time, args)
+        scan_id = launch_scan(qgc, current_time, args, webapp_id)
+        report_prefix = "Scan_Report_" + args.web_name + '_' + \
+            args.bld_num + '_' + args.scan_type_name
+        poller.add(scan_id, args.webapp_id, report_prefix)
+
+    if not poller.run():
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -294,6 +419,9 @@ if __name__ == "__main__":
         '--qualys-config',
         help="Qualys API config filen\n",
         required=True)
+    parser.add_argument(
+        '--state-file',
+        help="File tracking in-flight scans, so a restarted job reattaches\n")
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -14,7 +14,7 @@ import requests
 import subprocess
 import sys
 from collections import defaultdict
-from typing import ClassVar, Dict, NamedTuple, Optional, Set
+from typing import ClassVar, Dict, List, NamedTuple, Optional, Set, Union
 from util import Action, render_template, run, run_output
 
 
@@ -75,13 +75,17 @@ class Aptly:
         return run_output(f"aptly -config {self.config_file} {cmd}")
 
 
-    def run_aptly(self, cmd: str, **kwargs) -> subprocess.CompletedProcess:
+    def run_aptly(
+        self, cmd: Union[List[str], str], **kwargs
+    ) -> subprocess.CompletedProcess:
         """
         Convenience function to run an 'aptly' command with the specified
         config file
         """
 
-        return run(f"aptly -config {self.config_file} {cmd}", **kwargs)
+        if type(cmd) == str:
+            cmd = cmd.split()
+        return run(["aptly", "-config", str(self.config_file), *cmd], **kwargs)
 
 
     def create_repo(self, repo: AptlyRepo) -> None:
@@ -96,29 +100,41 @@ class Aptly:
         self.repos.update(self.ask_aptly("repo list -raw").split())
 
 
-    def commit_package(self, repo: AptlyRepo, debact: DebAction) -> None:
+    def commit_packages(
+        self, repo: AptlyRepo, debactions: Set[DebAction]
+    ) -> None:
         """
-        Imports/Removes a package file in a specified Aptly repository,
-        creating said repository if necessary
+        Imports/Removes package files in a specified Aptly repository,
+        creating said repository if necessary. All removals are done with
+        one aptly command, and all imports with another.
         """
 
         if not str(repo) in self.repos:
             self.create_repo(repo)
 
-        match debact.action:
-            case Action.ADD:
-                pkgfile = debact.pkgfile
-                logging.info(f"Importing {pkgfile} into aptly repo {repo}")
-                self.run_aptly(f"repo add {repo} {pkgfile}")
-            case Action.REMOVE:
-                pkgref = debact.pkgref()
+        pkgrefs = sorted(
+            debact.pkgref() for debact in debactions
+            if debact.action == Action.REMOVE
+        )
+        if pkgrefs:
+            for pkgref in pkgrefs:
                 logging.info(f"Removing {pkgref} from aptly repo {repo}")
-                self.run_aptly(f"repo remove {repo} {pkgref}")
+            self.run_aptly(["repo", "remove", str(repo), *pkgrefs])
+
+        pkgfiles = sorted(
+            str(debact.pkgfile) for debact in debactions
+            if debact.action == Action.ADD
+        )
+        if pkgfiles:
+            for pkgfile in pkgfiles:
+                logging.info(f"Importing {pkgfile} into aptly repo {repo}")
+            self.run_aptly(["repo", "add", str(repo), *pkgfiles])
 
 
-    def update_repo(self, repo: AptlyRepo) -> None:
+    def update_repo(self, repo: AptlyRepo, publishes: Set[str]) -> None:
         """
-        Publishes specified repo to the local filesystem
+        Publishes specified repo to the local filesystem. publishes is the
+        set of existing publishes, as output by "aptly publish list -raw".
         """
 
         # A repo will always be published locally to a root named after
@@ -126,8 +142,6 @@ class Aptly:
         # existing publish set up for this already.
         fspath = f"filesystem:{repo.target}:."
         publish = f"{fspath} {repo.distro}"
-        publishes: Set[str] = set()
-        publishes.update(self.ask_aptly("publish list -raw").split('\n'))
         if not publish in publishes:
             logging.info(f"Publishing local apt repository {repo}")
             self.run_aptly(
@@ -276,13 +290,23 @@ class Aptly:
 
     def commit(self) -> None:
         """
-        Processes all queued add_package requests
+        Processes all queued add_package requests. Only repositories which
+        had packages added or removed are republished, so the indexes of
+        untouched distributions aren't rewritten and re-signed.
+
+        Every aptly command takes an exclusive lock on aptly's database,
+        so these are run one at a time rather than concurrently.
         """
 
+        if not self.dirty_repos:
+            return
+
+        publishes: Set[str] = set(
+            self.ask_aptly("publish list -raw").split('\n')
+        )
         for (repo, debactions) in self.dirty_repos.items():
-            for debact in debactions:
-                self.commit_package(repo, debact)
-            self.update_repo(repo)
+            self.commit_packages(repo, debactions)
+            self.update_repo(repo, publishes)
             self.write_listfile(repo)
 
 
@@ -11,6 +11,7 @@ import shutil
 import sys
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from util import Action, render_template, run, run_output
 from typing import ClassVar, Dict, NamedTuple, Optional, Set
 
@@ -55,9 +56,15 @@ class Createrepo:
             return self.dir
 
 
-    def __init__(self, createrepo_conf: Dict, targets_conf: Dict) -> None:
+    def __init__(
+        self, createrepo_conf: Dict, targets_conf: Dict, jobs: int = 4
+    ) -> None:
         self.script_dir = pathlib.Path(__file__).resolve().parent
         self.gpg_key = createrepo_conf["gpg_key"]
+        self.jobs = jobs
+        self.cache_dir: Optional[pathlib.Path] = None
+        if "cache_dir" in createrepo_conf:
+            self.cache_dir = pathlib.Path(createrepo_conf["cache_dir"])
         Createrepo.targets_conf = targets_conf
         self.dirty_repos: Dict[Createrepo.YumRepo, Set[pathlib.Path]] = \
             defaultdict(set)
@@ -104,7 +111,18 @@ class Createrepo:
 
         repo_dir = repo.repo_dir()
         logging.info(f"Updating yum metadata in repo {repo_dir}")
-        run(f"createrepo_c --update --retain-old-md=5 --compatibility {repo_dir}")
+        cmd = [
+            "createrepo_c", "--update", "--retain-old-md=5", "--compatibility"
+        ]
+        # With --update, createrepo_c reuses the existing metadata of any
+        # package whose size and mtime are unchanged; the checksum cache
+        # also saves re-reading packages which were re-copied unchanged
+        if self.cache_dir is not None:
+            cmd += [
+                "--cachedir",
+                str(self.cache_dir / repo.target / repo.distro / repo.arch)
+            ]
+        run(cmd + [str(repo_dir)])
 
         # GPG sign the repomd
         repomdfile = repo_dir / "repodata" / "repomd.xml"
@@ -227,21 +245,35 @@ class Createrepo:
         return str(repo)
 
 
-    def commit(self) -> None:
+    def commit_repo(self, repo: YumRepo, rpmactions: Set[RpmAction]) -> None:
         """
-        Processes all queued add_package requests
+        Processes all queued requests for one repository
         """
 
-        for (repo, rpmactions) in self.dirty_repos.items():
-            for rpmact in rpmactions:
-                self.commit_package(repo, rpmact)
-            self.update_repo(repo)
+        for rpmact in rpmactions:
+            self.commit_package(repo, rpmact)
+        self.update_repo(repo)
+
+        # We may end up calling this redundantly if we have RPMs for
+        # multiple architectures in the same target:distro, but it's
+        # easier just call this every time - it's cheap enough to
+        # generate the .repo file
+        self.write_repofile(repo)
+
+
+    def commit(self) -> None:
+        """
+        Processes all queued add_package requests. Each distro/arch
+        repository is independent, so several are processed at once.
+        """
 
-            # We may end up calling this redundantly if we have RPMs for
-            # multiple architectures in the same target:distro, but it's
-            # easier just call this every time - it's cheap enough to
-            # generate the .repo file
-            self.write_repofile(repo)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(self.commit_repo, repo, rpmactions)
+                for (repo, rpmactions) in self.dirty_repos.items()
+            ]
+            for future in futures:
+                future.result()
 
 
     def recreate_repofiles(self, target: str) -> None:
@@ -0,0 +1,194 @@
+"""
+Incremental sync of a local package archive to S3
+"""
+
+import boto3
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import pathlib
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+
+# Repository metadata files which refer to other files in the archive.
+# These are uploaded only after everything else, so a client never sees
+# new metadata which names files that aren't on S3 yet.
+METADATA_FILES = {
+    "repomd.xml", "repomd.xml.asc", "Release", "Release.gpg", "InRelease",
+}
+
+# Objects up to this size are uploaded in a single part, so their ETag is
+# their MD5 and can be compared with the local file
+MULTIPART_THRESHOLD = 5 * 1024 ** 3
+
+
+def file_md5(path: pathlib.Path) -> str:
+    """
+    Returns the MD5 of a file's contents
+    """
+
+    md5 = hashlib.md5()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class S3Sync:
+    """
+    Copies the contents of a local directory to an S3 path, uploading only
+    files whose checksums differ from what's on S3.
+
+    Two caches make this cheap: a snapshot of the local files' checksums,
+    keyed by size and mtime so only new or modified files are re-hashed,
+    and an inventory of the checksums of the objects on S3. The inventory
+    is kept up to date as files are uploaded, and is only rebuilt from a
+    full bucket listing when requested or when it doesn't exist yet.
+    """
+
+    def __init__(
+        self, region: str, bucket: str, profile: str, s3_path: str,
+        local_dir: pathlib.Path, cache_dir: pathlib.Path, jobs: int = 16
+    ) -> None:
+        self.bucket = bucket
+        self.s3_path = s3_path.strip("/")
+        self.local_dir = local_dir
+        self.jobs = jobs
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Every upload thread needs its own connection, and botocore's
+        # default pool only holds 10
+        session = boto3.Session(profile_name=profile, region_name=region)
+        self.s3 = session.client(
+            "s3", config=Config(max_pool_connections=jobs)
+        )
+
+        cache_name = f"{bucket}-{self.s3_path}".replace("/", "_")
+        self.snapshot_file = cache_dir / f"s3sync-local-{cache_name}.json"
+        self.inventory_file = cache_dir / f"s3sync-remote-{cache_name}.json"
+
+
+    def _load(self, cache_file: pathlib.Path) -> Optional[Dict]:
+        if not cache_file.exists():
+            return None
+        with cache_file.open() as c:
+            return json.load(c)
+
+
+    def _save(self, cache_file: pathlib.Path, data: Dict) -> None:
+        tmp_file = cache_file.with_suffix(".tmp")
+        with tmp_file.open("w") as c:
+            json.dump(data, c)
+        tmp_file.replace(cache_file)
+
+
+    def key(self, relpath: str) -> str:
+        return f"{self.s3_path}/{relpath}" if self.s3_path else relpath
+
+
+    def snapshot_local(self) -> Dict[str, str]:
+        """
+        Returns the MD5 of every file under local_dir, keyed by relative
+        path. Symlinks are skipped.
+        """
+
+        old_snapshot = self._load(self.snapshot_file) or {}
+        snapshot = {}
+        for dirpath, dirnames, filenames in os.walk(self.local_dir):
+            for filename in filenames:
+                path = pathlib.Path(dirpath) / filename
+                if path.is_symlink():
+                    continue
+                relpath = path.relative_to(self.local_dir).as_posix()
+                stat = path.stat()
+                old = old_snapshot.get(relpath)
+                if old is not None and old[:2] == [stat.st_size, stat.st_mtime_ns]:
+                    snapshot[relpath] = old
+                else:
+                    snapshot[relpath] = [
+                        stat.st_size, stat.st_mtime_ns, file_md5(path)
+                    ]
+        self._save(self.snapshot_file, snapshot)
+        return {relpath: entry[2] for relpath, entry in snapshot.items()}
+
+
+    def list_remote(self) -> Dict[str, str]:
+        """
+        Builds the inventory from a listing of the bucket. Objects uploaded
+        in multiple parts don't have their MD5 as their ETag, so for those
+        the "md5" recorded is the ETag itself, which will never match a
+        local file and so they will be re-uploaded once.
+        """
+
+        logging.info(f"Listing s3://{self.bucket}/{self.s3_path}/")
+        inventory = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        prefix = f"{self.s3_path}/" if self.s3_path else ""
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                relpath = obj["Key"][len(prefix):]
+                inventory[relpath] = obj["ETag"].strip('"')
+        return inventory
+
+
+    def upload(self, relpath: str) -> None:
+        path = self.local_dir / relpath
+        content_type = mimetypes.guess_type(path.name)[0] \
+            or "application/octet-stream"
+        logging.debug(f"Uploading {relpath}")
+        self.s3.upload_file(
+            str(path), self.bucket, self.key(relpath),
+            ExtraArgs={"ACL": "public-read", "ContentType": content_type},
+            Config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD)
+        )
+
+
+    def sync(self, refresh_inventory: bool) -> Tuple[List[str], List[str]]:
+        """
+        Uploads all new and changed files, metadata files last. Returns
+        the relative paths of the new files and of the replaced files.
+        """
+
+        local = self.snapshot_local()
+        inventory = None if refresh_inventory \
+            else self._load(self.inventory_file)
+        if inventory is None:
+            inventory = self.list_remote()
+
+        changed = [
+            relpath for relpath, md5 in local.items()
+            if inventory.get(relpath) != md5
+        ]
+        replaced = [relpath for relpath in changed if relpath in inventory]
+        added = [relpath for relpath in changed if relpath not in inventory]
+        logging.info(
+            f"{len(added)} new and {len(replaced)} changed files to upload "
+            f"({len(local) - len(changed)} unchanged)"
+        )
+
+        # Upload all packages and secondary metadata, then the primary
+        # metadata files which refer to them
+        phases = [
+            [p for p in changed if pathlib.PurePath(p).name not in METADATA_FILES],
+            [p for p in changed if pathlib.PurePath(p).name in METADATA_FILES],
+        ]
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for phase in phases:
+                    futures = {
+                        relpath: executor.submit(self.upload, relpath)
+                        for relpath in phase
+                    }
+                    for relpath, future in futures.items():
+                        future.result()
+                        inventory[relpath] = local[relpath]
+        finally:
+            self._save(self.inventory_file, inventory)
+
+        return added, replaced
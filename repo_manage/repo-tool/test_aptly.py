@@ -0,0 +1,179 @@
+"""
+Checks of the Aptly wrapper against a throwaway aptly root and GPG key
+created in a temporary directory. These need the aptly, gpg and dpkg-deb
+commands, and are skipped without them. Run with "python3 -m unittest"
+or pytest from this directory.
+"""
+
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from unittest import mock
+
+from aptly import Aptly, AptlyRepo
+from util import Action
+
+TARGET = "release"
+DISTRO = "noble"
+GPG_KEY = "repo-tool-test@example.com"
+
+
+def make_deb(path, package, version, arch="amd64"):
+    """
+    Builds a minimal .deb at path
+    """
+    with tempfile.TemporaryDirectory() as build_dir:
+        debian_dir = pathlib.Path(build_dir) / "DEBIAN"
+        debian_dir.mkdir()
+        (debian_dir / "control").write_text(
+            f"Package: {package}\n"
+            f"Version: {version}\n"
+            f"Architecture: {arch}\n"
+            f"Maintainer: Test <test@example.com>\n"
+            f"Description: Test package\n"
+        )
+        subprocess.run(["dpkg-deb", "--build", build_dir, str(path)],
+                       check=True, stdout=subprocess.DEVNULL)
+
+
+@unittest.skipUnless(
+    all(shutil.which(cmd) for cmd in ["aptly", "gpg", "dpkg-deb"]),
+    "needs aptly, gpg and dpkg-deb")
+class AptlyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.root = pathlib.Path(self.tmpdir.name)
+
+        # A signing key with no passphrase, in its own keyring
+        gnupg_home = self.root / "gnupg"
+        gnupg_home.mkdir(mode=0o700)
+        env = mock.patch.dict(os.environ, {"GNUPGHOME": str(gnupg_home)})
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(subprocess.run, ["gpgconf", "--kill", "gpg-agent"])
+        subprocess.run(
+            ["gpg", "--batch", "--quiet", "--passphrase", "",
+             "--quick-generate-key", GPG_KEY, "rsa2048", "sign", "never"],
+            check=True, stderr=subprocess.DEVNULL)
+
+        # Aptly renders its config next to the script
+        config_file = pathlib.Path(__file__).resolve().parent / "aptly.conf"
+        if not config_file.exists():
+            self.addCleanup(config_file.unlink, missing_ok=True)
+
+        self.base_dir = self.root / "repos"
+        self.targets_conf = {TARGET: {
+            "local": {"base_dir": str(self.base_dir)},
+            "s3": {"bucket": "packages.example.com", "prefix": "releases",
+                   "transport": "https"},
+        }}
+        self.aptly_conf = {
+            "root_dir": str(self.root / "aptly"),
+            "gpg_key": GPG_KEY,
+        }
+        self.debs = {}
+        for package, version in [
+            ("couchbase-server", "7.6.0-1000"),
+            ("couchbase-server", "7.6.1-2000"),
+            ("couchbase-release", "1.0-1"),
+        ]:
+            deb = self.root / f"{package}_{version}_amd64.deb"
+            make_deb(deb, package, version)
+            self.debs[(package, version)] = deb
+
+    def aptly(self):
+        aptly = Aptly(self.aptly_conf, self.targets_conf)
+        aptly.commands = []
+        run_aptly = aptly.run_aptly
+
+        def recording_run_aptly(cmd, **kwargs):
+            if type(cmd) == str:
+                cmd = cmd.split()
+            aptly.commands.append(cmd[:2])
+            return run_aptly(cmd, **kwargs)
+
+        aptly.run_aptly = recording_run_aptly
+        return aptly
+
+    def packages(self, aptly, repo):
+        output = aptly.ask_aptly(f"repo show -with-packages {repo}")
+        return sorted(output.split("Packages:\n", 1)[1].split())
+
+    def queue(self, aptly, action, *packages):
+        for package in packages:
+            aptly.add_action(TARGET, DISTRO, self.debs[package], action)
+
+    def test_commit_packages(self):
+        aptly = self.aptly()
+        repo = AptlyRepo(TARGET, DISTRO)
+        self.queue(aptly, Action.ADD,
+                   ("couchbase-server", "7.6.0-1000"),
+                   ("couchbase-release", "1.0-1"))
+        aptly.commands = []
+        aptly.commit_packages(repo, aptly.dirty_repos[repo])
+
+        # The repo is created, and both packages added with one command
+        self.assertEqual(aptly.commands, [
+            ["repo", "create"], ["repo", "add"]])
+        self.assertIn(str(repo), aptly.repos)
+        self.assertEqual(self.packages(aptly, repo), [
+            "couchbase-release_1.0-1_amd64",
+            "couchbase-server_7.6.0-1000_amd64",
+        ])
+
+        # Replace one package with another: one removal, one addition
+        aptly = self.aptly()
+        self.queue(aptly, Action.REMOVE, ("couchbase-server", "7.6.0-1000"))
+        self.queue(aptly, Action.ADD, ("couchbase-server", "7.6.1-2000"))
+        # Already there, so not queued again
+        self.queue(aptly, Action.ADD, ("couchbase-release", "1.0-1"))
+        self.assertEqual(len(aptly.dirty_repos[repo]), 2)
+        aptly.commands = []
+        aptly.commit_packages(repo, aptly.dirty_repos[repo])
+
+        self.assertEqual(aptly.commands, [
+            ["repo", "remove"], ["repo", "add"]])
+        self.assertEqual(self.packages(aptly, repo), [
+            "couchbase-release_1.0-1_amd64",
+            "couchbase-server_7.6.1-2000_amd64",
+        ])
+
+    def test_commit(self):
+        aptly = self.aptly()
+        self.queue(aptly, Action.ADD, ("couchbase-server", "7.6.0-1000"))
+        aptly.commit()
+        self.assertIn(["publish", "repo"], aptly.commands)
+
+        dists = self.base_dir / "debian" / "dists" / DISTRO
+        packages = dists / "main" / "binary-amd64" / "Packages"
+        self.assertIn("Version: 7.6.0-1000", packages.read_text())
+        # The index is signed with the throwaway key
+        subprocess.run(["gpg", "--batch", "--verify", str(dists / "InRelease")],
+                       check=True, stderr=subprocess.DEVNULL)
+        listfile = self.base_dir / f"couchbase-{TARGET}-{DISTRO}.list"
+        self.assertIn(
+            f"https://packages.example.com/releases/debian {DISTRO} main",
+            listfile.read_text())
+
+        # The second commit updates the existing publish
+        aptly = self.aptly()
+        self.queue(aptly, Action.ADD, ("couchbase-server", "7.6.1-2000"))
+        aptly.commit()
+        self.assertIn(["publish", "update"], aptly.commands)
+        self.assertNotIn(["publish", "repo"], aptly.commands)
+        self.assertIn("Version: 7.6.1-2000", packages.read_text())
+
+        # Nothing queued, so nothing is run
+        aptly = self.aptly()
+        aptly.commit()
+        self.assertEqual(aptly.commands, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
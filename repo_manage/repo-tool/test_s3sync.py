@@ -0,0 +1,184 @@
+"""
+Checks of the incremental S3 sync and the Cloudfront invalidation which
+follows it, against a moto mock of S3. Run with "python3 -m unittest" or
+pytest from this directory.
+"""
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+from unittest import mock
+
+import boto3
+from moto import mock_aws
+
+import util
+from s3sync import S3Sync
+
+REGION = "us-east-1"
+BUCKET = "packages.example.com"
+PREFIX = "releases"
+
+
+class S3SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        env = mock.patch.dict(os.environ, {
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_DEFAULT_REGION": REGION,
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        self.s3 = boto3.client("s3", region_name=REGION)
+        self.s3.create_bucket(Bucket=BUCKET)
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        root = pathlib.Path(self.tmpdir.name)
+        self.local_dir = root / "repo"
+        self.cache_dir = root / "cache"
+        self.write_files({
+            "rpm/repodata/repomd.xml": "repomd 1",
+            "rpm/repodata/repomd.xml.asc": "signature 1",
+            "rpm/repodata/primary.xml.gz": "primary 1",
+            "rpm/couchbase-server-7.6.0.rpm": "rpm 1",
+            "deb/dists/noble/Release": "release 1",
+            "deb/dists/noble/InRelease": "inrelease 1",
+            "deb/dists/noble/main/binary-amd64/Packages": "packages 1",
+            "deb/pool/couchbase-server_7.6.0_amd64.deb": "deb 1",
+        })
+
+    def write_files(self, files):
+        for relpath, content in files.items():
+            path = self.local_dir / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    def syncer(self, jobs=16):
+        return S3Sync(REGION, BUCKET, None, PREFIX, self.local_dir,
+                      self.cache_dir, jobs)
+
+    def sync(self, refresh_inventory=False):
+        """
+        Syncs the local directory, returning the new and replaced files
+        and the order in which files were uploaded
+        """
+        syncer = self.syncer()
+        uploaded = []
+        upload = syncer.upload
+
+        def recording_upload(relpath):
+            upload(relpath)
+            uploaded.append(relpath)
+
+        syncer.upload = recording_upload
+        with self.assertLogs(level="INFO"):
+            added, replaced = syncer.sync(refresh_inventory)
+        return sorted(added), sorted(replaced), uploaded
+
+    def remote(self, relpath):
+        obj = self.s3.get_object(Bucket=BUCKET, Key=f"{PREFIX}/{relpath}")
+        return obj["Body"].read().decode()
+
+    def assert_metadata_last(self, uploaded):
+        is_metadata = [
+            pathlib.PurePath(relpath).name in
+            {"repomd.xml", "repomd.xml.asc", "Release", "InRelease"}
+            for relpath in uploaded
+        ]
+        self.assertEqual(is_metadata, sorted(is_metadata), uploaded)
+
+    def test_connection_pool(self):
+        self.assertEqual(self.syncer(jobs=24).s3.meta.config.max_pool_connections, 24)
+
+    def test_sync(self):
+        added, replaced, uploaded = self.sync()
+        self.assertEqual(len(added), 8)
+        self.assertEqual(replaced, [])
+        self.assert_metadata_last(uploaded)
+        self.assertEqual(self.remote("rpm/repodata/repomd.xml"), "repomd 1")
+        obj = self.s3.head_object(
+            Bucket=BUCKET, Key=f"{PREFIX}/rpm/repodata/repomd.xml")
+        self.assertEqual(obj["ContentType"], "application/xml")
+
+        # Nothing changed, so nothing is uploaded
+        self.assertEqual(self.sync(), ([], [], []))
+
+    def test_changes(self):
+        self.sync()
+        self.write_files({
+            "rpm/repodata/repomd.xml": "repomd 2",
+            "rpm/repodata/primary.xml.gz": "primary 2",
+            "rpm/repodata/other-2.xml.gz": "other 2",
+            "rpm/couchbase-server-7.6.1.rpm": "rpm 2",
+        })
+        added, replaced, uploaded = self.sync()
+        self.assertEqual(added, [
+            "rpm/couchbase-server-7.6.1.rpm", "rpm/repodata/other-2.xml.gz"])
+        self.assertEqual(replaced, [
+            "rpm/repodata/primary.xml.gz", "rpm/repodata/repomd.xml"])
+        self.assertEqual(uploaded[-1], "rpm/repodata/repomd.xml")
+        self.assert_metadata_last(uploaded)
+        self.assertEqual(self.remote("rpm/repodata/repomd.xml"), "repomd 2")
+
+    def test_refresh_inventory(self):
+        self.sync()
+        # Changed on S3 behind the cached inventory's back
+        self.s3.put_object(Bucket=BUCKET,
+                           Key=f"{PREFIX}/deb/dists/noble/Release", Body=b"x")
+        self.assertEqual(self.sync(), ([], [], []))
+        self.assertEqual(self.sync(refresh_inventory=True),
+                         ([], ["deb/dists/noble/Release"],
+                          ["deb/dists/noble/Release"]))
+        self.assertEqual(self.remote("deb/dists/noble/Release"), "release 1")
+
+    def invalidate(self):
+        """
+        Runs sync_to_s3bucket with invalidation, returning the paths
+        invalidated, or None if there was no invalidation
+        """
+        with mock.patch.object(util, "run_output", return_value="DIST\n"), \
+                mock.patch.object(util, "run") as run, \
+                self.assertLogs(level="INFO"):
+            util.sync_to_s3bucket(
+                REGION, BUCKET, None, PREFIX, self.local_dir,
+                only_recent=True, invalidate_after_upload=True,
+                cache_dir=self.cache_dir)
+        if not run.called:
+            return None
+        cmd = run.call_args.args[0]
+        self.assertEqual(cmd[cmd.index("--distribution-id") + 1], "DIST")
+        return cmd[cmd.index("--paths") + 1:]
+
+    def test_invalidation(self):
+        # Nothing was replaced
+        self.assertIsNone(self.invalidate())
+
+        # Only the replaced files are invalidated, not the new ones
+        self.write_files({
+            "deb/dists/noble/InRelease": "inrelease 2",
+            "deb/dists/noble/main/binary-amd64/Packages": "packages 2",
+            "deb/pool/couchbase-server_7.6.1 amd64.deb": "deb 2",
+        })
+        self.assertEqual(self.invalidate(), [
+            f"/{PREFIX}/deb/dists/noble/InRelease",
+            f"/{PREFIX}/deb/dists/noble/main/binary-amd64/Packages",
+        ])
+
+        # Past the limit, everything under the prefix is invalidated
+        with mock.patch.object(util, "MAX_INVALIDATION_PATHS", 1):
+            self.write_files({
+                "rpm/repodata/repomd.xml": "repomd 2",
+                "rpm/repodata/primary.xml.gz": "primary 2",
+            })
+            self.assertEqual(self.invalidate(), [f"/{PREFIX}/*"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,17 +3,22 @@ Re-usable utility functions
 """
 
 import logging
-import os
 import pathlib
 import subprocess
 import sys
 from enum import Enum
 from jinja2 import Template
-from typing import Dict, List, Union
+from s3sync import S3Sync
+from typing import Dict, List, Optional, Union
+from urllib.parse import quote
 
 # Global debug flag for run()
 global_debug: bool = False
 
+# Most paths to list in a Cloudfront invalidation before falling back to
+# invalidating everything under the S3 path
+MAX_INVALIDATION_PATHS = 100
+
 def run(cmd: Union[List[str], str], **kwargs) -> subprocess.CompletedProcess:
     """
     Echo command being executed - helpful for debugging
@@ -80,67 +85,48 @@ def render_template(
 
 def sync_to_s3bucket(
     region: str, bucket: str, profile: str, s3_path: str,
-    local_dir: pathlib.Path, only_recent: bool, invalidate_after_upload: bool
+    local_dir: pathlib.Path, only_recent: bool, invalidate_after_upload: bool,
+    cache_dir: Optional[pathlib.Path] = None
 ) -> None:
     """
     Synchronizes the *contents* of a local directory to an S3 path as
-    efficiently as possible. If "only_recent" is True, will attempt to
-    sync only changes from the last 24 hours.
+    efficiently as possible. If "only_recent" is True, trusts the cached
+    inventory of what is already on S3; otherwise re-lists the bucket
+    first to catch any changes made outside this tool. The caches are
+    kept in cache_dir (default: this script's directory).
     """
 
-    # Current implementation uses rclone, which requires us to first set
-    # up a "remote" with various parameters. We'll save that in a local file.
-    # The remote is named "s3remote", and is of type "s3".
-    script_dir = pathlib.Path(__file__).resolve().parent
-    conf_file = script_dir / "rclone.conf"
-    run(
-        f"rclone --quiet --config {conf_file} config create s3remote s3 "
-        f"env_auth true acl public-read region {region} provider AWS "
-        f"no_check_bucket true"
-    )
-
-    # Only way to specify the AWS credentials profile to use :(
-    os.environ["AWS_PROFILE"] = profile
-
-    # If doing a "top-up" recents-only sync, we want different options
-    # than if doing a full sync
-    if only_recent:
-        opt_flags = "--no-traverse --max-age 24h"
-    else:
-        opt_flags = "--fast-list"
-
-    # Do the sync, with all the options for best efficiency. Note the
-    # destination path names the "s3remote" we set up earlier. Also note
-    # that we use "rclone copy" rather than "rclone sync" - the main
-    # difference is that "sync" would delete files on S3 that have been
-    # deleted locally. However, due to Cloudfront caching, customers can
-    # get into a bad state if we delete old yum/apt metadata files -
-    # they may get a cached copy of, say, repomd.xml which tells them to
-    # download an older version of a secondary metadata file, and if
-    # that file is already deleted from S3 (and didn't happen to be
-    # cached by Cloudfront) they'll get errors. There's as much as a
-    # 12-hour window where Cloudfront may serve an inconsistent view of
-    # the repository after we upload changes. In general, only
-    # repository metadata files should ever get deleted from the local
-    # repositories, and they're quite small, so there isn't much of a
-    # downside to leaving all of them on S3. Maybe every so often we
+    # Note that we only ever upload, never delete. The main reason is that,
+    # due to Cloudfront caching, customers can get into a bad state if we
+    # delete old yum/apt metadata files - they may get a cached copy of,
+    # say, repomd.xml which tells them to download an older version of a
+    # secondary metadata file, and if that file is already deleted from S3
+    # (and didn't happen to be cached by Cloudfront) they'll get errors.
+    # There's as much as a 12-hour window where Cloudfront may serve an
+    # inconsistent view of the repository after we upload changes. In
+    # general, only repository metadata files should ever get deleted from
+    # the local repositories, and they're quite small, so there isn't much
+    # of a downside to leaving all of them on S3. Maybe every so often we
     # could do a full "sync" just to clean them out.
-    try:
-        run(
-            f"rclone --config {conf_file} copy --progress -v --skip-links "
-            f"--update --use-server-modtime {opt_flags} "
-            f"{local_dir} s3remote:{bucket}/{s3_path}"
-        )
-    finally:
-        conf_file.unlink()
+    if cache_dir is None:
+        cache_dir = pathlib.Path(__file__).resolve().parent
+    syncer = S3Sync(region, bucket, profile, s3_path, local_dir, cache_dir)
+    (added, replaced) = syncer.sync(refresh_inventory=not only_recent)
 
     if invalidate_after_upload:
+        # New files can't be in Cloudfront's cache yet, so only the files
+        # which replaced existing objects need invalidating
+        if not replaced:
+            logging.info("No existing files changed; skipping invalidation")
+            return
+
         # Determine the Cloudfront distribution ID associated with the bucket
         logging.debug(
             f"Looking up Cloudfront distribution ID for bucket {bucket}"
         )
         distribution_id = run_output([
-            "aws", "cloudfront", "list-distributions", "--output", "text",
+            "aws", "--profile", profile,
+            "cloudfront", "list-distributions", "--output", "text",
             "--query",
             f"""
             DistributionList.Items[] |
@@ -154,14 +140,21 @@ def sync_to_s3bucket(
             )
             sys.exit(3)
 
-        # Run invalidation for upload path
+        # Past a point, a single wildcard is cheaper than listing paths
+        if len(replaced) > MAX_INVALIDATION_PATHS:
+            paths = [f"/{s3_path}/*"]
+        else:
+            paths = sorted(
+                quote(f"/{s3_path}/{relpath}") for relpath in replaced
+            )
         logging.info(
-            f"Running invalidation for bucket {bucket}, path {s3_path}"
+            f"Running invalidation for bucket {bucket}: {len(paths)} path(s)"
         )
         run([
-            "aws", "cloudfront", "create-invalidation",
+            "aws", "--profile", profile,
+            "cloudfront", "create-invalidation",
             "--distribution-id", distribution_id,
-            "--paths", f"/{s3_path}/*"
+            "--paths", *paths
         ])
 
 class Action(Enum):
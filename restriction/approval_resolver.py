@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+"""
+Resolves which tickets are approved for restricted releases, sharing one
+Jira session between all the restricted manifests a change touches.
+
+The tickets approved by each release's approval ticket are cached in a JSON
+file for a limited time, since consecutive changes usually hit the same
+releases. A cached set is only trusted to approve a ticket; before a ticket
+is rejected the approval ticket is always re-read, so a stale cache cannot
+block a change which has just been approved.
+"""
+
+import json
+import os
+import time
+
+from jira.exceptions import JIRAError
+from jira_util import connect_jira
+
+
+BYPASS_LABELS = [
+    'doc-change-only',
+    'test-change-only',
+    'analytics-compat-jars'
+]
+
+
+def _key_list(tickets):
+    """
+    Formats ticket IDs for use in a JQL "key in (...)" clause
+    """
+    return ", ".join(f'"{ticket}"' for ticket in sorted(tickets))
+
+
+class ApprovalResolver:
+
+    def __init__(self, cache_file=None, ttl=300):
+        """
+        cache_file: JSON file in which to cache approved tickets, or None
+        ttl: number of seconds for which cached approvals are trusted
+        """
+        self.cache_file = cache_file
+        self.ttl = ttl
+        # Approvals read before this time came from the cache file
+        self.started = time.time()
+        self._jira = None
+        self.cache = {}
+        self.bypass = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    self.cache = json.load(f)
+            except json.JSONDecodeError:
+                # A corrupt cache is just discarded; it's rewritten on save
+                self.cache = {}
+
+    @property
+    def jira(self):
+        """
+        The shared Jira session, connected on first use
+        """
+        if self._jira is None:
+            self._jira = connect_jira()
+        return self._jira
+
+    def _save(self):
+        if self.cache_file is not None:
+            # Write atomically, so concurrent checks never see a partial
+            # cache file
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self.cache, f, indent=2)
+            os.replace(tmp_file, self.cache_file)
+
+    def invalidate(self, approval_ticket=None):
+        """
+        Drops cached approvals for one approval ticket, or for all of them
+        """
+        if approval_ticket is None:
+            self.cache = {}
+        else:
+            self.cache.pop(approval_ticket, None)
+        self._save()
+
+    def _is_fresh(self, approval_ticket):
+        entry = self.cache.get(approval_ticket)
+        return entry is not None and time.time() - entry["time"] < self.ttl
+
+    def _search(self, tickets, fields):
+        """
+        Reads all given tickets with a single query, returning a dict of
+        ticket ID to issue. A moved or renamed issue is returned by the
+        query under its new key, so any tickets the query didn't return
+        under the requested key are read individually, which follows
+        moves; tickets which don't exist are left out.
+        """
+        issues = {
+            issue.key: issue for issue in self.jira.search_issues(
+                f"key in ({_key_list(tickets)})",
+                maxResults=False,
+                fields=fields,
+                validate_query=False
+            )
+        }
+        found = {}
+        for ticket in tickets:
+            if ticket in issues:
+                found[ticket] = issues[ticket]
+                continue
+            try:
+                found[ticket] = self.jira.issue(ticket, fields=fields)
+            except JIRAError as e:
+                if e.status_code != 404:
+                    raise
+        return found
+
+    def fetch_approvals(self, approval_tickets):
+        """
+        Reads all given approval tickets from Jira with a single query, and
+        caches the tickets each of them approves: those it links to in
+        either direction, its subtasks, and itself
+        """
+        approval_tickets = set(approval_tickets)
+        if not approval_tickets:
+            return
+        issues = self._search(approval_tickets, "issuelinks,subtasks")
+        now = time.time()
+        for ticket, issue in issues.items():
+            depends = [
+                link.outwardIssue.key for link in issue.fields.issuelinks
+                if hasattr(link, "outwardIssue")
+            ]
+            relates = [
+                link.inwardIssue.key for link in issue.fields.issuelinks
+                if hasattr(link, "inwardIssue")
+            ]
+            subtasks = [subtask.key for subtask in issue.fields.subtasks]
+            self.cache[ticket] = {
+                "time": now,
+                "approved": depends + relates + subtasks + [ticket]
+            }
+        self._save()
+
+        missing = approval_tickets - set(issues)
+        if missing:
+            raise Exception(
+                f"JIRA approval ticket '{sorted(missing)[0]}' not "
+                "found. Please verify the ticket ID is correct."
+            )
+
+    def prefetch(self, approval_tickets):
+        """
+        Ensures approvals for all given approval tickets are cached, reading
+        any missing or expired ones from Jira in a single query
+        """
+        self.fetch_approvals(
+            ticket for ticket in approval_tickets
+            if not self._is_fresh(ticket)
+        )
+
+    def fetch_bypass(self, tickets):
+        """
+        Reads the labels of all given tickets with a single query, and
+        records whether each may bypass restrictions. Tickets which do not
+        exist (eg. typos in the commit message) cannot bypass restrictions.
+        """
+        tickets = set(tickets) - set(self.bypass)
+        if not tickets:
+            return
+        for ticket in tickets:
+            self.bypass[ticket] = False
+        try:
+            issues = self._search(tickets, "labels")
+        except Exception:
+            # As with a missing ticket, a failure to read labels just means
+            # no bypass labels were found
+            return
+        for ticket, issue in issues.items():
+            self.bypass[ticket] = any(
+                label in BYPASS_LABELS for label in issue.fields.labels
+            )
+
+    def unapproved_ticket(self, approval_ticket, tickets):
+        """
+        Returns the first of tickets which is neither approved by
+        approval_ticket nor carries a bypass label, or None if all are
+        approved
+        """
+        self.prefetch([approval_ticket])
+        pending = [
+            tick for tick in tickets
+            if tick not in self.cache[approval_ticket]["approved"]
+        ]
+        if pending and self.cache[approval_ticket]["time"] < self.started:
+            # Cached approvals may be stale; re-read before rejecting
+            self.fetch_approvals([approval_ticket])
+            pending = [
+                tick for tick in pending
+                if tick not in self.cache[approval_ticket]["approved"]
+            ]
+
+        self.fetch_bypass(pending)
+        for tick in pending:
+            if not self.bypass[tick]:
+                return tick
+        return None
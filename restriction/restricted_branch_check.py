@@ -8,7 +8,9 @@ import re
 import sys
 import urllib
 
-from jira_util import connect_jira, get_tickets
+from approval_resolver import ApprovalResolver
+from jira_util import get_tickets
+from restriction_index import get_restricted_manifests, load_restriction_index
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 build_from_manifest_path = os.path.abspath(os.path.join(script_dir, "..", "build-from-manifest"))
@@ -152,58 +154,43 @@ def check_branch_in_manifest(meta):
     return True
 
 
-def can_bypass_restriction(ticket, jira):
+def find_restricted_manifests(manifests):
     """
-    Given a Jira ticket ID, returns true if 'doc-change-only' and/or
-    'test-change-only' labels are present, or false if neither are
-    found
+    Returns the restricted manifests that reference PROJECT/BRANCH, by
+    checking every manifest returned by scan_manifests()
     """
-    bypass_labels = [
-        'doc-change-only',
-        'test-change-only',
-        'analytics-compat-jars'
-    ]
-    try:
-        jira_ticket = jira.issue(ticket)
-        return any(label in bypass_labels for label in jira_ticket.raw['fields']['labels'])
-    except Exception as e:
-        # If the above jira call failed, it was most likely due to the
-        # message naming a non-existent ticket eg. due to a typo or
-        # similar. We don't want to fail with an error about retrieving
-        # labels; just assume the non-existent ticket didn't have any of
-        # the approved labels.
-        return False
+    restricted_manifests = []
+    for manifest in manifests:
+        meta = manifests[manifest]
+        if meta.get("restricted"):
+            approval_ticket = meta.get("approval_ticket")
+            if approval_ticket is None:
+                print("no approval ticket for restricted manifest {}".format(
+                    manifest
+                ))
+                continue
 
+            # Also see if projects are specifically excluded from check for this manifest
+            unrestricted_projects = meta.get("unrestricted_projects", [])
+            if PROJECT in unrestricted_projects:
+                print("Project {} is unrestricted in manifest {}".format(
+                    PROJECT, manifest
+                ))
+                continue
 
-def get_approved_tickets(approval_ticket, jira):
-    """
-    Given a Jira approval ticket ID, return all linked ticket IDs
-    """
-    try:
-        jira_ticket = jira.issue(approval_ticket)
-        depends = [
-            link.outwardIssue.key for link in jira_ticket.fields.issuelinks
-            if hasattr(link, "outwardIssue")
-        ]
-        relates = [
-            link.inwardIssue.key for link in jira_ticket.fields.issuelinks
-            if hasattr(link, "inwardIssue")
-        ]
-        subtasks = [subtask.key for subtask in jira_ticket.fields.subtasks]
-        return depends + relates + subtasks + [approval_ticket]
-    except Exception as e:
-        # Error handling in connect_jira handles auth issues
-        if "404" in str(e) or "does not exist" in str(e):
-            raise Exception(f"JIRA approval ticket '{approval_ticket}' not found. Please verify the ticket ID is correct.")
-        else:
-            # Re-raise all other errors to be handled by the main error handler
-            raise
+            if not check_branch_in_manifest(meta):
+                continue
+
+            # Ok, this proposal is to a branch in a restricted manifest
+            restricted_manifests.append(manifest)
+    return restricted_manifests
 
 
-def validate_change_in_ticket(meta):
+def validate_change_in_ticket(meta, resolver):
     """
     Checks the commit message for a ticket name, and verifies it with the the
-    approval ticket for the restricted manifest
+    approval ticket for the restricted manifest, using the given
+    ApprovalResolver
     """
     global COMMIT_MSG
     approval_ticket = meta.get("approval_ticket")
@@ -220,25 +207,23 @@ def validate_change_in_ticket(meta):
         OUTPUT["REASON"] = "the commit message does not name a ticket"
         return False
 
-    # Now get list of approved tickets from approval ticket, and ensure
-    # all "fixed" tickets are approved.
-    jira = connect_jira()
-    approved_tickets = get_approved_tickets(approval_ticket, jira)
-    for tick in fix_tickets:
-        if tick not in approved_tickets and not can_bypass_restriction(tick, jira):
-            # Ok, this fixed ticket isn't approved in approval ticket
-            # nor does it contain a label for bypassing this check.
-            # Populate the OUTPUT map for the HTML and email templates.
-            # Need to format release_name with version for consistent output
-            release_name = meta.get("release_name")
-            version = meta.get("version", "")
-            formatted_release = format_release_with_version(release_name, version)
-
-            OUTPUT["REASON"] = "ticket {} is not approved for {} " \
-                "(see approval ticket {})".format(
-                    tick, formatted_release, approval_ticket
-            )
-            return False
+    # Now ensure all "fixed" tickets are approved by the approval ticket,
+    # or contain a label for bypassing this check.
+    tick = resolver.unapproved_ticket(approval_ticket, fix_tickets)
+    if tick is not None:
+        # Ok, this fixed ticket isn't approved in approval ticket
+        # nor does it contain a label for bypassing this check.
+        # Populate the OUTPUT map for the HTML and email templates.
+        # Need to format release_name with version for consistent output
+        release_name = meta.get("release_name")
+        version = meta.get("version", "")
+        formatted_release = format_release_with_version(release_name, version)
+
+        OUTPUT["REASON"] = "ticket {} is not approved for {} " \
+            "(see approval ticket {})".format(
+                tick, formatted_release, approval_ticket
+        )
+        return False
     return True
 
 
@@ -432,6 +417,18 @@ def real_main():
     parser.add_argument("-p", "--manifest-project", type=str,
                         default="ssh://git@github.com/couchbase/manifest",
                         help="Alternate Git project for manifest")
+    parser.add_argument("--index-file", type=str,
+                        default="restriction-index.json",
+                        help="Restricted branch index, rebuilt when the manifest repository changes")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Scan every manifest rather than using the restricted branch index")
+    parser.add_argument("--approval-cache", type=str,
+                        default="approval-cache.json",
+                        help="File caching the tickets approved for each release")
+    parser.add_argument("--approval-cache-ttl", type=int, default=300,
+                        help="Seconds for which cached approvals are trusted (0 disables caching)")
+    parser.add_argument("--invalidate-approval-cache", action="store_true",
+                        help="Discard all cached approvals before checking")
     args = parser.parse_args()
 
     # In GitHub Actions mode, look for the manifest repo in the workspace
@@ -461,33 +458,16 @@ def real_main():
         os.remove(html_filename)
 
     # Collect all restricted manifests that reference this branch
-    manifests = scan_manifests(manifest_project)
-    restricted_manifests = []
-    for manifest in manifests:
-        meta = manifests[manifest]
-        if meta.get("restricted"):
-            approval_ticket = meta.get("approval_ticket")
-            if approval_ticket is None:
-                print("no approval ticket for restricted manifest {}".format(
-                    manifest
-                ))
-                continue
-
-            # Also see if projects are specifically excluded from check for this manifest
-            unrestricted_projects = meta.get("unrestricted_projects", [])
-            if PROJECT in unrestricted_projects:
-                print("Project {} is unrestricted in manifest {}".format(
-                    PROJECT, manifest
-                ))
-                continue
-
-            if not check_branch_in_manifest(meta):
-                continue
-
-            # Ok, this proposal is to a branch in a restricted manifest
-            restricted_manifests.append(manifest)
-            print("Project: {} Branch: {} is in restricted manifest: "
-                  "{}".format(PROJECT, BRANCH, manifest))
+    if args.no_index:
+        manifests = scan_manifests(manifest_project)
+        restricted_manifests = find_restricted_manifests(manifests)
+    else:
+        index = load_restriction_index(manifest_project, args.index_file)
+        manifests = index["manifests"]
+        restricted_manifests = get_restricted_manifests(index, PROJECT, BRANCH)
+    for manifest in restricted_manifests:
+        print("Project: {} Branch: {} is in restricted manifest: "
+              "{}".format(PROJECT, BRANCH, manifest))
 
     # Now *remove* any restricted manifests that are the parent of any other
     # restricted manifests in the list. Logic: if a change is approved for a
@@ -505,9 +485,16 @@ def real_main():
             restricted_children.remove(parent)
 
     # Now, iterate through all restricted manifests that we have left,
-    # and ensure this ticket is approved for each.
+    # and ensure this ticket is approved for each. The approval tickets of
+    # all of them are read from Jira together up front.
+    resolver = ApprovalResolver(args.approval_cache, args.approval_cache_ttl)
+    if args.invalidate_approval_cache:
+        resolver.invalidate()
+    resolver.prefetch(
+        manifests[manifest]["approval_ticket"] for manifest in restricted_children
+    )
     for manifest in restricted_children:
-        if not validate_change_in_ticket(manifests[manifest]):
+        if not validate_change_in_ticket(manifests[manifest], resolver):
             OUTPUT["MANIFEST"] = manifest
             output_report(manifests[manifest])
 
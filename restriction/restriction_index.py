@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""
+Persistent index of restricted branches, so that checking a change does not
+require fetching and parsing every manifest.
+
+The index is a JSON document:
+  {
+    "head": <SHA of the manifest repository the index was built from>,
+    "manifests": { <manifest path>: <manifest metadata>, ... },
+    "branches": { <project>: { <branch>: [<manifest path>, ...] } }
+  }
+
+"manifests" only holds restricted manifests which have an approval ticket,
+and the metadata omits the parsed manifest itself. "branches" lists, for
+each project and branch, the restricted manifests which build the project
+from that branch, less any manifests naming the project as unrestricted.
+"""
+
+import json
+import os
+import sys
+from subprocess import CalledProcessError, check_output
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+build_from_manifest_path = os.path.abspath(os.path.join(script_dir, "..", "build-from-manifest"))
+if build_from_manifest_path not in sys.path:
+    sys.path.insert(0, build_from_manifest_path)
+from manifest_util import get_manifest_dir, scan_manifests
+
+
+def get_manifest_head(manifest_project):
+    """
+    Returns the SHA of the HEAD of the manifest repository, without
+    fetching it, or None if it cannot be determined
+    """
+    try:
+        if os.path.isdir(manifest_project):
+            output = check_output(
+                ["git", "-C", manifest_project, "rev-parse", "HEAD"])
+        else:
+            output = check_output(
+                ["git", "ls-remote", manifest_project, "HEAD"])
+    except CalledProcessError:
+        return None
+    return output.decode("utf-8").split()[0]
+
+
+def get_project_branches(manifest_et):
+    """
+    Returns a dict of project name to the branch the manifest builds it from.
+    As with an XPath find(), the first <project> of a given name wins, and
+    <extend-project> is only used for names with no <project>
+    """
+    default_branch = "master"
+    default_et = manifest_et.find("./default")
+    if default_et is not None:
+        default_branch = default_et.get("branch", "master")
+
+    branches = {}
+    for tag in ("project", "extend-project"):
+        tag_branches = {}
+        for project_et in manifest_et.findall(f"./{tag}"):
+            tag_branches.setdefault(
+                project_et.get("name"),
+                project_et.get("revision", default_branch)
+            )
+        for name, branch in tag_branches.items():
+            branches.setdefault(name, branch)
+    return branches
+
+
+def build_restriction_index(manifests, head):
+    """
+    Builds the index from the metadata returned by scan_manifests()
+    """
+    index = {"head": head, "manifests": {}, "branches": {}}
+    for manifest, meta in manifests.items():
+        if not meta.get("restricted"):
+            continue
+        if meta.get("approval_ticket") is None:
+            print("no approval ticket for restricted manifest {}".format(
+                manifest
+            ))
+            continue
+
+        index["manifests"][manifest] = {
+            key: value for key, value in meta.items()
+            if not key.startswith("_")
+        }
+        unrestricted_projects = meta.get("unrestricted_projects", [])
+        for project, branch in get_project_branches(meta["_manifest"]).items():
+            if project in unrestricted_projects:
+                continue
+            index["branches"].setdefault(project, {}).setdefault(
+                branch, []
+            ).append(manifest)
+    return index
+
+
+def load_restriction_index(manifest_project, index_file):
+    """
+    Returns the restriction index for manifest_project, loading it from
+    index_file if it is still current, or rescanning the manifests and
+    saving a new one if the manifest repository HEAD has moved
+    """
+    head = get_manifest_head(manifest_project)
+    if head is not None and os.path.exists(index_file):
+        try:
+            with open(index_file) as f:
+                index = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Restriction index {index_file} is corrupt; rebuilding index")
+        else:
+            if index.get("head") == head:
+                return index
+            print(f"Manifest repository moved to {head}; rebuilding index")
+
+    manifests = scan_manifests(manifest_project)
+    # Record the HEAD that was actually scanned, which may be newer than
+    # the one queried above
+    if os.path.isdir(manifest_project):
+        head = get_manifest_head(manifest_project)
+    else:
+        head = get_manifest_head(get_manifest_dir(manifest_project))
+    index = build_restriction_index(manifests, head)
+
+    index_dir = os.path.dirname(index_file)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+    # Write atomically, so concurrent checks never see a partial index
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_file, index_file)
+    return index
+
+
+def get_restricted_manifests(index, project, branch):
+    """
+    Returns the list of restricted manifests which build project from branch
+    """
+    return index["branches"].get(project, {}).get(branch, [])
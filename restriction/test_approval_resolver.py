@@ -0,0 +1,200 @@
+"""
+Checks of ApprovalResolver against a local fake Jira server which counts
+the requests made. Run with "python3 -m unittest" or pytest from this
+directory.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from jira import JIRA
+
+from approval_resolver import ApprovalResolver
+
+
+class FakeJira(BaseHTTPRequestHandler):
+    """
+    Serves search and issue requests from the class attributes below,
+    counting the requests to each endpoint
+    """
+
+    # Ticket ID: {"links": [...], "subtasks": [...], "labels": [...]}
+    issues = {}
+    # Old ticket ID: ticket ID it was moved to
+    moved = {}
+    requests = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def issue(self, ticket):
+        key = self.moved.get(ticket, ticket)
+        if key not in self.issues:
+            return None
+        data = self.issues[key]
+        return {
+            "id": key,
+            "key": key,
+            "self": f"http://{self.headers['Host']}/rest/api/2/issue/{key}",
+            "fields": {
+                "issuelinks": [
+                    {"outwardIssue": {"key": link}}
+                    for link in data.get("links", [])
+                ] + [
+                    {"inwardIssue": {"key": link}}
+                    for link in data.get("related", [])
+                ],
+                "subtasks": [
+                    {"key": subtask} for subtask in data.get("subtasks", [])
+                ],
+                "labels": data.get("labels", []),
+            },
+        }
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.split("/")[4]
+        # The client reads these when it connects
+        if endpoint == "serverInfo":
+            return self.send_json({
+                "deploymentType": "Server",
+                "version": "9.12.0",
+                "versionNumbers": [9, 12, 0],
+            })
+        if endpoint == "field":
+            return self.send_json([])
+        FakeJira.requests[endpoint] = FakeJira.requests.get(endpoint, 0) + 1
+        if endpoint == "search":
+            jql = parse_qs(url.query)["jql"][0]
+            issues = [
+                issue for issue in map(self.issue, re.findall(r'"([^"]+)"', jql))
+                if issue is not None
+            ]
+            return self.send_json({
+                "startAt": 0,
+                "maxResults": 50,
+                "total": len(issues),
+                "issues": issues,
+            })
+        if endpoint == "issue":
+            issue = self.issue(url.path.split("/")[5])
+            if issue is not None:
+                return self.send_json(issue)
+        self.send_json({"errorMessages": ["Issue Does Not Exist"]}, 404)
+
+
+class ApprovalResolverTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeJira)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        FakeJira.issues = {
+            "REL-1": {"links": ["MB-1"], "related": ["MB-2"],
+                      "subtasks": ["MB-3"]},
+            "REL-2": {"links": ["MB-4"]},
+            "REL-30": {"links": ["MB-5"]},
+            "MB-6": {"labels": ["doc-change-only"]},
+            "MB-70": {"labels": ["test-change-only"]},
+            "MB-8": {"labels": ["other"]},
+        }
+        FakeJira.moved = {"REL-3": "REL-30", "MB-7": "MB-70"}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmpdir.name, "cache.json")
+        self.jira = JIRA(f"http://127.0.0.1:{self.server.server_port}")
+        FakeJira.requests = {}
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def resolver(self, **kwargs):
+        resolver = ApprovalResolver(self.cache_file, **kwargs)
+        resolver._jira = self.jira
+        return resolver
+
+    def test_single_query(self):
+        resolver = self.resolver()
+        resolver.prefetch(["REL-1", "REL-2"])
+        self.assertEqual(FakeJira.requests, {"search": 1})
+        self.assertEqual(resolver.cache["REL-1"]["approved"],
+                         ["MB-1", "MB-2", "MB-3", "REL-1"])
+        self.assertIsNone(resolver.unapproved_ticket("REL-1", ["MB-3"]))
+        self.assertIsNone(resolver.unapproved_ticket("REL-2", ["MB-4"]))
+        self.assertEqual(FakeJira.requests, {"search": 1})
+
+    def test_moved_approval_ticket(self):
+        resolver = self.resolver()
+        resolver.prefetch(["REL-1", "REL-3"])
+        self.assertEqual(resolver.cache["REL-3"]["approved"],
+                         ["MB-5", "REL-3"])
+        self.assertEqual(FakeJira.requests, {"search": 1, "issue": 1})
+
+    def test_missing_approval_ticket(self):
+        with self.assertRaisesRegex(Exception, "'REL-9' not found"):
+            self.resolver().prefetch(["REL-1", "REL-9"])
+
+    def test_bypass(self):
+        resolver = self.resolver()
+        self.assertEqual(
+            resolver.unapproved_ticket(
+                "REL-1", ["MB-1", "MB-6", "MB-7", "MB-8"]),
+            "MB-8")
+        self.assertEqual(resolver.bypass, {
+            "MB-6": True, "MB-7": True, "MB-8": False})
+        # No such ticket, so no bypass labels
+        self.assertEqual(resolver.unapproved_ticket("REL-1", ["MB-9"]), "MB-9")
+
+    def test_cache(self):
+        self.resolver().prefetch(["REL-1", "REL-2"])
+        FakeJira.requests = {}
+
+        # Fresh cached approvals are used without asking Jira
+        resolver = self.resolver()
+        self.assertIsNone(resolver.unapproved_ticket("REL-1", ["MB-1"]))
+        self.assertEqual(FakeJira.requests, {})
+
+        # but are re-read before rejecting a ticket
+        self.assertEqual(resolver.unapproved_ticket("REL-2", ["MB-8"]), "MB-8")
+        self.assertEqual(FakeJira.requests, {"search": 2})
+
+        # and expired ones are read again
+        FakeJira.requests = {}
+        resolver = self.resolver(ttl=0)
+        self.assertIsNone(resolver.unapproved_ticket("REL-1", ["MB-1"]))
+        self.assertEqual(FakeJira.requests, {"search": 1})
+
+    def test_invalidate(self):
+        resolver = self.resolver()
+        resolver.prefetch(["REL-1", "REL-2"])
+        resolver.invalidate("REL-1")
+        with open(self.cache_file) as f:
+            self.assertEqual(list(json.load(f)), ["REL-2"])
+        resolver.invalidate()
+        with open(self.cache_file) as f:
+            self.assertEqual(json.load(f), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+"""
+Checks and a benchmark of the restricted branch index against a fixture
+manifest repository created in a temporary directory.
+
+Run the checks with "python3 -m unittest" or pytest from this directory.
+Running "python3 test_restriction_index.py" replays a stream of 1,000
+change events (or those in --events, one "PROJECT BRANCH" per line),
+looking up each one both by scanning every manifest and with the index,
+and compares the latency of the two.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+import unittest
+
+import restricted_branch_check
+from manifest_util import scan_manifests
+from restriction_index import get_restricted_manifests, load_restriction_index
+
+GIT_ENV = dict(
+    os.environ,
+    GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+    GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com",
+)
+
+BRANCHES = ["master", "trinity", "morpheus", "7.2.x", "7.1.x", "neo"]
+
+
+def make_manifest_repo(path, products=10, releases=6, projects=150):
+    """
+    Creates a manifest repository with a product-config.json per product,
+    each listing a manifest per release building every project from the
+    release's branch. The manifests of all but the first release are
+    restricted, and each product leaves one project unrestricted.
+    """
+    os.makedirs(path)
+    for p in range(products):
+        product = f"product{p}"
+        config = {"manifests": {}}
+        for r, branch in enumerate(BRANCHES[:releases]):
+            manifest_path = f"{product}/{branch}.xml"
+            meta = {"release": branch}
+            if r > 0:
+                meta.update({
+                    "restricted": True,
+                    "approval_ticket": f"REL-{p * 100 + r}",
+                    "unrestricted_projects": [f"project{p}"],
+                })
+                if r > 1:
+                    meta["parent"] = f"{product}/{BRANCHES[r - 1]}.xml"
+            config["manifests"][manifest_path] = meta
+            lines = [
+                "<manifest>",
+                '  <remote name="couchbase" fetch="ssh://git@github.com/couchbase/"/>',
+                f'  <default remote="couchbase" branch="{branch}"/>',
+                '  <project name="build" path="cbbuild">',
+                '    <annotation name="VERSION" value="1.0.0"/>',
+                "  </project>",
+            ]
+            for i in range(projects):
+                # Some projects are built from master in every release
+                revision = ' revision="master"' if i % 7 == 0 else ""
+                lines.append(f'  <project name="project{i}"{revision}/>')
+            lines.append("</manifest>")
+            os.makedirs(os.path.join(path, product), exist_ok=True)
+            with open(os.path.join(path, manifest_path), "w") as f:
+                f.write("\n".join(lines) + "\n")
+        with open(os.path.join(path, product, "product-config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+    subprocess.run(["git", "init", "--quiet", path], check=True)
+    subprocess.run(["git", "-C", path, "add", "-A"], check=True)
+    subprocess.run(["git", "-C", path, "commit", "--quiet", "-m", "fixture"],
+                   check=True, env=GIT_ENV)
+
+
+def make_events(count, projects=150, seed=0):
+    """
+    Returns a repeatable stream of (project, branch) change events
+    """
+    rand = random.Random(seed)
+    return [
+        (f"project{rand.randrange(projects + 10)}", rand.choice(BRANCHES))
+        for _ in range(count)
+    ]
+
+
+def scan_lookup(manifest_repo, project, branch):
+    """
+    Finds the restricted manifests building project from branch as
+    restricted_branch_check does with --no-index
+    """
+    restricted_branch_check.PROJECT = project
+    restricted_branch_check.BRANCH = branch
+    manifests = scan_manifests(manifest_repo)
+    return restricted_branch_check.find_restricted_manifests(manifests)
+
+
+def index_lookup(manifest_repo, index_file, project, branch):
+    """
+    Finds the restricted manifests building project from branch as
+    restricted_branch_check does by default
+    """
+    index = load_restriction_index(manifest_repo, index_file)
+    return get_restricted_manifests(index, project, branch)
+
+
+class RestrictionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.manifest_repo = os.path.join(self.tmpdir.name, "manifest")
+        self.index_file = os.path.join(self.tmpdir.name, "index.json")
+        make_manifest_repo(self.manifest_repo, products=3, projects=20)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def lookup(self, project, branch):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return index_lookup(
+                self.manifest_repo, self.index_file, project, branch)
+
+    def test_matches_scan(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for project, branch in make_events(200, projects=20):
+                self.assertEqual(
+                    sorted(scan_lookup(self.manifest_repo, project, branch)),
+                    sorted(index_lookup(self.manifest_repo, self.index_file,
+                                        project, branch)),
+                    f"{project} {branch}")
+
+    def test_lookup(self):
+        self.assertEqual(
+            sorted(self.lookup("project1", "trinity")),
+            ["product0/trinity.xml", "product2/trinity.xml"])
+        # Built from master by the restricted manifests of every product
+        self.assertEqual(len(self.lookup("project7", "master")), 15)
+        # Only built from master by the unrestricted manifests
+        self.assertEqual(self.lookup("project1", "master"), [])
+        self.assertEqual(self.lookup("nosuchproject", "trinity"), [])
+
+    def test_rebuilt_when_head_moves(self):
+        self.lookup("project1", "trinity")
+        with open(self.index_file) as f:
+            head = json.load(f)["head"]
+
+        config_file = os.path.join(
+            self.manifest_repo, "product0", "product-config.json")
+        with open(config_file) as f:
+            config = json.load(f)
+        del config["manifests"]["product0/trinity.xml"]["restricted"]
+        with open(config_file, "w") as f:
+            json.dump(config, f)
+        subprocess.run(["git", "-C", self.manifest_repo, "commit", "--quiet",
+                        "-am", "unrestrict"], check=True, env=GIT_ENV)
+
+        self.assertEqual(self.lookup("project1", "trinity"),
+                         ["product2/trinity.xml"])
+        with open(self.index_file) as f:
+            self.assertNotEqual(json.load(f)["head"], head)
+
+    def test_corrupt_index(self):
+        with open(self.index_file, "w") as f:
+            f.write('{"head": ')
+        self.assertEqual(len(self.lookup("project1", "trinity")), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark restricted branch lookups against a fixture")
+    parser.add_argument("--events", type=argparse.FileType("r"),
+                        help="File of 'PROJECT BRANCH' events to replay")
+    parser.add_argument("--count", type=int, default=1000,
+                        help="Number of events to generate without --events")
+    args = parser.parse_args()
+
+    if args.events:
+        events = [tuple(line.split()) for line in args.events if line.strip()]
+    else:
+        events = make_events(args.count)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        manifest_repo = os.path.join(tmpdir, "manifest")
+        index_file = os.path.join(tmpdir, "index.json")
+        make_manifest_repo(manifest_repo)
+
+        timings = {}
+        for name, lookup in [
+            ("scan", lambda p, b: scan_lookup(manifest_repo, p, b)),
+            ("index", lambda p, b: index_lookup(
+                manifest_repo, index_file, p, b)),
+        ]:
+            latencies = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                for project, branch in events:
+                    start = time.perf_counter()
+                    lookup(project, branch)
+                    latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            timings[name] = latencies
+
+    print(f"Replayed {len(events)} events")
+    for name, latencies in timings.items():
+        print(f"{name:>6}: total {sum(latencies):.2f}s, "
+              f"median {latencies[len(latencies) // 2] * 1000:.2f}ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,168 @@
 #!/usr/bin/env python3.6
 
-# Simple program to take a set of files on AWS S3, download them,
-# calculate their MD5 sums, and re-upload them with the sum included
-# in their metadata
-
+# Simple program to take a set of files on AWS S3, determine their MD5
+# sums, and add the sum to their metadata.
+#
+# For objects uploaded in a single part, the ETag already is the MD5 sum.
+# Multipart objects are hashed by streaming their contents with ranged
+# GETs. The metadata is then applied with an in-place server-side copy,
+# so nothing is re-uploaded. Objects are processed concurrently, and each
+# completed key is recorded in a checkpoint file so an interrupted run can
+# be resumed.
+
+import argparse
 import hashlib
-import os
 import sys
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 import botocore.exceptions
 
+from boto3.s3.transfer import TransferConfig
+
+
+# Size of each ranged GET when hashing multipart objects
+RANGE_SIZE = 64 * 2 ** 20
+
+# Objects up to this size are copied with a single CopyObject, which keeps
+# a single-part ETag; larger objects can only be copied in parts
+MULTIPART_THRESHOLD = 5 * 1024 ** 3
+
+# Headers which are reset by a metadata-replacing copy unless passed again
+PRESERVED_HEADERS = [
+    'CacheControl',
+    'ContentDisposition',
+    'ContentEncoding',
+    'ContentLanguage',
+    'ContentType',
+]
+
 
-def get_md5(filename):
+def get_md5(bucket, key, size):
     """
-    Generate the MD5 for a given file
+    Generate the MD5 for a given object by streaming it in ranged GETs
     """
 
     hash_md5 = hashlib.md5()
 
-    with open(filename, 'rb') as fh:
-        for chunk in iter(lambda: fh.read(2 ** 20), b''):
+    for start in range(0, size, RANGE_SIZE):
+        end = min(start + RANGE_SIZE, size) - 1
+        body = s3.get_object(
+            Bucket=bucket, Key=key, Range=f'bytes={start}-{end}'
+        )['Body']
+        for chunk in iter(lambda: body.read(2 ** 20), b''):
             hash_md5.update(chunk)
 
     return hash_md5.hexdigest()
 
 
-def add_md5_to_s3(s3_key):
+def add_md5_to_s3(bucket, key, etag, size):
     """
-    Download given file from given bucket, calculate its MD5 hash,
-    then re-upload it with the MD5 in the metadata
+    Determine the MD5 hash of the given object, then copy it over itself
+    with the MD5 in the metadata. Returns True if the object now has MD5
+    metadata.
     """
 
-    filename = s3_key.split('/')[-1]
-
     try:
-        s3_bucket.download_file(s3_key, filename)
+        head = s3.head_object(Bucket=bucket, Key=key)
     except botocore.exceptions.ClientError:
-        print(f'  Unable to retrieve {s3_key} from {s3_bucket}')
-        return
-
-    md5_hash = get_md5(filename)
-    obj = s3.Object(s3_bucket.name, s3_key)
+        print(f'  Unable to retrieve {key} from {bucket}')
+        return False
+
+    metadata = head.get('Metadata', {})
+    if 'md5' in metadata:
+        print(f'  {key} already has MD5 metadata')
+        return True
+
+    # A multipart ETag is "<hash of part hashes>-<part count>", and the
+    # ETag of an object encrypted with SSE-KMS or SSE-C isn't its MD5;
+    # otherwise the ETag is the MD5 of the contents
+    etag = etag.strip('"')
+    encrypted = head.get('ServerSideEncryption', '').startswith('aws:kms') \
+        or 'SSECustomerAlgorithm' in head
+    if '-' in etag or encrypted:
+        try:
+            md5_hash = get_md5(bucket, key, size)
+        except botocore.exceptions.ClientError:
+            print(f'  Unable to retrieve {key} from {bucket}')
+            return False
+    else:
+        md5_hash = etag
+
+    extra_args = {
+        'ACL': 'public-read',
+        'MetadataDirective': 'REPLACE',
+        'Metadata': {**metadata, 'md5': md5_hash},
+    }
+    for header in PRESERVED_HEADERS:
+        if header in head:
+            extra_args[header] = head[header]
 
     try:
-        obj.upload_file(
-            filename,
-            ExtraArgs={'ACL': 'public-read', 'Metadata': {'md5': md5_hash}}
+        # Managed copy, so objects over 5GB are copied in parts
+        s3.copy(
+            {'Bucket': bucket, 'Key': key}, bucket, key,
+            ExtraArgs=extra_args,
+            Config=TransferConfig(multipart_threshold=MULTIPART_THRESHOLD)
         )
     except botocore.exceptions.ClientError:
-        print(f'  Unable to upload {filename} to {s3_bucket} at {s3_key}')
-        return
+        print(f'  Unable to update metadata of {key} in {bucket}')
+        return False
 
-    try:
-        os.remove(filename)
-    except FileNotFoundError:
-        pass
+    print(f'Updated {key} to have MD5 metadata')
+    return True
 
 
-if len(sys.argv) != 3:
-    print(f'Usage: {sys.argv[0]} <S3 bucket> <S3 base path>')
-    sys.exit(1)
+def process(obj):
+    """
+    Add MD5 metadata to an object and record it in the checkpoint file.
+    Returns True on success.
+    """
 
-s3 = boto3.resource('s3')
-s3_bucket = s3.Bucket(sys.argv[1])
-s3_base_path = sys.argv[2]
+    if not add_md5_to_s3(obj.bucket_name, obj.key, obj.e_tag, obj.size):
+        return False
+    with checkpoint_lock:
+        checkpoint.write(f'{obj.key}\n')
+        checkpoint.flush()
+    return True
+
+
+parser = argparse.ArgumentParser(
+    description='Add MD5 sums to the metadata of objects on S3'
+)
+parser.add_argument('bucket', help='S3 bucket')
+parser.add_argument('base_path', help='S3 base path')
+parser.add_argument('-j', '--jobs', type=int, default=16,
+                    help='Number of objects to process concurrently')
+parser.add_argument('--checkpoint', default='add_md5_metadata.checkpoint',
+                    help='File listing completed keys, for resuming')
+args = parser.parse_args()
+
+s3 = boto3.client('s3')
+s3_bucket = boto3.resource('s3').Bucket(args.bucket)
+s3_base_path = args.base_path
 
 if not s3_base_path.endswith('/'):
     s3_base_path += '/'
 
-for obj in s3_bucket.objects.filter(Prefix=s3_base_path):
-    print(f'Updating {obj.key} to have MD5 metadata')
-    add_md5_to_s3(obj.key)
+try:
+    with open(args.checkpoint) as fh:
+        done = set(fh.read().splitlines())
+except FileNotFoundError:
+    done = set()
+
+checkpoint_lock = threading.Lock()
+with open(args.checkpoint, 'a') as checkpoint:
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [
+            executor.submit(process, obj)
+            for obj in s3_bucket.objects.filter(Prefix=s3_base_path)
+            if obj.key not in done
+        ]
+    failures = sum(1 for future in futures if not future.result())
+
+if failures:
+    print(f'{failures} objects could not be updated; re-run to retry them')
+    sys.exit(1)
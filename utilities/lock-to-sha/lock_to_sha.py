@@ -2,8 +2,10 @@
 
 import argparse
 import re
+import subprocess
 import sys
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 
 
@@ -26,8 +28,85 @@ def parse_src_input(input):
 
     return input_lock_src
 
+class RefResolver:
+    """
+    Resolves branch heads directly from the git remotes with `git ls-remote`,
+    for when there is no build manifest to take SHAs from. Each repository
+    is queried once for all the refs needed from it, with several
+    repositories queried at a time, and results are cached per
+    (fetch URL, ref) for the run.
+    """
+
+    def __init__(self, jobs=8):
+        self.jobs = jobs
+        self.cache = {}
+
+    def _ls_remote(self, url, refs):
+        output = subprocess.check_output(
+            ['git', 'ls-remote', url, *sorted(refs)],
+            text=True
+        )
+        shas = {}
+        for line in output.splitlines():
+            sha, ref = line.split('\t', 1)
+            shas[ref] = sha
+        return shas
+
+    def resolve(self, wanted):
+        """
+        Resolve the given refs, a dict of fetch URL to set of refs,
+        returning a dict of (fetch URL, ref) to SHA. Refs which don't
+        exist are left out
+        """
+        missing = {
+            url: {ref for ref in refs if (url, ref) not in self.cache}
+            for url, refs in wanted.items()
+        }
+        missing = {url: refs for url, refs in missing.items() if refs}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = executor.map(
+                lambda item: (item[0], self._ls_remote(*item)),
+                missing.items()
+            )
+            for url, shas in results:
+                for ref in missing[url]:
+                    if ref in shas:
+                        self.cache[(url, ref)] = shas[ref]
+
+        return {
+            (url, ref): self.cache[(url, ref)]
+            for url, refs in wanted.items() for ref in refs
+            if (url, ref) in self.cache
+        }
+
+
+def get_remote_urls(tree):
+    """
+    Returns a dict of remote name to fetch URL, and the name of the
+    default remote
+    """
+    remotes = {
+        remote.get('name'): remote.get('fetch')
+        for remote in tree.iterfind("remote")
+    }
+    default_remote = None
+    default_element = tree.find("default")
+    if default_element is not None:
+        default_remote = default_element.get("remote")
+    return remotes, default_remote
+
+
+def branch_ref(revision):
+    """
+    Returns the full ref name for a manifest revision
+    """
+    if revision.startswith("refs/"):
+        return revision
+    return f"refs/heads/{revision}"
+
+
 def lock_to_sha(args):
-    sha_src_dict = parse_src_input(args.sha_src)
     master_only = args.master_only
 
     # Read input manifest
@@ -50,8 +129,8 @@ def lock_to_sha(args):
     result_dict = tree.iterfind("project")
     sha_regex = re.compile(r'\b([a-f0-9]{40})\b')
 
-    updated_projects = 0
     projects_on_version_branch = 0
+    to_lock = []
     for result in result_dict:
         project = result.get('name')
         path = result.get('path', project)
@@ -90,14 +169,19 @@ def lock_to_sha(args):
         if args.projects is not None and project not in args.projects:
             logging.debug(f"Project {project} not on list of explicit projects")
             continue
-        try:
-            sha = sha_src_dict[path]['revision']
-            result.attrib['revision'] = sha
-            updated_projects += 1
-            logging.info(f"Locking {project} to {sha}")
-        except KeyError as e:
-            logging.fatal(f"Error: {e} {project} not found in \"{args.sha_src}\" input file!")
-            sys.exit(1)
+        to_lock.append((result, project, path, revision))
+
+    if args.sha_src is not None:
+        shas = lookup_src_shas(args.sha_src, to_lock)
+    else:
+        shas = lookup_remote_shas(tree, to_lock, args.jobs)
+
+    updated_projects = 0
+    for result, project, path, revision in to_lock:
+        sha = shas[path]
+        result.attrib['revision'] = sha
+        updated_projects += 1
+        logging.info(f"Locking {project} to {sha}")
 
     # write data
     tree.write(args.output, encoding='UTF-8',
@@ -113,9 +197,66 @@ def lock_to_sha(args):
         logging.warning("manifest unchanged!")
 
 
+def lookup_src_shas(sha_src, to_lock):
+    """
+    Returns a dict of project path to SHA for the projects to lock,
+    taken from a build manifest
+    """
+    sha_src_dict = parse_src_input(sha_src)
+    shas = {}
+    for result, project, path, revision in to_lock:
+        try:
+            shas[path] = sha_src_dict[path]['revision']
+        except KeyError as e:
+            logging.fatal(f"Error: {e} {project} not found in \"{sha_src}\" input file!")
+            sys.exit(1)
+    return shas
+
+
+def lookup_remote_shas(tree, to_lock, jobs):
+    """
+    Returns a dict of project path to SHA for the projects to lock, by
+    resolving the current head of each project's branch on its remote
+    """
+    remotes, default_remote = get_remote_urls(tree)
+
+    # Group the refs needed by remote repository
+    wanted = {}
+    project_refs = {}
+    for result, project, path, revision in to_lock:
+        remote = result.get('remote', default_remote)
+        fetch = remotes.get(remote)
+        if fetch is None or not re.match(r'^[a-z]+://|^[^/]+@', fetch):
+            logging.fatal(
+                f"Error: can't determine fetch URL of remote \"{remote}\" "
+                f"for {project}")
+            sys.exit(1)
+        url = f"{fetch.rstrip('/')}/{project}"
+        ref = branch_ref(revision)
+        wanted.setdefault(url, set()).add(ref)
+        project_refs[path] = (url, ref)
+
+    logging.info(f"Resolving {len(project_refs)} refs from {len(wanted)} repositories")
+    try:
+        resolved = RefResolver(jobs).resolve(wanted)
+    except subprocess.CalledProcessError as e:
+        logging.fatal(f"Error: {e}")
+        sys.exit(1)
+
+    shas = {}
+    for result, project, path, revision in to_lock:
+        url, ref = project_refs[path]
+        try:
+            shas[path] = resolved[(url, ref)]
+        except KeyError:
+            logging.fatal(f"Error: {ref} not found in {url} for {project}!")
+            sys.exit(1)
+    return shas
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Create an updated manifest by locking projects to SHAs sourced from a build manifest"
+        description="Create an updated manifest by locking projects to SHAs sourced from a build manifest, or from the current heads of their branches"
     )
     parser.add_argument(
         '--input',
@@ -124,8 +265,15 @@ def main():
     )
     parser.add_argument(
         '--sha-src',
-        help="Build manifest that has locked SHAs",
-        required=True
+        help="Build manifest that has locked SHAs "
+        "(default: resolve branch heads from the remotes)",
+        required=False
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        help="Number of remotes to query at once when not using --sha-src",
+        default=8
     )
     parser.add_argument(
         '--output',
@@ -0,0 +1,180 @@
+"""
+Checks of locking a manifest to branch heads resolved with "git ls-remote",
+against bare repositories created in a temporary directory and reached
+with file:// URLs. Run with "python3 -m unittest" or pytest from this
+directory.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+from lxml import etree
+
+import lock_to_sha
+from lock_to_sha import RefResolver
+
+VERSION = "7.6.0"
+
+
+def make_bare_repo(path, branches):
+    """
+    Creates a bare repository at path with a commit on each of the given
+    branches, and a tag, returning the SHA of each ref
+    """
+    subprocess.run(["git", "init", "--quiet", "--bare", path], check=True)
+    stream = []
+    for n, branch in enumerate(branches, 1):
+        message = f"Commit on {branch}\n".encode()
+        content = f"{path} {branch}\n".encode()
+        stream += [
+            b"commit refs/heads/%s\n" % branch.encode(),
+            b"mark :%d\n" % n,
+            b"committer test <test@example.com> 1700000000 +0000\n",
+            b"data %d\n%s" % (len(message), message),
+            b"M 100644 inline README\ndata %d\n%s\n" % (len(content), content),
+        ]
+    stream.append(b"reset refs/tags/v1.0.0\nfrom :1\n")
+    subprocess.run(["git", "-C", path, "fast-import", "--quiet"],
+                   input=b"".join(stream), check=True)
+    output = subprocess.run(
+        ["git", "-C", path, "show-ref"],
+        check=True, stdout=subprocess.PIPE, text=True).stdout
+    return {
+        ref: sha for sha, ref in (line.split() for line in output.splitlines())
+    }
+
+
+class LockToShaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+        self.refs = {}
+        for remote, project, branches in [
+            ("couchbase", "kv_engine", ["master", "trinity"]),
+            ("couchbase", "couchstore", ["main"]),
+            ("couchbase", "forestdb", ["master", VERSION]),
+            ("couchbase", "testrunner", ["master"]),
+            ("couchbase", "tlm", ["master"]),
+            ("other", "jemalloc", ["master"]),
+        ]:
+            self.refs[project] = make_bare_repo(
+                os.path.join(self.root, remote, project), branches)
+
+        self.input = os.path.join(self.root, "input.xml")
+        self.output = os.path.join(self.root, "output.xml")
+        kv_tag_sha = self.refs["kv_engine"]["refs/tags/v1.0.0"]
+        with open(self.input, "w") as f:
+            f.write(f"""<manifest>
+  <remote name="couchbase" fetch="file://{self.root}/couchbase/"/>
+  <remote name="other" fetch="file://{self.root}/other"/>
+  <default remote="couchbase" revision="master"/>
+  <project name="build" path="cbbuild" revision="refs/tags/v1.0.0">
+    <annotation name="VERSION" value="{VERSION}"/>
+  </project>
+  <project name="kv_engine" revision="trinity"/>
+  <project name="couchstore" revision="main"/>
+  <project name="forestdb" revision="{VERSION}"/>
+  <project name="testrunner"/>
+  <project name="tlm" revision="{kv_tag_sha}"/>
+  <project name="jemalloc" path="third_party/jemalloc" remote="other"/>
+</manifest>
+""")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_lock(self, *options):
+        """
+        Runs lock-to-sha on the input manifest with the given options,
+        returning the revision of each project in the output. The log
+        messages are kept in self.logs
+        """
+        argv = ["lock-to-sha", "--input", self.input, "--output", self.output,
+                *options]
+        with mock.patch.object(sys, "argv", argv), \
+                self.assertLogs(level="INFO") as self.logs:
+            lock_to_sha.main()
+        tree = etree.parse(self.output)
+        return {
+            project.get("name"): project.get("revision")
+            for project in tree.iterfind("project")
+        }
+
+    def head(self, project, branch):
+        return self.refs[project][f"refs/heads/{branch}"]
+
+    def test_lock(self):
+        revisions = self.run_lock()
+        self.assertEqual(revisions, {
+            # Tags, SHAs, the version branch and skipped projects are
+            # left alone
+            "build": "refs/tags/v1.0.0",
+            "kv_engine": self.head("kv_engine", "trinity"),
+            "couchstore": self.head("couchstore", "main"),
+            "forestdb": VERSION,
+            "testrunner": None,
+            "tlm": self.refs["kv_engine"]["refs/tags/v1.0.0"],
+            "jemalloc": self.head("jemalloc", "master"),
+        })
+
+    def test_master_only(self):
+        revisions = self.run_lock("--master-only")
+        self.assertEqual(revisions["kv_engine"], "trinity")
+        self.assertEqual(revisions["couchstore"], self.head("couchstore", "main"))
+        self.assertEqual(revisions["jemalloc"], self.head("jemalloc", "master"))
+
+    def test_skip_projects(self):
+        revisions = self.run_lock("--skip-projects", "couchstore")
+        self.assertEqual(revisions["couchstore"], "main")
+        # Replacing the default list of skipped projects
+        self.assertEqual(revisions["testrunner"], self.head("testrunner", "master"))
+
+    def test_lock_version_branches(self):
+        revisions = self.run_lock("--lock-version-branches")
+        self.assertEqual(revisions["forestdb"], self.head("forestdb", VERSION))
+
+    def test_missing_branch(self):
+        with open(self.input) as f:
+            manifest = f.read()
+        with open(self.input, "w") as f:
+            f.write(manifest.replace('revision="main"', 'revision="nosuch"'))
+        with self.assertRaises(SystemExit) as cm:
+            self.run_lock()
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("refs/heads/nosuch not found", self.logs.output[-1])
+
+    def test_resolver(self):
+        resolver = RefResolver(jobs=2)
+        kv_engine = f"file://{self.root}/couchbase/kv_engine"
+        forestdb = f"file://{self.root}/couchbase/forestdb"
+        wanted = {
+            kv_engine: {"refs/heads/master", "refs/heads/trinity",
+                        "refs/heads/nosuch"},
+            forestdb: {f"refs/heads/{VERSION}"},
+        }
+        with mock.patch.object(
+                resolver, "_ls_remote", wraps=resolver._ls_remote) as ls_remote:
+            resolved = resolver.resolve(wanted)
+            # One query per repository, with refs which don't exist left out
+            self.assertEqual(ls_remote.call_count, 2)
+            self.assertEqual(resolved, {
+                (kv_engine, "refs/heads/master"): self.head("kv_engine", "master"),
+                (kv_engine, "refs/heads/trinity"): self.head("kv_engine", "trinity"),
+                (forestdb, f"refs/heads/{VERSION}"): self.head("forestdb", VERSION),
+            })
+
+            # Resolved refs are cached; only the missing one is asked again
+            self.assertEqual(resolver.resolve(wanted), resolved)
+            self.assertEqual(ls_remote.call_count, 3)
+            self.assertEqual(ls_remote.call_args.args,
+                             (kv_engine, {"refs/heads/nosuch"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
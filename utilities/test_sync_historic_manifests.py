@@ -0,0 +1,238 @@
+"""
+Checks and a benchmark of sync_historic_manifests against a fixture
+build-manifests repo and project repos created in a temporary directory.
+
+Run the checks with "python3 -m unittest" or pytest from this directory,
+and the benchmark with "python3 test_sync_historic_manifests.py", which
+by default materializes 50 builds from a 5,000 commit build-manifests
+repo referencing 30 project repos.
+"""
+
+import argparse
+import importlib.machinery
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+loader = importlib.machinery.SourceFileLoader(
+    "sync_historic_manifests", str(SCRIPT_DIR / "sync_historic_manifests"))
+spec = importlib.util.spec_from_loader("sync_historic_manifests", loader)
+shm = importlib.util.module_from_spec(spec)
+loader.exec_module(shm)
+
+PRODUCT = "couchbase-server"
+RELEASE = "trinity"
+VERSION = "7.6.0"
+MANIFEST_FILE = f"{PRODUCT}/{RELEASE}/{VERSION}.xml"
+
+FIXTURE_DATE = "1700000000 +0000"
+
+
+def fast_import(path, commits):
+    """
+    Creates a repo at path with a linear history on master, built with a
+    single "git fast-import". commits is a list of (subject, {path:
+    bytes}) of the files each commit changes. Returns the commit SHAs,
+    oldest first.
+    """
+    subprocess.run(["git", "init", "--quiet", "-b", "master", str(path)],
+                   check=True)
+    stream = []
+    for mark, (subject, files) in enumerate(commits, 1):
+        message = subject.encode() + b"\n"
+        stream.append(
+            b"commit refs/heads/master\n"
+            b"mark :%d\n"
+            b"committer test <test@example.com> %s\n"
+            b"data %d\n%s"
+            % (mark, FIXTURE_DATE.encode(), len(message), message))
+        for filename, content in files.items():
+            stream.append(b"M 100644 inline %s\ndata %d\n%s\n"
+                          % (filename.encode(), len(content), content))
+    subprocess.run(["git", "-C", str(path), "fast-import", "--quiet"],
+                   input=b"".join(stream), check=True)
+    subprocess.run(["git", "-C", str(path), "checkout", "--quiet", "-f",
+                    "master"], check=True)
+    return shm.git("-C", str(path), "rev-list", "--reverse", "master",
+                   text=True).split()
+
+
+def project_content(name, rev):
+    return f"{name} revision {rev}\n".encode()
+
+
+def make_fixture(root, commits, repos, revisions=5):
+    """
+    Creates project repos p00, p01... each with a few revisions, the
+    first with a project nested inside it, and a build-manifests repo of
+    commits builds of VERSION whose manifests cycle through the project
+    revisions. Returns the build-manifests URL, and the SHAs of each
+    project's revisions.
+    """
+    names = [f"p{i:02d}" for i in range(repos)]
+    shas = {
+        name: fast_import(root / "repos" / name, [
+            (f"revision {rev}", {
+                "README": project_content(name, rev),
+                "src/main.c": b"int main() { return %d; }\n" % rev,
+            })
+            for rev in range(revisions)
+        ])
+        for name in names
+    }
+
+    manifest_commits = []
+    for bld_num in range(1, commits + 1):
+        projects = []
+        for i, name in enumerate(names):
+            path = name
+            extra = ""
+            if i == 0:
+                extra = '<linkfile src="README" dest="README.link"/>'
+            elif i == 1:
+                # Nested inside the first project
+                path = f"{names[0]}/{name}"
+            sha = shas[name][(bld_num + i) % revisions]
+            projects.append(
+                f'  <project name="{name}" path="{path}" '
+                f'revision="{sha}">{extra}</project>\n')
+        manifest = (
+            "<manifest>\n"
+            f'  <remote name="fixture" fetch="file://{root / "repos"}/"/>\n'
+            '  <default remote="fixture"/>\n'
+            + "".join(projects) +
+            "</manifest>\n"
+        )
+        manifest_commits.append((
+            f"{PRODUCT} {RELEASE} build {VERSION}-{bld_num}",
+            {MANIFEST_FILE: manifest.encode()},
+        ))
+    fast_import(root / "build-manifests", manifest_commits)
+    return f"file://{root / 'build-manifests'}", shas
+
+
+def run(manifests_url, builds, outdir, cache_dir, *options):
+    """
+    Runs sync_historic_manifests on the given build numbers, returning its
+    exit status
+    """
+    builds_file = outdir.parent / "builds.txt"
+    builds_file.write_text("".join(
+        f"{PRODUCT} {RELEASE} {VERSION} {bld_num}\n" for bld_num in builds))
+    argv = ["sync_historic_manifests", str(builds_file),
+            "-o", str(outdir), "-c", str(cache_dir), *options]
+    with mock.patch.object(sys, "argv", argv), \
+            mock.patch.object(shm, "BUILD_MANIFESTS", manifests_url):
+        try:
+            shm.main()
+        except SystemExit as e:
+            return e.code
+    return 0
+
+
+class SyncHistoricManifestsTest(unittest.TestCase):
+
+    REPOS = 4
+    REVISIONS = 3
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.root = Path(cls.tmpdir.name)
+        cls.manifests_url, cls.shas = make_fixture(
+            cls.root, 20, cls.REPOS, cls.REVISIONS)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(dir=self.root))
+        self.outdir = self.workdir / "out"
+        self.cache_dir = self.workdir / "cache"
+
+    def check_build(self, bld_num):
+        """
+        Checks each project of a build is checked out at the revision its
+        manifest locks it to
+        """
+        builddir = self.outdir / f"{PRODUCT}-{VERSION}-{bld_num}"
+        for i, name in enumerate(sorted(self.shas)):
+            path = builddir / name if i != 1 else builddir / "p00" / name
+            self.assertEqual(
+                (path / "README").read_bytes(),
+                project_content(name, (bld_num + i) % self.REVISIONS))
+        self.assertEqual(
+            (builddir / "README.link").read_bytes(),
+            (builddir / "p00" / "README").read_bytes())
+        self.assertIn(
+            f"BLD_NUM={bld_num}\n",
+            (builddir / "build.properties").read_text())
+
+    def test_export(self):
+        self.assertEqual(
+            run(self.manifests_url, [3, 7], self.outdir, self.cache_dir), 0)
+        self.check_build(3)
+        self.check_build(7)
+
+    def test_worktree_rerun(self):
+        # The second run removes and re-adds the same worktrees
+        for bld_num in [5, 5, 6]:
+            self.assertEqual(
+                run(self.manifests_url, [bld_num], self.outdir,
+                    self.cache_dir, "--worktree"), 0)
+            self.check_build(bld_num)
+
+    def test_unknown_build(self):
+        self.assertEqual(
+            run(self.manifests_url, [2, 999], self.outdir, self.cache_dir), 1)
+        self.check_build(2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark sync_historic_manifests against a fixture")
+    parser.add_argument("--commits", type=int, default=5000,
+                        help="Number of commits in build-manifests")
+    parser.add_argument("--repos", type=int, default=30,
+                        help="Number of project repos")
+    parser.add_argument("--builds", type=int, default=50,
+                        help="Number of builds to materialize")
+    parser.add_argument("--worktree", action="store_true",
+                        help="Materialize builds as worktrees")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = Path(tmpdir)
+        start = time.monotonic()
+        manifests_url, _ = make_fixture(root, args.commits, args.repos)
+        print(f"Created fixture in {time.monotonic() - start:.1f}s")
+
+        step = max(args.commits // args.builds, 1)
+        builds = list(range(1, args.commits + 1, step))[:args.builds]
+        options = ["--worktree"] if args.worktree else []
+        timings = []
+        for attempt in ["cold cache", "warm cache"]:
+            outdir = root / "out"
+            start = time.monotonic()
+            status = run(manifests_url, builds, outdir, root / "cache",
+                         *options)
+            timings.append(
+                f"{attempt}: {time.monotonic() - start:.1f}s "
+                f"(exit status {status})")
+        print(f"\nMaterialized {len(builds)} builds of {args.repos} "
+              f"projects from {args.commits} commits")
+        print("\n".join(timings))
+
+
+if __name__ == "__main__":
+    main()